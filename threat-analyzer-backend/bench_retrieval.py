@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Benchmark des backends de recherche vectorielle (chroma vs numpy)
+Compare le temps de construction, la latence des requêtes et la mémoire
+
+Usage : python bench_retrieval.py --rows 50000 --queries 200 --k 10
+        --backends numpy,numpy:float16,numpy:int8,chroma
+(numpy:<type> = stockage quantifié sur disque, relu en mémoire mappée)
+"""
+import argparse
+import gc
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from rag.build_kb import load_threat_rows, render_threat_document
+from rag.embedding_model import encode, get_memory_report
+from rag.vector_backends import get_backend
+
+SAMPLE_QUERIES = [
+    "Application web avec authentification et base de données MySQL",
+    "Application mobile iOS Android stockage local OAuth",
+    "API REST GraphQL rate limiting authentification",
+    "Microservices Kubernetes Kafka Redis",
+    "Stockage cloud S3 Firebase données sensibles",
+]
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def prepare_embeddings(csv_path: str, rows: int):
+    """
+    Encode le CSV une fois puis le réplique (avec un léger bruit) jusqu'à `rows` lignes
+    """
+    documents = [render_threat_document(row) for row in load_threat_rows(csv_path)]
+    base = np.asarray(encode(documents), dtype=np.float32)
+
+    rng = np.random.default_rng(42)
+    repeats = max(1, -(-rows // len(base)))
+    embeddings = np.tile(base, (repeats, 1))[:rows]
+    embeddings = embeddings + rng.normal(0, 0.01, embeddings.shape).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    documents = [documents[i % len(documents)] for i in range(rows)]
+    return documents, embeddings
+
+def bench_backend(name: str, documents, embeddings, query_embeddings, k: int, batch_size: int):
+    gc.collect()
+    rss_before = get_memory_report()["process_rss_mb"]
+
+    backend_name, _, vector_dtype = name.partition(":")
+    persist_dir = tempfile.mkdtemp(prefix="bench_kb_") if vector_dtype else ""
+    client = get_backend(persist_dir, backend_name=backend_name, vector_dtype=vector_dtype or None)
+    collection = client.create_collection(name=f"bench_{backend_name}")
+
+    t0 = time.perf_counter()
+    ids = [str(i) for i in range(len(documents))]
+    for start in range(0, len(documents), batch_size):
+        collection.add(
+            ids=ids[start:start + batch_size],
+            embeddings=embeddings[start:start + batch_size].tolist(),
+            documents=documents[start:start + batch_size]
+        )
+    if vector_dtype:
+        collection.persist()
+    build_seconds = time.perf_counter() - t0
+
+    # Première requête hors mesure (initialisation paresseuse)
+    collection.query(query_embeddings=[query_embeddings[0]], n_results=k)
+
+    latencies = []
+    for query_embedding in query_embeddings:
+        t0 = time.perf_counter()
+        collection.query(query_embeddings=[query_embedding], n_results=k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    gc.collect()
+    rss_after = get_memory_report()["process_rss_mb"]
+    client.delete_collection(name=f"bench_{backend_name}")
+
+    return {
+        "backend": name,
+        "build_s": round(build_seconds, 2),
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p95_ms": round(_percentile(latencies, 95), 3),
+        "mean_ms": round(statistics.mean(latencies), 3),
+        "rss_delta_mb": round(rss_after - rss_before, 1) if rss_before and rss_after else None
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chroma vs numpy")
+    parser.add_argument("--csv", default="Données.csv")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--backends", default="numpy,numpy:int8,chroma")
+    args = parser.parse_args()
+
+    print(f"Préparation de {args.rows} embeddings...")
+    documents, embeddings = prepare_embeddings(args.csv, args.rows)
+
+    queries = [SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)] + f" #{i}" for i in range(args.queries)]
+    query_embeddings = encode(queries).tolist()
+
+    results = []
+    for name in args.backends.split(","):
+        print(f"Backend {name}...")
+        results.append(bench_backend(name.strip(), documents, embeddings, query_embeddings, args.k, args.batch_size))
+
+    print()
+    print(f"{'backend':<14} {'build_s':>8} {'p50_ms':>8} {'p95_ms':>8} {'mean_ms':>8} {'rss_mb':>8}")
+    for r in results:
+        print(f"{r['backend']:<14} {r['build_s']:>8} {r['p50_ms']:>8} {r['p95_ms']:>8} {r['mean_ms']:>8} {str(r['rss_delta_mb']):>8}")
+
+if __name__ == "__main__":
+    main()
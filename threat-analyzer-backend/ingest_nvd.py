@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Alimente le miroir local de la NVD à partir des flux NVD JSON 2.0
+(https://nvd.nist.gov/vuln/data-feeds : nvdcve-2.0-<année>.json.gz,
+nvdcve-2.0-modified.json.gz). Relancer la commande met à jour les CVE existantes,
+puis reconstruit l'index CWE -> CVE (meilleures CVE par CWE, CVSS puis date).
+
+Usage : python ingest_nvd.py feeds/            (tous les nvdcve-2.0-*.json[.gz] du dossier)
+        python ingest_nvd.py nvdcve-2.0-2024.json.gz nvdcve-2.0-modified.json.gz --db nvd_mirror.sqlite3
+"""
+import argparse
+import glob
+import os
+import time
+
+from services.nvd_mirror import NVD_CWE_INDEX_TOP_N, NVD_MIRROR_PATH, NVDMirror, iter_feed_records
+
+def collect_feed_files(paths):
+    """
+    Fichiers à charger ; les flux annuels sont triés et "modified" passe en dernier
+    (ses versions des CVE remplacent celles des flux annuels)
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(glob.glob(os.path.join(path, "nvdcve-2.0-*.json")))
+            files.extend(glob.glob(os.path.join(path, "nvdcve-2.0-*.json.gz")))
+        else:
+            files.append(path)
+    return sorted(set(files), key=lambda f: ("modified" in os.path.basename(f), "recent" in os.path.basename(f), f))
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestion des flux NVD JSON 2.0 dans le miroir local")
+    parser.add_argument("paths", nargs="+", help="fichiers de flux ou dossiers les contenant")
+    parser.add_argument("--db", default=NVD_MIRROR_PATH, help="base SQLite du miroir (NVD_MIRROR_PATH)")
+    parser.add_argument("--top-n", type=int, default=NVD_CWE_INDEX_TOP_N,
+                        help="CVE conservées par CWE dans l'index (NVD_CWE_INDEX_TOP_N)")
+    args = parser.parse_args()
+
+    files = collect_feed_files(args.paths)
+    if not files:
+        print("Aucun fichier de flux NVD trouvé")
+        exit(1)
+
+    mirror = NVDMirror(args.db)
+    start = time.perf_counter()
+    for path in files:
+        file_start = time.perf_counter()
+        count = mirror.ingest(iter_feed_records(path), source=os.path.basename(path))
+        print(f"✓ {os.path.basename(path)} : {count} CVE ({time.perf_counter() - file_start:.1f}s)")
+    indexed = mirror.build_cwe_index(args.top_n)
+    print(f"✓ Index CWE -> CVE : {indexed} CWE ({args.top_n} CVE au plus par CWE)")
+    mirror.optimize()
+
+    stats = mirror.stats()
+    print(f"\nMiroir {args.db} : {stats['cves']} CVE, {stats['cwes']} CWE "
+          f"(dernière modification {stats['latest_modification']}) en {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
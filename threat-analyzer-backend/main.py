@@ -1,18 +1,35 @@
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Optional
+import asyncio
+import hashlib
+import hmac
 import json
 import io
 import os
+import tempfile
 
 from pypdf import PdfReader
 
-from rag.build_kb import build_vector_db
-from rag.query_kb import search_threats
-from services.llm_service import analyze_with_claude
-from services.langchain_service import analyze_with_langchain
-from services.nvd_service import enrich_threat_with_cve
+from rag.build_kb import build_vector_db, last_build_report, load_threat_rows, sync_vector_db, delete_threat_rows, kb_write_lock
+from rag.query_kb import search_threats, get_query_cache_stats, get_retrieval_stats
+from rag.embedding_model import warm_up, get_memory_report
+from rag.kb_metadata import detect_app_platform, build_platform_filter
+from rag.multi_query import retrieve_multi_query
+from services.llm_service import analyze_with_claude_async, stream_claude_async, parse_response, build_prompt
+from services.langchain_service import analyze_with_langchain_async
+from services.llm_cache import get_llm_cache_stats, clear_llm_cache
+from services.http_pool import get_pool_stats
+from services.json_stream import StreamingArrayParser
+from services.llm_policy import LLMExecutionPolicy
+from services.json_repair import get_repair_stats
+from services.singleflight import SingleFlight, make_flight_key
+from services.prompt_assembler import assemble_prompt, estimate_tokens, last_prompt_report
+from services.nvd_service import NVD_SOURCE
+from services.nvd_async import enrich_menaces_with_cves, get_enrichment_stats
+from services.nvd_mirror import get_nvd_mirror
+from services.cve_cache import get_cve_cache_stats, clear_cve_cache
 from services.storage_service import save_analysis, init_database
 from services.auth_service import register_user, login_user, get_user_by_id
 from services.standards_comparison import enrich_threat_with_standards
@@ -20,6 +37,7 @@ from services.risk_score_service import calculate_risk_score
 from services.dashboard_adapter import adapt_for_dashboard
 from services.pdf_report_service import generate_pdf_report
 from services.mitre_service import enrich_threat_with_metadata
+from services.mitre_catalog import get_mitre_catalog, MITRE_ATTACK_BUNDLE
 from services.validation_metrics import calculate_average_confidence, calculate_coverage_metrics, calculate_precision_recall
 from parsers.c4_parser import parse_c4_text, extract_architecture_from_c4
 from parsers.uml_parser import parse_uml_text, extract_architecture_from_uml, parse_xmi_content
@@ -39,7 +57,38 @@ app.add_middleware(
 )
 
 # Construction de la base vectorielle UNE SEULE FOIS
-vector_db = build_vector_db("Données.csv")
+KB_CSV_PATH = "Données.csv"
+vector_db = build_vector_db(KB_CSV_PATH)
+
+# Préchargement du modèle d'embedding pour que la première analyse n'en paie pas le coût
+if os.getenv("EMBEDDING_WARMUP", "true").lower() == "true":
+    warm_up()
+
+# Catalogue MITRE ATT&CK (bundle STIX local, relu depuis son cache) chargé au démarrage
+mitre_catalog = get_mitre_catalog()
+if mitre_catalog is not None:
+    print(f"✓ Catalogue MITRE ATT&CK : {len(mitre_catalog)} techniques ({mitre_catalog.load_seconds * 1000:.0f} ms)")
+
+# Nombre de menaces retournées par la recherche RAG (contexte envoyé au LLM)
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "8"))
+
+# Au-delà de cette longueur (caractères), l'architecture est recherchée en plusieurs sous-requêtes
+MULTI_QUERY_MIN_CHARS = int(os.getenv("MULTI_QUERY_MIN_CHARS", "1000"))
+
+# Analyses identiques simultanées regroupées en une seule exécution
+analysis_flights = SingleFlight()
+
+# Taille du gabarit de prompt (hors contexte RAG et entrée utilisateur)
+PROMPT_TEMPLATE_TOKENS = estimate_tokens(build_prompt("", ""))
+
+# Exécution des analyses IA : hedging et circuit breaker entre les deux chemins
+llm_policy = LLMExecutionPolicy([
+    ("langchain", analyze_with_langchain_async),
+    ("claude", analyze_with_claude_async)
+])
+
+# Jeton requis par les endpoints d'administration (non défini = endpoints refusés)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
 
 # -----------------------------------
 # Endpoint health check
@@ -48,6 +97,214 @@ vector_db = build_vector_db("Données.csv")
 def health():
     return {"status": "ok", "message": "Backend is running"}
 
+# -----------------------------------
+# Endpoints d'administration de la base de connaissances
+# -----------------------------------
+def check_admin_token(token: Optional[str]):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Endpoints d'administration désactivés (ADMIN_TOKEN non défini)")
+    # Comparaison en temps constant
+    if not token or not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Jeton d'administration invalide")
+
+@app.post("/admin/kb/sync")
+def admin_sync_kb(
+    file: Optional[UploadFile] = File(None),
+    x_admin_token: Optional[str] = Header(None)
+):
+    """
+    Synchronise la base vectorielle avec le CSV des menaces
+    Si un CSV est fourni, il remplace Données.csv avant la synchronisation
+    Seules les lignes nouvelles ou modifiées sont ré-encodées
+    """
+    check_admin_token(x_admin_token)
+    try:
+        # Remplacement du CSV et synchronisation sous le même verrou : aucun autre
+        # worker ne lit (hash) Données.csv pendant son remplacement
+        with kb_write_lock():
+            if file:
+                # Fichier temporaire propre à la requête, à côté du CSV (os.replace atomique)
+                fd, tmp_path = tempfile.mkstemp(
+                    dir=os.path.dirname(os.path.abspath(KB_CSV_PATH)), suffix=".upload"
+                )
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        f.write(file.file.read())
+                    # Valider le fichier avant de remplacer le catalogue
+                    load_threat_rows(tmp_path)
+                    # mkstemp crée le fichier en 0600 : on conserve les droits du CSV actuel
+                    if os.path.exists(KB_CSV_PATH):
+                        os.chmod(tmp_path, os.stat(KB_CSV_PATH).st_mode & 0o777)
+                    os.replace(tmp_path, KB_CSV_PATH)
+                except Exception:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+
+            report = sync_vector_db(vector_db, KB_CSV_PATH)
+        return {"status": "success", "report": report}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+@app.get("/admin/kb/stats")
+def admin_kb_stats(x_admin_token: Optional[str] = Header(None)):
+    """
+    Statistiques de la base vectorielle : dernière construction et caches de recherche
+    """
+    check_admin_token(x_admin_token)
+    return {
+        "documents": vector_db.count(),
+        "build": last_build_report,
+        "query_cache": get_query_cache_stats(),
+        "retrieval_latency": get_retrieval_stats()
+    }
+
+@app.get("/admin/kb/model")
+def admin_model_report(x_admin_token: Optional[str] = Header(None)):
+    """
+    Rapport mémoire du modèle d'embedding partagé
+    """
+    check_admin_token(x_admin_token)
+    return get_memory_report()
+
+@app.post("/admin/kb/upsert")
+def admin_upsert_kb(
+    rows: str = Form(...),  # JSON avec la liste des lignes (chaque ligne doit avoir un "id")
+    x_admin_token: Optional[str] = Header(None)
+):
+    """
+    Ajoute ou met à jour des lignes de la base vectorielle sans supprimer les autres
+    Les lignes ne sont pas écrites dans Données.csv : la base est marquée comme
+    modifiée (conservée au redémarrage tant que le CSV ne change pas, écartée par /admin/kb/sync)
+    """
+    check_admin_token(x_admin_token)
+    try:
+        with kb_write_lock():
+            report = sync_vector_db(vector_db, json.loads(rows), delete_missing=False)
+        return {"status": "success", "report": report}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+@app.post("/admin/kb/delete")
+def admin_delete_kb(
+    ids: str = Form(...),  # JSON avec la liste des identifiants à supprimer
+    x_admin_token: Optional[str] = Header(None)
+):
+    """
+    Supprime des lignes de la base vectorielle (sans modifier Données.csv :
+    la base est marquée comme modifiée, comme pour /admin/kb/upsert)
+    """
+    check_admin_token(x_admin_token)
+    try:
+        with kb_write_lock():
+            report = delete_threat_rows(vector_db, json.loads(ids))
+        return {"status": "success", "report": report}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+@app.get("/admin/llm/cache")
+def admin_llm_cache_stats(x_admin_token: Optional[str] = Header(None)):
+    """
+    Statistiques du cache des réponses LLM (hits, misses, évictions...)
+    """
+    check_admin_token(x_admin_token)
+    return get_llm_cache_stats()
+
+@app.post("/admin/llm/cache/clear")
+def admin_clear_llm_cache(x_admin_token: Optional[str] = Header(None)):
+    """
+    Vide le cache des réponses LLM
+    """
+    check_admin_token(x_admin_token)
+    clear_llm_cache()
+    return {"status": "success"}
+
+@app.get("/admin/llm/pool")
+def admin_llm_pool_stats(x_admin_token: Optional[str] = Header(None)):
+    """
+    Statistiques du pool de connexions HTTP partagé par les clients LLM
+    """
+    check_admin_token(x_admin_token)
+    return get_pool_stats()
+
+@app.get("/admin/llm/policy")
+def admin_llm_policy_stats(x_admin_token: Optional[str] = Header(None)):
+    """
+    Latences, erreurs, hedging et état des circuit breakers par chemin LLM
+    """
+    check_admin_token(x_admin_token)
+    return llm_policy.stats()
+
+@app.get("/admin/llm/prompt")
+def admin_prompt_report(x_admin_token: Optional[str] = Header(None)):
+    """
+    Tokens par section du dernier prompt assemblé (budget, RAG, architecture, fichier)
+    """
+    check_admin_token(x_admin_token)
+    return last_prompt_report
+
+@app.get("/admin/llm/repair")
+def admin_json_repair_stats(x_admin_token: Optional[str] = Header(None)):
+    """
+    Fréquence des réparations du JSON retourné par les LLM (texte autour, virgules, troncature)
+    """
+    check_admin_token(x_admin_token)
+    return get_repair_stats()
+
+@app.get("/admin/analyze/coalescing")
+def admin_coalescing_stats(x_admin_token: Optional[str] = Header(None)):
+    """
+    Analyses exécutées et requêtes identiques regroupées (single-flight)
+    """
+    check_admin_token(x_admin_token)
+    return analysis_flights.stats()
+
+@app.get("/admin/nvd/mirror")
+def admin_nvd_mirror_stats(x_admin_token: Optional[str] = Header(None)):
+    """
+    État du miroir local de la NVD (CVE chargées, flux ingérés)
+    """
+    check_admin_token(x_admin_token)
+    mirror = get_nvd_mirror()
+    if mirror is None:
+        return {"source": NVD_SOURCE, "available": False}
+    return {"source": NVD_SOURCE, "available": True, **mirror.stats()}
+
+@app.get("/admin/nvd/cache")
+def admin_cve_cache_stats(x_admin_token: Optional[str] = Header(None)):
+    """
+    Statistiques du cache des recherches CVE (hits, résultats expirés servis, erreurs...)
+    """
+    check_admin_token(x_admin_token)
+    return get_cve_cache_stats()
+
+@app.post("/admin/nvd/cache/clear")
+def admin_clear_cve_cache(x_admin_token: Optional[str] = Header(None)):
+    """
+    Vide le cache des recherches CVE (mémoire et disque)
+    """
+    check_admin_token(x_admin_token)
+    clear_cve_cache()
+    return {"status": "success"}
+
+@app.get("/admin/nvd/enrichment")
+def admin_nvd_enrichment_stats(x_admin_token: Optional[str] = Header(None)):
+    """
+    Enrichissement CVE : recherches dédupliquées, appels NVD, nouvelles tentatives, limiteur de débit
+    """
+    check_admin_token(x_admin_token)
+    return get_enrichment_stats()
+
+@app.get("/admin/mitre/catalog")
+def admin_mitre_catalog_stats(x_admin_token: Optional[str] = Header(None)):
+    """
+    Catalogue MITRE ATT&CK local : version, nombre de techniques, source et temps de chargement
+    """
+    check_admin_token(x_admin_token)
+    if mitre_catalog is None:
+        return {"available": False, "bundle": MITRE_ATTACK_BUNDLE}
+    return {"available": True, **mitre_catalog.stats()}
+
 # -----------------------------------
 # Endpoints d'authentification
 # -----------------------------------
@@ -132,275 +389,383 @@ async def get_user(user_id: str):
 # -----------------------------------
 # Endpoint principal : Analyse
 # -----------------------------------
-@app.post("/analyze")
-async def analyze_project(
-    project_name: str = Form(...),
-    app_type: str = Form(...),
-    architecture_description: str = Form(...),
-    file: Optional[UploadFile] = File(None),
-    user_id: Optional[str] = Form(None)
-):
-    try:
-        file_content = ""
+def enrich_menace_metadata(menace: dict) -> dict:
+    """
+    Enrichissement local et immédiat d'une menace (métadonnées MITRE, standards)
+    """
+    enriched_menace = enrich_threat_with_metadata(menace)
+    return enrich_threat_with_standards(enriched_menace)
 
-        # -------------------------------
-        # Lecture du fichier uploadé
-        # -------------------------------
-        c4_architecture = None
-        if file:
-            if file.filename.endswith(".json"):
-                content = await file.read()
-                file_content = json.dumps(json.loads(content), indent=2)
-                # Essayer de parser comme C4 si c'est un fichier de diagramme
-                try:
-                    json_data = json.loads(content)
-                    if isinstance(json_data, dict) and ('components' in json_data or 'systems' in json_data):
-                        c4_architecture = extract_architecture_from_c4(json_data)
-                except:
-                    pass
-
-            elif file.filename.endswith(".pdf"):
-                pdf_bytes = await file.read()
-                reader = PdfReader(io.BytesIO(pdf_bytes))
-                for page in reader.pages:
-                    file_content += page.extract_text() or ""
-                # Essayer de parser le texte comme C4
-                if file_content:
-                    c4_data = parse_c4_text(file_content)
-                    if c4_data.get('components'):
-                        c4_architecture = extract_architecture_from_c4(c4_data)
-
-            elif file.filename.endswith((".md", ".txt", ".c4")):
-                content = await file.read()
-                file_content = content.decode('utf-8')
-                # Essayer de parser comme C4
-                c4_data = parse_c4_text(file_content)
-                if c4_data.get('components'):
-                    c4_architecture = extract_architecture_from_c4(c4_data)
-                else:
-                    # Essayer de parser comme UML
-                    uml_data = parse_uml_text(file_content)
-                    if uml_data.get('classes') or uml_data.get('actors'):
-                        c4_architecture = extract_architecture_from_uml(uml_data)
-            
-            elif file.filename.endswith((".xmi", ".xml")):
-                # Parser comme UML XMI
-                content = await file.read()
-                file_content = content.decode('utf-8')
-                
-                # Essayer d'abord le parsing XMI (format standard)
-                uml_data = parse_xmi_content(file_content)
-                
-                # Si le parsing XMI n'a rien donné, essayer le parsing texte
-                if not uml_data or (not uml_data.get('classes') and not uml_data.get('actors') and not uml_data.get('use_cases') and not uml_data.get('relations')):
-                    uml_data = parse_uml_text(file_content)
-                
-                if uml_data and (uml_data.get('classes') or uml_data.get('actors') or uml_data.get('use_cases') or uml_data.get('relations')):
-                    c4_architecture = extract_architecture_from_uml(uml_data)
-
-            else:
-                file_content = "Format non supporté"
-        
-        # Si on a une architecture C4, l'ajouter à la description
-        if c4_architecture:
-            architecture_description = f"{architecture_description}\n\nArchitecture extraite du diagramme:\n{c4_architecture}"
+async def enrich_menaces(menaces: list) -> list:
+    """
+    Enrichit les menaces retournées par l'IA (métadonnées MITRE, standards, CVE NVD)
+    """
+    return await attach_cves([enrich_menace_metadata(menace) for menace in menaces])
 
-        # -------------------------------
-        # RAG : recherche des menaces
-        # -------------------------------
-        # Construire une requête plus spécifique selon le type d'application
-        app_type_lower = app_type.lower()
-        if "mobile" in app_type_lower or "ios" in app_type_lower or "android" in app_type_lower:
-            rag_query = f"""
-Application mobile iOS/Android : {app_type}
-Architecture mobile : {architecture_description}
-Menaces spécifiques aux applications mobiles, stockage local, certificate pinning, OAuth mobile
-"""
-        elif "web" in app_type_lower or "site" in app_type_lower:
-            rag_query = f"""
-Application web : {app_type}
-Architecture web : {architecture_description}
-Menaces spécifiques aux applications web, SQL injection, XSS, authentification web
-"""
-        elif "api" in app_type_lower or "rest" in app_type_lower or "graphql" in app_type_lower:
-            rag_query = f"""
-API REST/GraphQL : {app_type}
-Architecture API : {architecture_description}
-Menaces spécifiques aux APIs, accès non autorisé API, rate limiting, authentification API
-"""
-        else:
-            rag_query = f"""
-Application : {app_type}
-Architecture : {architecture_description}
-"""
+async def attach_cves(menaces: list) -> list:
+    """
+    Ajoute les CVE NVD liées aux menaces (recherches concurrentes, ignorées en cas d'erreur)
+    """
+    try:
+        return await enrich_menaces_with_cves(menaces)
+    except Exception as e:
+        print(f"Erreur enrichissement CVE: {e}")
+        # Continuer sans CVE si erreur
+        return menaces
 
-        # Augmenter le nombre de résultats pour avoir plus de contexte, puis Claude filtrera
-        relevant_threats = search_threats(vector_db, rag_query, k=10)
-        
-        # Filtrage préliminaire selon le type d'application
-        filtered_threats = []
-        app_type_lower = app_type.lower()
+def parse_uploaded_file(filename: str, content: bytes):
+    """
+    Extrait le texte du fichier fourni ; retourne (contenu texte, architecture extraite C4/UML ou None)
+    """
+    file_content = ""
+    c4_architecture = None
+    if filename.endswith(".json"):
+        file_content = json.dumps(json.loads(content), indent=2)
+        # Essayer de parser comme C4 si c'est un fichier de diagramme
+        try:
+            json_data = json.loads(content)
+            if isinstance(json_data, dict) and ('components' in json_data or 'systems' in json_data):
+                c4_architecture = extract_architecture_from_c4(json_data)
+        except:
+            pass
+
+    elif filename.endswith(".pdf"):
+        reader = PdfReader(io.BytesIO(content))
+        for page in reader.pages:
+            file_content += page.extract_text() or ""
+        # Essayer de parser le texte comme C4
+        if file_content:
+            c4_data = parse_c4_text(file_content)
+            if c4_data.get('components'):
+                c4_architecture = extract_architecture_from_c4(c4_data)
+
+    elif filename.endswith((".md", ".txt", ".c4")):
+        file_content = content.decode('utf-8')
+        # Essayer de parser comme C4
+        c4_data = parse_c4_text(file_content)
+        if c4_data.get('components'):
+            c4_architecture = extract_architecture_from_c4(c4_data)
+        else:
+            # Essayer de parser comme UML
+            uml_data = parse_uml_text(file_content)
+            if uml_data.get('classes') or uml_data.get('actors'):
+                c4_architecture = extract_architecture_from_uml(uml_data)
+    
+    elif filename.endswith((".xmi", ".xml")):
+        # Parser comme UML XMI
+        file_content = content.decode('utf-8')
         
-        for threat in relevant_threats:
-            threat_lower = threat.lower()
-            # Pour applications mobiles : garder seulement les menaces mobiles, ignorer les menaces web explicites
-            if "mobile" in app_type_lower or "ios" in app_type_lower or "android" in app_type_lower:
-                # Ignorer les menaces qui mentionnent explicitement "web" ou "serveur web" sauf si elles mentionnent aussi "mobile"
-                if ("application web" in threat_lower or "serveur web" in threat_lower) and "mobile" not in threat_lower:
-                    continue
-                # Garder les menaces qui mentionnent mobile, iOS, Android, ou qui sont génériques (API, backend)
-                if any(keyword in threat_lower for keyword in ["mobile", "ios", "android", "api", "backend", "oauth", "s3", "firebase"]):
-                    filtered_threats.append(threat)
-                elif "application web" not in threat_lower:
-                    # Garder les menaces génériques qui ne sont pas spécifiquement web
-                    filtered_threats.append(threat)
-            # Pour applications web : garder seulement les menaces web, ignorer les menaces mobiles explicites
-            elif "web" in app_type_lower or "site" in app_type_lower:
-                # Ignorer les menaces qui mentionnent explicitement "mobile", "ios", "android" sauf si elles mentionnent aussi "web"
-                if ("mobile" in threat_lower or "ios" in threat_lower or "android" in threat_lower) and "web" not in threat_lower:
-                    continue
-                filtered_threats.append(threat)
-            # Pour APIs : garder les menaces API et backend, ignorer les menaces UI
-            elif "api" in app_type_lower or "rest" in app_type_lower or "graphql" in app_type_lower:
-                # Ignorer les menaces spécifiques aux interfaces utilisateur
-                if ("application web" in threat_lower or "application mobile" in threat_lower) and "api" not in threat_lower:
-                    continue
-                filtered_threats.append(threat)
-            else:
-                # Pour les autres types, garder tout
-                filtered_threats.append(threat)
+        # Essayer d'abord le parsing XMI (format standard)
+        uml_data = parse_xmi_content(file_content)
         
-        # Si le filtrage a supprimé trop de résultats, garder au moins les 5 premiers
-        if len(filtered_threats) < 3:
-            filtered_threats = relevant_threats[:5]
+        # Si le parsing XMI n'a rien donné, essayer le parsing texte
+        if not uml_data or (not uml_data.get('classes') and not uml_data.get('actors') and not uml_data.get('use_cases') and not uml_data.get('relations')):
+            uml_data = parse_uml_text(file_content)
         
-        rag_context = "\n\n".join(filtered_threats)
+        if uml_data and (uml_data.get('classes') or uml_data.get('actors') or uml_data.get('use_cases') or uml_data.get('relations')):
+            c4_architecture = extract_architecture_from_uml(uml_data)
 
-        # -------------------------------
-        # Entrée utilisateur
-        # -------------------------------
-        user_input = f"""
-Nom du projet : {project_name}
-Type d'application : {app_type}
-Architecture : {architecture_description}
+    else:
+        file_content = "Format non supporté"
+
+    return file_content, c4_architecture
+
+async def read_uploaded_file(file: Optional[UploadFile]):
+    """
+    Lit le fichier fourni ; retourne (contenu texte, architecture extraite C4/UML ou None)
+    """
+    if not file:
+        return "", None
+    content = await file.read()
+    return await asyncio.to_thread(parse_uploaded_file, file.filename, content)
 
-Fichier fourni :
-{file_content}
+async def retrieve_rag_threats(app_type: str, architecture_description: str) -> list:
+    """
+    Recherche RAG des menaces du catalogue pertinentes pour l'architecture
+    """
+    # Construire une requête plus spécifique selon le type d'application
+    platform = detect_app_platform(app_type)
+    if platform == "mobile":
+        rag_header = f"Application mobile iOS/Android : {app_type}"
+        rag_architecture_label = "Architecture mobile"
+        rag_focus = "Menaces spécifiques aux applications mobiles, stockage local, certificate pinning, OAuth mobile"
+    elif platform == "web":
+        rag_header = f"Application web : {app_type}"
+        rag_architecture_label = "Architecture web"
+        rag_focus = "Menaces spécifiques aux applications web, SQL injection, XSS, authentification web"
+    elif platform == "api":
+        rag_header = f"API REST/GraphQL : {app_type}"
+        rag_architecture_label = "Architecture API"
+        rag_focus = "Menaces spécifiques aux APIs, accès non autorisé API, rate limiting, authentification API"
+    else:
+        rag_header = f"Application : {app_type}"
+        rag_architecture_label = "Architecture"
+        rag_focus = ""
+
+    rag_query = f"""
+{rag_header}
+{rag_architecture_label} : {architecture_description}
+{rag_focus}
 """
 
-        # -------------------------------
-        # Analyse IA (avec LangChain si disponible, sinon Claude direct)
-        # -------------------------------
-        try:
-            # Essayer avec LangChain d'abord (meilleure orchestration)
-            analysis = analyze_with_langchain(
-                rag_context=rag_context,
-                user_input=user_input
-            )
-            # Si erreur, fallback sur Claude direct
-            if "error" in analysis:
-                analysis = analyze_with_claude(
-                    rag_context=rag_context,
-                    user_input=user_input
-                )
-        except Exception as e:
-            # Fallback sur Claude direct en cas d'erreur
-            print(f"Erreur LangChain, fallback sur Claude: {e}")
-            analysis = analyze_with_claude(
-                rag_context=rag_context,
-                user_input=user_input
+    def retrieve_threats(where=None):
+        # Les longues architectures (diagrammes C4/UML) dépassent la fenêtre du modèle
+        # d'embedding : une sous-requête par groupe de composants/relations, fusionnées
+        if len(architecture_description) > MULTI_QUERY_MIN_CHARS:
+            return retrieve_multi_query(
+                vector_db,
+                architecture_description,
+                k=RAG_TOP_K,
+                where=where,
+                context=f"{rag_header}\n{rag_focus}".strip()
             )
+        return search_threats(vector_db, rag_query, k=RAG_TOP_K, where=where)
 
-        # Sécurité si l'IA retourne une erreur
-        if "error" in analysis:
-            return {
-                "project": project_name,
-                "error": analysis.get("error"),
-                "score_risque": 0,
-                "dashboard": {},
-                "analysis": {"menaces": []}
-            }
+    # Le filtrage par type d'application est fait dans l'index (métadonnées de plateforme) :
+    # seules les menaces pertinentes sont évaluées et retournées.
+    # L'encodage et la recherche sont synchrones : exécutés dans un thread
+    # pour ne pas bloquer l'event loop
+    filtered_threats = await asyncio.to_thread(retrieve_threats, build_platform_filter(app_type))
+    
+    # Si le filtre est trop restrictif, compléter avec la recherche non filtrée
+    if len(filtered_threats) < 3:
+        filtered_threats = await asyncio.to_thread(retrieve_threats)
 
-        # -------------------------------
-        # Enrichissement des menaces avec métadonnées
-        # -------------------------------
-        enriched_menaces = []
-        for menace in analysis.get("menaces", []):
-            enriched_menace = enrich_threat_with_metadata(menace)
-            
-            # Enrichir avec CVE depuis NVD
-            try:
-                cves = enrich_threat_with_cve(
-                    threat_name=enriched_menace.get("nom", ""),
-                    cwe_id=enriched_menace.get("cwe_id", "")
-                )
-                if cves:
-                    enriched_menace["cves"] = cves
-            except Exception as e:
-                print(f"Erreur enrichissement CVE: {e}")
-                # Continuer sans CVE si erreur
-            
-            # Enrichir avec comparaison standards
-            enriched_menace = enrich_threat_with_standards(enriched_menace)
-            
-            enriched_menaces.append(enriched_menace)
-        
-        analysis["menaces"] = enriched_menaces
+    return filtered_threats
 
-        # -------------------------------
-        # Score + Dashboard
-        # -------------------------------
-        risk_score = calculate_risk_score(analysis.get("menaces", []))
+def build_prompt_inputs(threats: list, project_name: str, app_type: str,
+                        architecture_description: str, file_content: str):
+    """
+    Contexte RAG compact et entrée utilisateur tenant dans le budget de tokens
+    """
+    rag_context, user_input, report = assemble_prompt(
+        threats, project_name, app_type, architecture_description, file_content,
+        template_tokens=PROMPT_TEMPLATE_TOKENS
+    )
+    print(
+        f"Prompt {project_name}: {report['total']}/{report['budget']} tokens "
+        f"(RAG {report['rag_context']}, architecture {report['architecture']}, fichier {report['file']})"
+    )
+    return rag_context, user_input
+
+def build_analysis_result(project_name: str, user_id: Optional[str], app_type: str,
+                          architecture_description: str, analysis: dict) -> dict:
+    """
+    Score de risque, dashboard, métriques de validation et sauvegarde d'une analyse enrichie
+    """
+    risk_score = calculate_risk_score(analysis.get("menaces", []))
+
+    dashboard_data = adapt_for_dashboard(
+        project_name=project_name,
+        analysis=analysis,
+        score_risque=risk_score
+    )
+    
+    # Calculer métriques de validation
+    avg_confidence = calculate_average_confidence(analysis.get("menaces", []))
+    coverage_metrics = calculate_coverage_metrics(analysis.get("menaces", []))
+    
+    # Ajouter les métriques au dashboard
+    dashboard_data["metriques"] = {
+        "score_confiance_moyen": avg_confidence,
+        "couverture": coverage_metrics
+    }
 
-        dashboard_data = adapt_for_dashboard(
+    # Sauvegarder dans la base de données
+    try:
+        init_database()
+        analysis_id = save_analysis(
             project_name=project_name,
-            analysis=analysis,
-            score_risque=risk_score
+            user_id=user_id,
+            app_type=app_type,
+            architecture_description=architecture_description,
+            dashboard=dashboard_data,
+            analysis=analysis
         )
-        
-        # Calculer métriques de validation
-        avg_confidence = calculate_average_confidence(enriched_menaces)
-        coverage_metrics = calculate_coverage_metrics(enriched_menaces)
-        
-        # Ajouter les métriques au dashboard
-        dashboard_data["metriques"] = {
-            "score_confiance_moyen": avg_confidence,
-            "couverture": coverage_metrics
-        }
+    except Exception as e:
+        print(f"Erreur lors de la sauvegarde: {e}")
+        # Continuer même si la sauvegarde échoue
 
-        # Sauvegarder dans la base de données
-        try:
-            init_database()
-            analysis_id = save_analysis(
-                project_name=project_name,
-                user_id=user_id,
-                app_type=app_type,
-                architecture_description=architecture_description,
-                dashboard=dashboard_data,
-                analysis=analysis
-            )
-        except Exception as e:
-            print(f"Erreur lors de la sauvegarde: {e}")
-            # Continuer même si la sauvegarde échoue
+    return {
+        "project": project_name,
+        "score_risque": risk_score.get("score", 0),
+        "dashboard": dashboard_data,
+        "analysis": analysis
+    }
 
-        return {
-            "project": project_name,
-            "score_risque": risk_score.get("score", 0),
-            "dashboard": dashboard_data,
-            "analysis": analysis
-        }
+def analysis_error(project_name: str, error: str) -> dict:
+    return {
+        "project": project_name,
+        "error": error,
+        "score_risque": 0,
+        "dashboard": {},
+        "analysis": {"menaces": []}
+    }
+
+def analysis_request_key(project_name: str, app_type: str, architecture_description: str,
+                         filename: Optional[str], file_bytes: bytes) -> str:
+    """
+    Clé de regroupement des analyses identiques : champs du projet normalisés et
+    empreinte du fichier (l'utilisateur n'en fait pas partie, la sauvegarde reste par requête)
+    """
+    return make_flight_key(
+        " ".join(project_name.split()),
+        " ".join(app_type.split()).lower(),
+        " ".join(architecture_description.split()),
+        filename or "",
+        hashlib.sha256(file_bytes).hexdigest() if file_bytes else ""
+    )
+
+async def run_analysis_pipeline(project_name: str, app_type: str, architecture_description: str,
+                                filename: Optional[str], file_bytes: bytes) -> dict:
+    """
+    Fichier -> RAG -> IA -> enrichissement ; retourne {"analysis", "architecture_description"}
+    ou {"error"}. Partagé par les requêtes identiques simultanées (voir analysis_flights)
+    """
+    # -------------------------------
+    # Lecture du fichier uploadé
+    # -------------------------------
+    file_content, c4_architecture = "", None
+    if filename:
+        file_content, c4_architecture = await asyncio.to_thread(parse_uploaded_file, filename, file_bytes)
+    
+    # Si on a une architecture C4, l'ajouter à la description
+    if c4_architecture:
+        architecture_description = f"{architecture_description}\n\nArchitecture extraite du diagramme:\n{c4_architecture}"
+
+    # -------------------------------
+    # RAG : recherche des menaces
+    # -------------------------------
+    threats = await retrieve_rag_threats(app_type, architecture_description)
+
+    # -------------------------------
+    # Entrée utilisateur (prompt dans le budget de tokens)
+    # -------------------------------
+    rag_context, user_input = build_prompt_inputs(
+        threats, project_name, app_type, architecture_description, file_content
+    )
+
+    # -------------------------------
+    # Analyse IA : LangChain en principal, Claude direct en secours
+    # (lancé en parallèle si LangChain dépasse son p95, ou dès son échec)
+    # -------------------------------
+    analysis = await llm_policy.run(rag_context, user_input)
+
+    # Sécurité si l'IA retourne une erreur
+    if "error" in analysis:
+        return {"error": analysis.get("error")}
+
+    # -------------------------------
+    # Enrichissement des menaces avec métadonnées
+    # -------------------------------
+    analysis["menaces"] = await enrich_menaces(analysis.get("menaces", []))
+
+    return {"analysis": analysis, "architecture_description": architecture_description}
+
+@app.post("/analyze")
+async def analyze_project(
+    project_name: str = Form(...),
+    app_type: str = Form(...),
+    architecture_description: str = Form(...),
+    file: Optional[UploadFile] = File(None),
+    user_id: Optional[str] = Form(None)
+):
+    try:
+        filename = file.filename if file else None
+        file_bytes = await file.read() if file else b""
+
+        # Les requêtes identiques simultanées attendent la même exécution du pipeline
+        key = analysis_request_key(project_name, app_type, architecture_description, filename, file_bytes)
+        outcome = await analysis_flights.do(
+            key,
+            lambda: run_analysis_pipeline(project_name, app_type, architecture_description, filename, file_bytes)
+        )
+        if "error" in outcome:
+            return analysis_error(project_name, outcome["error"])
+
+        # -------------------------------
+        # Score + Dashboard (et sauvegarde pour cet utilisateur), hors event loop
+        # -------------------------------
+        return await asyncio.to_thread(
+            build_analysis_result,
+            project_name, user_id, app_type, outcome["architecture_description"], outcome["analysis"]
+        )
     
     except Exception as e:
         print(f"Erreur dans /analyze: {str(e)}")
         import traceback
         traceback.print_exc()
-        return {
-            "project": project_name,
-            "error": f"Erreur serveur: {str(e)}",
-            "score_risque": 0,
-            "dashboard": {},
-            "analysis": {"menaces": []}
-        }
+        return analysis_error(project_name, f"Erreur serveur: {str(e)}")
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/analyze/stream")
+async def analyze_project_stream(
+    project_name: str = Form(...),
+    app_type: str = Form(...),
+    architecture_description: str = Form(...),
+    file: Optional[UploadFile] = File(None),
+    user_id: Optional[str] = Form(None)
+):
+    """
+    Variante SSE de /analyze : chaque menace est envoyée (événement "menace"),
+    enrichie MITRE/standards, dès que le modèle a fini de la générer ;
+    l'événement final "summary" contient le même résultat que /analyze
+    (CVE, score de risque, dashboard). En cas d'échec : événement "error".
+    """
+    # Le fichier est lu avant le début du flux (il est fermé ensuite)
+    try:
+        file_content, c4_architecture = await read_uploaded_file(file)
+        if c4_architecture:
+            architecture_description = f"{architecture_description}\n\nArchitecture extraite du diagramme:\n{c4_architecture}"
+        threats = await retrieve_rag_threats(app_type, architecture_description)
+        rag_context, user_input = build_prompt_inputs(
+            threats, project_name, app_type, architecture_description, file_content
+        )
+    except Exception as e:
+        print(f"Erreur dans /analyze/stream: {str(e)}")
+        error_event = sse_event("error", analysis_error(project_name, f"Erreur serveur: {str(e)}"))
+        return StreamingResponse(iter([error_event]), media_type="text/event-stream")
+
+    async def events():
+        parser = StreamingArrayParser("menaces")
+        menaces = []
+        try:
+            # Flux Claude direct sous le circuit breaker de la politique (repli sans streaming)
+            async for text in llm_policy.stream("claude", stream_claude_async, rag_context, user_input):
+                for menace in parser.feed(text):
+                    menace = enrich_menace_metadata(menace)
+                    menaces.append(menace)
+                    yield sse_event("menace", menace)
+
+            analysis = parse_response(parser.text)
+            if "error" in analysis:
+                yield sse_event("error", analysis_error(project_name, analysis.get("error")))
+                return
+
+            # Menaces non extraites au fil de l'eau (ne devrait pas arriver si le JSON est valide)
+            if len(menaces) < len(analysis.get("menaces", [])):
+                for menace in analysis["menaces"][len(menaces):]:
+                    menace = enrich_menace_metadata(menace)
+                    menaces.append(menace)
+                    yield sse_event("menace", menace)
+
+            # CVE (appels NVD) puis score, dashboard et sauvegarde
+            analysis["menaces"] = await attach_cves(menaces)
+            result = await asyncio.to_thread(
+                build_analysis_result, project_name, user_id, app_type, architecture_description, analysis
+            )
+            yield sse_event("summary", result)
+        except Exception as e:
+            print(f"Erreur dans /analyze/stream: {str(e)}")
+            yield sse_event("error", analysis_error(project_name, f"Erreur serveur: {str(e)}"))
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # -----------------------------------
 # Endpoint PDF
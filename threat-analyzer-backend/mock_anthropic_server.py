@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Serveur local imitant l'API Messages d'Anthropic (POST /v1/messages)
+Permet de tester /analyze en charge sans crédit API et de reproduire des
+latences hors ligne. Les deux services LLM l'utilisent via ANTHROPIC_BASE_URL.
+
+Modes :
+- canned : réponse JSON de menaces fixe (--response pour un fichier personnalisé)
+- record : relaie les requêtes vers l'API réelle et enregistre les réponses
+           (texte, usage, durées) dans la cassette
+- replay : rejoue les réponses de la cassette (requête absente -> erreur 404)
+
+Latence avant le premier token et débit de génération (--latency, --token-rate) :
+  fixed:V  |  uniform:MIN,MAX  |  normal:MOYENNE,ECART  |  lognormal:MEDIANE,SIGMA
+  (latence en ms, débit en tokens/s ; en replay, "recorded" rejoue les durées enregistrées)
+
+Usage :
+  python mock_anthropic_server.py --port 8765 --latency lognormal:800,0.4 --token-rate normal:80,15
+  python mock_anthropic_server.py --mode record --cassette cassettes/analyze.json
+  python mock_anthropic_server.py --mode replay --cassette cassettes/analyze.json --latency recorded
+puis : ANTHROPIC_BASE_URL=http://127.0.0.1:8765 uvicorn main:app
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHARS_PER_TOKEN = 3.5
+
+CANNED_ANALYSIS = {
+    "niveau_global": "Élevé",
+    "menaces": [
+        {
+            "nom": "SQL Injection",
+            "gravite": "Critique",
+            "description": "Injection SQL via les paramètres des formulaires et de l'API, permettant la lecture ou la modification de la base de données.",
+            "recommandations": [
+                "Utiliser des requêtes préparées pour tous les accès à la base",
+                "Valider et normaliser toutes les entrées utilisateur côté serveur",
+                "Déployer un WAF devant les points d'entrée exposés"
+            ],
+            "cwe_id": "CWE-89",
+            "cvss_score": "9.8",
+            "mitre_attack_id": "T1190",
+            "owasp_category": "A03:2021",
+            "score_confiance": 0.9
+        },
+        {
+            "nom": "Broken Authentication",
+            "gravite": "Élevée",
+            "description": "Mécanismes d'authentification faibles permettant la compromission de comptes (absence de MFA, mots de passe faibles).",
+            "recommandations": [
+                "Implémenter l'authentification multifacteur",
+                "Hacher les mots de passe avec bcrypt ou Argon2",
+                "Limiter les tentatives de connexion"
+            ],
+            "cwe_id": "CWE-287",
+            "cvss_score": "9.8",
+            "mitre_attack_id": "T1078",
+            "owasp_category": "A07:2021",
+            "score_confiance": 0.85
+        },
+        {
+            "nom": "Cross-Site Scripting (XSS)",
+            "gravite": "Moyenne",
+            "description": "Injection de scripts malveillants via les champs de saisie, menant au vol de session.",
+            "recommandations": [
+                "Encoder toutes les sorties HTML",
+                "Mettre en place une Content Security Policy stricte",
+                "Valider les entrées utilisateur"
+            ],
+            "cwe_id": "CWE-79",
+            "cvss_score": "6.1",
+            "mitre_attack_id": "T1059",
+            "owasp_category": "A03:2021",
+            "score_confiance": 0.8
+        }
+    ]
+}
+
+class Distribution:
+    """
+    Tirage d'une valeur selon une spécification "type:paramètres"
+    """
+
+    def __init__(self, spec: str):
+        self.spec = spec
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",") if p]
+
+    def sample(self) -> float:
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return random.uniform(self.params[0], self.params[1])
+        if self.kind == "normal":
+            return max(0.0, random.gauss(self.params[0], self.params[1]))
+        if self.kind == "lognormal":
+            return random.lognormvariate(math.log(self.params[0]), self.params[1])
+        raise ValueError(f"Distribution inconnue: {self.spec}")
+
+def estimate_tokens(text: str) -> int:
+    return max(1, math.ceil(len(text) / CHARS_PER_TOKEN)) if text else 0
+
+def request_key(body: dict) -> str:
+    """
+    Clé de cassette : champs de la requête qui déterminent la réponse (stream exclu)
+    """
+    relevant = {name: body.get(name) for name in ("model", "system", "messages", "max_tokens", "temperature")}
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+class Cassette:
+    """
+    Réponses enregistrées (fichier JSON : clé -> réponse), écriture atomique
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def get(self, key: str):
+        return self.entries.get(key)
+
+    def put(self, key: str, entry: dict):
+        with self._lock:
+            self.entries[key] = entry
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.path)
+
+class MockState:
+    def __init__(self, args):
+        self.mode = args.mode
+        self.upstream = args.upstream.rstrip("/")
+        self.cassette = Cassette(args.cassette) if args.cassette else None
+        self.latency = None if args.latency == "recorded" else Distribution(args.latency)
+        self.token_rate = None if args.token_rate == "recorded" else Distribution(args.token_rate)
+        self.chunk_tokens = args.chunk_tokens
+        if args.response:
+            with open(args.response, "r", encoding="utf-8") as f:
+                self.canned_text = f.read()
+        else:
+            self.canned_text = json.dumps(CANNED_ANALYSIS, ensure_ascii=False, indent=2)
+        self.counters = {"requests": 0, "streamed": 0, "replayed": 0, "recorded": 0, "missing": 0, "upstream_errors": 0}
+        self._lock = threading.Lock()
+
+    def count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+def forward_upstream(state: MockState, body: dict, headers) -> dict:
+    """
+    Mode record : envoie la requête (sans streaming) à l'API réelle
+    """
+    payload = dict(body)
+    payload.pop("stream", None)
+    request = urllib.request.Request(
+        f"{state.upstream}/v1/messages",
+        data=json.dumps(payload).encode("utf-8"),
+        headers={
+            "content-type": "application/json",
+            "x-api-key": headers.get("x-api-key") or os.getenv("ANTHROPIC_API_KEY", ""),
+            "anthropic-version": headers.get("anthropic-version") or "2023-06-01"
+        },
+        method="POST"
+    )
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=600) as response:
+        message = json.loads(response.read())
+    total_ms = (time.perf_counter() - start) * 1000
+
+    text = "".join(block.get("text", "") for block in message.get("content", []) if block.get("type") == "text")
+    usage = message.get("usage", {})
+    output_tokens = usage.get("output_tokens") or estimate_tokens(text)
+    return {
+        "text": text,
+        "usage": usage,
+        "stop_reason": message.get("stop_reason", "end_turn"),
+        "total_ms": round(total_ms, 1),
+        # Sans streaming en amont : durée répartie avec un premier token estimé à 10 %
+        "ttft_ms": round(total_ms * 0.1, 1),
+        "tokens_per_s": round(output_tokens / max(total_ms * 0.9 / 1000, 1e-3), 1)
+    }
+
+class MessagesHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: MockState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int, error_type: str, message: str):
+        self._send_json(status, {"type": "error", "error": {"type": error_type, "message": message}})
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._send_json(200, {"mode": self.state.mode, **self.state.counters})
+        else:
+            self._send_error(404, "not_found_error", "Not found")
+
+    def do_POST(self):
+        if not self.path.startswith("/v1/messages"):
+            self._send_error(404, "not_found_error", f"Endpoint non simulé: {self.path}")
+            return
+
+        state = self.state
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        state.count("requests")
+
+        entry = self._resolve(body)
+        if entry is None:
+            return
+
+        if state.mode == "record":
+            # Réponse déjà attendue en amont : renvoyée sans latence simulée supplémentaire
+            ttft_ms, tokens_per_s = 0.0, 1e9
+        else:
+            ttft_ms = entry.get("ttft_ms", 0) if state.latency is None else state.latency.sample()
+            tokens_per_s = entry.get("tokens_per_s", 50) if state.token_rate is None else state.token_rate.sample()
+            tokens_per_s = max(tokens_per_s, 1.0)
+
+        if body.get("stream"):
+            state.count("streamed")
+            self._stream(body, entry, ttft_ms, tokens_per_s)
+        else:
+            output_tokens = estimate_tokens(entry["text"])
+            time.sleep(ttft_ms / 1000 + output_tokens / tokens_per_s)
+            self._send_json(200, self._message(body, entry, entry["text"]))
+
+    def _resolve(self, body: dict):
+        state = self.state
+        if state.mode == "canned":
+            return {"text": state.canned_text}
+
+        key = request_key(body)
+        if state.mode == "replay":
+            entry = state.cassette.get(key) if state.cassette else None
+            if entry is None:
+                state.count("missing")
+                self._send_error(404, "not_found_error", f"Requête absente de la cassette ({key[:12]})")
+            else:
+                state.count("replayed")
+            return entry
+
+        try:
+            entry = forward_upstream(state, body, self.headers)
+        except urllib.error.HTTPError as e:
+            # Erreur de l'API transmise telle quelle ; corps non JSON (proxy) : erreur au format de l'API
+            state.count("upstream_errors")
+            raw_error = e.read()
+            try:
+                self._send_json(e.code, json.loads(raw_error or b"{}"))
+            except json.JSONDecodeError:
+                self._send_error(502, "api_error", f"Réponse amont non JSON (HTTP {e.code})")
+            return None
+        except (urllib.error.URLError, OSError) as e:
+            # API injoignable, délai dépassé
+            state.count("upstream_errors")
+            self._send_error(502, "api_error", f"API amont injoignable: {e}")
+            return None
+        except json.JSONDecodeError:
+            state.count("upstream_errors")
+            self._send_error(502, "api_error", "Réponse amont non JSON")
+            return None
+        state.cassette.put(key, entry)
+        state.count("recorded")
+        return entry
+
+    def _message(self, body: dict, entry: dict, text: str) -> dict:
+        usage = entry.get("usage") or {}
+        return {
+            "id": f"msg_mock_{uuid.uuid4().hex[:16]}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "mock"),
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": entry.get("stop_reason", "end_turn"),
+            "stop_sequence": None,
+            "usage": {
+                "input_tokens": usage.get("input_tokens") or estimate_tokens(json.dumps(body.get("messages", []), ensure_ascii=False)),
+                "output_tokens": usage.get("output_tokens") or estimate_tokens(text)
+            }
+        }
+
+    def _write_event(self, event: str, data: dict):
+        chunk = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+        self.wfile.write(b"%x\r\n" % len(chunk) + chunk + b"\r\n")
+        self.wfile.flush()
+
+    def _stream(self, body: dict, entry: dict, ttft_ms: float, tokens_per_s: float):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        text = entry["text"]
+        message = self._message(body, entry, "")
+        message["stop_reason"] = None
+        message["usage"]["output_tokens"] = 1
+        self._write_event("message_start", {"type": "message_start", "message": message})
+        self._write_event("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+        time.sleep(ttft_ms / 1000)
+
+        chunk_chars = max(1, int(self.state.chunk_tokens * CHARS_PER_TOKEN))
+        for start in range(0, len(text), chunk_chars):
+            piece = text[start:start + chunk_chars]
+            self._write_event("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": piece}})
+            time.sleep(estimate_tokens(piece) / tokens_per_s)
+
+        self._write_event("content_block_stop", {"type": "content_block_stop", "index": 0})
+        self._write_event("message_delta", {
+            "type": "message_delta",
+            "delta": {"stop_reason": entry.get("stop_reason", "end_turn"), "stop_sequence": None},
+            "usage": {"output_tokens": estimate_tokens(text)}
+        })
+        self._write_event("message_stop", {"type": "message_stop"})
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serveur local imitant l'API Messages d'Anthropic")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--mode", choices=["canned", "record", "replay"], default="canned")
+    parser.add_argument("--cassette", default="", help="Fichier JSON des réponses enregistrées (record/replay)")
+    parser.add_argument("--response", default="", help="Fichier texte de la réponse du mode canned")
+    parser.add_argument("--upstream", default="https://api.anthropic.com", help="API réelle (mode record)")
+    parser.add_argument("--latency", default="lognormal:800,0.3", help="Latence avant le premier token (ms)")
+    parser.add_argument("--token-rate", default="normal:80,10", help="Débit de génération (tokens/s)")
+    parser.add_argument("--chunk-tokens", type=int, default=4, help="Tokens par événement de streaming")
+    parser.add_argument("--seed", type=int, default=None, help="Graine des tirages (benchmarks reproductibles)")
+    args = parser.parse_args()
+
+    if args.mode in ("record", "replay") and not args.cassette:
+        parser.error("--cassette est obligatoire en mode record/replay")
+    if args.mode != "replay" and "recorded" in (args.latency, args.token_rate):
+        parser.error("--latency/--token-rate recorded n'est possible qu'en mode replay")
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    MessagesHandler.state = MockState(args)
+    server = ThreadingHTTPServer((args.host, args.port), MessagesHandler)
+    server.daemon_threads = True
+    print(f"Mock Anthropic ({args.mode}) sur http://{args.host}:{args.port} — latence {args.latency}, débit {args.token_rate}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,106 @@
+import os
+import csv
+import json
+import time
+import hashlib
+from contextlib import contextmanager
+
 import pandas as pd
-import chromadb
-from sentence_transformers import SentenceTransformer
+from dotenv import load_dotenv
+from filelock import FileLock, Timeout
+
+from rag.embedding_model import EMBEDDING_MODEL_NAME, encode
+from rag.kb_metadata import derive_metadata
+from rag.lexical_index import BM25Index
+from rag.vector_backends import get_backend
+
+load_dotenv()
+
+# Taille des lots pour l'encodage et l'insertion (configurable via .env)
+DEFAULT_BATCH_SIZE = int(os.getenv("KB_BATCH_SIZE", "256"))
+
+# Répertoire de l'index persistant (vide = index en mémoire, reconstruit à chaque démarrage)
+KB_PERSIST_DIR = os.getenv("KB_PERSIST_DIR", "kb_store")
+
+# Version du format des documents indexés (fait partie de la clé de l'index)
+KB_SCHEMA_VERSION = "4"
+
+COLLECTION_NAME = "threats"
+
+# Index lexical BM25 sauvegardé à côté de l'index vectoriel
+LEXICAL_INDEX_FILE = "lexical_index.pkl"
+
+# Verrou inter-processus de l'index persistant (workers qui démarrent ensemble)
+KB_LOCK_FILE = ".kb.lock"
 
-def build_vector_db(csv_path: str):
-    df = pd.read_csv(csv_path)
+# Rapport de la dernière construction (temps par phase)
+last_build_report = {}
 
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-    client = chromadb.Client()
+# Version de la base : incrémentée à chaque modification,
+# elle invalide les caches de recherche (rag/query_kb)
+_kb_version = 0
 
-    collection = client.create_collection(name="threats")
+def get_kb_version() -> int:
+    return _kb_version
 
-    for i, row in df.iterrows():
-        text = f"""
+def _bump_kb_version():
+    global _kb_version
+    _kb_version += 1
+
+# Index lexicaux par collection : nom -> (index BM25, chemin de sauvegarde)
+_lexical_indexes = {}
+
+def _index_key(collection) -> str:
+    # Clé du contenu indexé : hash du CSV, ou empreinte des modifications admin
+    metadata = collection.metadata or {}
+    return metadata.get("kb_key") or metadata.get("edit_hash") or ""
+
+def get_lexical_index(collection):
+    """
+    Retourne l'index BM25 associé à la collection (None s'il n'a pas été construit)
+    """
+    entry = _lexical_indexes.get(collection.name)
+    return entry[0] if entry else None
+
+def _refresh_lexical_index(collection) -> float:
+    """
+    Reconstruit l'index BM25 depuis les documents de la collection (sans ré-encodage)
+    et le sauvegarde si l'index vectoriel est persistant
+    """
+    t0 = time.perf_counter()
+    _, path = _lexical_indexes.get(collection.name, (None, ""))
+    data = collection.get(include=["documents", "metadatas"])
+    index = BM25Index().build(
+        data["ids"],
+        data["documents"],
+        data["metadatas"],
+        key=_index_key(collection)
+    )
+    if path:
+        index.save(path)
+    _lexical_indexes[collection.name] = (index, path)
+    return time.perf_counter() - t0
+
+def _load_lexical_index(collection, path: str) -> float:
+    """
+    Recharge l'index BM25 sauvegardé s'il correspond à la collection, sinon le reconstruit
+    """
+    t0 = time.perf_counter()
+    index = BM25Index.load(path) if path else None
+    if (index is not None
+            and index.key == _index_key(collection)
+            and len(index.ids) == collection.count()):
+        _lexical_indexes[collection.name] = (index, path)
+        return time.perf_counter() - t0
+
+    _lexical_indexes[collection.name] = (None, path)
+    return _refresh_lexical_index(collection)
+
+def render_threat_document(row: dict) -> str:
+    """
+    Construit le texte indexé pour une ligne du CSV de menaces
+    """
+    return f"""
 Architecture: {row.get('architecture_description', '')}
 Type de menace: {row.get('threat_type', '')}
 Gravité: {row.get('severity', '')}
@@ -24,12 +113,412 @@ CVSS Score: {row.get('cvss_score', '')}
 MITRE ATT&CK: {row.get('mitre_attack_id', '')}
 OWASP Category: {row.get('owasp_category', '')}
 """
-        embedding = model.encode(text).tolist()
 
-        collection.add(
-            documents=[text],
-            embeddings=[embedding],
-            ids=[str(i)]
+def load_threat_rows(csv_path: str) -> list:
+    """
+    Charge les lignes du CSV de menaces sous forme de dictionnaires
+    Chaque ligne reçoit un identifiant stable (colonne id, sinon numéro de ligne)
+    """
+    df = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+    columns = list(df.columns)
+    records = df.to_dict("records")
+
+    # Certaines exports placent chaque ligne entière entre guillemets :
+    # tout arrive alors dans la première colonne, qu'il faut re-découper
+    if len(columns) > 1 and records and all(
+        not any(record[col] for col in columns[1:]) for record in records
+    ):
+        reparsed = []
+        for record in records:
+            fields = next(csv.reader([record[columns[0]]]))
+            if len(fields) > len(columns):
+                fields = fields[:len(columns) - 1] + [",".join(fields[len(columns) - 1:])]
+            reparsed.append(dict(zip(columns, fields)))
+        records = reparsed
+
+    rows = []
+    for i, record in enumerate(records):
+        row = {col: (value or "").strip() for col, value in record.items()}
+        row["id"] = row.get("id") or str(i)
+        rows.append(row)
+    return rows
+
+def content_hash(document: str) -> str:
+    """
+    Hash du document rendu, utilisé pour détecter les lignes modifiées
+    """
+    return hashlib.sha1(document.encode("utf-8")).hexdigest()
+
+@contextmanager
+def kb_write_lock(persist_dir: str = None):
+    """
+    Verrou exclusif (fichier) sur l'index persistant : un seul processus construit
+    ou modifie KB_PERSIST_DIR à la fois (Chroma PersistentClient n'est pas
+    multi-processus) ; sans effet pour un index en mémoire
+    """
+    persist_dir = KB_PERSIST_DIR if persist_dir is None else persist_dir
+    if not persist_dir:
+        yield
+        return
+    os.makedirs(persist_dir, exist_ok=True)
+    lock = FileLock(os.path.join(persist_dir, KB_LOCK_FILE))
+    try:
+        lock.acquire(timeout=0)
+    except Timeout:
+        print(f"Index {persist_dir} verrouillé par un autre processus : attente...")
+        lock.acquire()
+    try:
+        yield
+    finally:
+        lock.release()
+
+def compute_kb_key(csv_path: str, model_name: str = EMBEDDING_MODEL_NAME) -> str:
+    """
+    Calcule la clé de l'index : hash du contenu du CSV + nom du modèle d'embedding
+    """
+    digest = hashlib.sha256()
+    with open(csv_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    digest.update(model_name.encode("utf-8"))
+    digest.update(KB_SCHEMA_VERSION.encode("utf-8"))
+    return digest.hexdigest()
+
+def _render_rows(rows: list) -> tuple:
+    """
+    Rend tous les documents d'un coup et retourne (ids, documents, metadatas)
+    Les métadonnées structurées (plateformes, gravité, CWE...) servent au filtrage
+    En cas d'identifiant en double, la dernière ligne l'emporte
+    """
+    by_id = {}
+    for row in rows:
+        by_id[str(row["id"])] = row
+
+    ids = list(by_id.keys())
+    documents = [render_threat_document(row) for row in by_id.values()]
+    metadatas = [
+        {"content_hash": content_hash(doc), **derive_metadata(row)}
+        for doc, row in zip(documents, by_id.values())
+    ]
+    return ids, documents, metadatas
+
+def _populate_collection(collection, ids: list, documents: list, metadatas: list,
+                         batch_size: int, verbose: bool) -> dict:
+    """
+    Encode les documents par lots et les insère (upsert) dans la collection
+    Retourne les temps d'encodage et d'insertion
+    """
+    encode_time = 0.0
+    insert_time = 0.0
+    for start in range(0, len(documents), batch_size):
+        batch_ids = ids[start:start + batch_size]
+        batch_docs = documents[start:start + batch_size]
+        batch_metadatas = metadatas[start:start + batch_size]
+
+        # Encodage du lot
+        t0 = time.perf_counter()
+        embeddings = encode(batch_docs, batch_size=batch_size).tolist()
+        encode_time += time.perf_counter() - t0
+
+        # Insertion du lot
+        t0 = time.perf_counter()
+        collection.upsert(
+            documents=batch_docs,
+            embeddings=embeddings,
+            metadatas=batch_metadatas,
+            ids=batch_ids
+        )
+        insert_time += time.perf_counter() - t0
+
+        if verbose:
+            print(f"Base vectorielle: {min(start + batch_size, len(documents))}/{len(documents)} documents indexés")
+
+    return {"encode_seconds": encode_time, "insert_seconds": insert_time}
+
+def _persist(collection):
+    # Chroma écrit au fil de l'eau ; le backend numpy écrit explicitement
+    persist = getattr(collection, "persist", None)
+    if persist:
+        persist()
+
+def _open_persistent_collection(persist_dir: str, kb_key: str):
+    """
+    Ouvre la collection persistante et indique si elle est à jour
+    Retourne (client, collection, statut) avec statut parmi :
+    "reused" (clé identique), "edited" (modifié par l'admin, CSV inchangé depuis),
+    "stale" (CSV modifié, mise à jour incrémentale possible)
+    ou "missing" (collection absente ou incompatible, à reconstruire)
+    """
+    client = get_backend(persist_dir)
+    try:
+        collection = client.get_collection(name=COLLECTION_NAME)
+    except Exception:
+        # Collection absente : premier démarrage
+        return client, None, "missing"
+
+    metadata = collection.metadata or {}
+    if metadata.get("kb_key") == kb_key and collection.count() > 0:
+        return client, collection, "reused"
+
+    # Lignes ajoutées / supprimées par l'admin, absentes de Données.csv :
+    # conservées tant que le CSV n'a pas changé depuis, sinon le CSV fait foi
+    if (metadata.get("edited") and metadata.get("base_kb_key") == kb_key
+            and metadata.get("embedding_model") == EMBEDDING_MODEL_NAME
+            and metadata.get("schema_version") == KB_SCHEMA_VERSION):
+        return client, collection, "edited"
+    if metadata.get("edited"):
+        print("⚠ Base vectorielle modifiée par l'admin mais Données.csv a changé : "
+              "resynchronisation depuis le CSV, les modifications admin sont écartées")
+
+    # Même modèle et même format de document : seules les lignes modifiées
+    # du CSV seront ré-encodées
+    if (metadata.get("embedding_model") == EMBEDDING_MODEL_NAME
+            and metadata.get("schema_version") == KB_SCHEMA_VERSION):
+        return client, collection, "stale"
+
+    # Modèle ou format différent : les embeddings existants sont inutilisables
+    client.delete_collection(name=COLLECTION_NAME)
+    return client, None, "missing"
+
+def _collection_metadata(kb_key: str) -> dict:
+    return {
+        "embedding_model": EMBEDDING_MODEL_NAME,
+        "schema_version": KB_SCHEMA_VERSION,
+        "kb_key": kb_key,
+        "edited": False,
+        "edit_hash": "",
+        "base_kb_key": ""
+    }
+
+def _mark_edited(collection, changes: dict):
+    """
+    Modification partielle (upsert / suppression admin) : l'index ne correspond
+    plus à Données.csv. kb_key est vidé pour qu'il ne soit jamais réutilisé comme
+    s'il était conforme au CSV ; base_kb_key garde la clé du CSV de départ et
+    edit_hash l'empreinte cumulée des modifications
+    """
+    metadata = dict(collection.metadata or {})
+    digest = hashlib.sha256()
+    digest.update(metadata.get("edit_hash", "").encode("utf-8"))
+    digest.update(json.dumps(changes, sort_keys=True).encode("utf-8"))
+    metadata.update({
+        "kb_key": "",
+        "edited": True,
+        "edit_hash": digest.hexdigest(),
+        "base_kb_key": metadata.get("base_kb_key") or metadata.get("kb_key", "")
+    })
+    collection.modify(metadata=metadata)
+
+def build_vector_db(csv_path: str, batch_size: int = None, verbose: bool = True, persist_dir: str = None):
+    """
+    Construit la base vectorielle des menaces à partir du CSV
+    Les documents sont rendus en une passe, encodés par lots
+    (un appel à encode par lot) puis insérés par lots dans le backend vectoriel (KB_BACKEND : chroma ou numpy)
+
+    En mode persistant (KB_PERSIST_DIR), l'index est stocké sur disque et
+    réutilisé tant que le hash du CSV et le modèle d'embedding ne changent pas ;
+    si seul le CSV a changé, seules les lignes modifiées sont ré-encodées
+    """
+    persist_dir = KB_PERSIST_DIR if persist_dir is None else persist_dir
+    # La clé est vérifiée une fois le verrou obtenu : les workers qui attendaient
+    # réutilisent l'index construit par le premier au lieu de le reconstruire
+    with kb_write_lock(persist_dir):
+        return _build_vector_db(csv_path, batch_size, verbose, persist_dir)
+
+def _build_vector_db(csv_path: str, batch_size: int, verbose: bool, persist_dir: str):
+    batch_size = batch_size or DEFAULT_BATCH_SIZE
+    started = time.perf_counter()
+
+    kb_key = compute_kb_key(csv_path)
+    lexical_path = os.path.join(persist_dir, LEXICAL_INDEX_FILE) if persist_dir else ""
+    _lexical_indexes[COLLECTION_NAME] = (None, lexical_path)
+
+    if persist_dir:
+        client, collection, status = _open_persistent_collection(persist_dir, kb_key)
+        if status in ("reused", "edited"):
+            lexical_time = _load_lexical_index(collection, lexical_path)
+            last_build_report.clear()
+            last_build_report.update({
+                "documents": collection.count(),
+                "reused": True,
+                "edited": status == "edited",
+                "kb_key": kb_key,
+                "lexical_seconds": round(lexical_time, 3),
+                "total_seconds": round(time.perf_counter() - started, 3)
+            })
+            if status == "edited":
+                print(f"⚠ Base vectorielle réutilisée avec des modifications admin absentes de {csv_path} "
+                      f"({collection.count()} documents) ; /admin/kb/sync les écarte")
+            elif verbose:
+                print(f"Base vectorielle réutilisée depuis {persist_dir}: {collection.count()} documents")
+            _bump_kb_version()
+            return collection
+        if status == "stale":
+            report = sync_vector_db(collection, csv_path, batch_size=batch_size, verbose=verbose)
+            last_build_report.clear()
+            last_build_report.update(report)
+            last_build_report["total_seconds"] = round(time.perf_counter() - started, 3)
+            _bump_kb_version()
+            return collection
+    else:
+        client = get_backend("")
+
+    rows = load_threat_rows(csv_path)
+
+    collection = client.create_collection(
+        name=COLLECTION_NAME,
+        metadata={"embedding_model": EMBEDDING_MODEL_NAME, "schema_version": KB_SCHEMA_VERSION}
+    )
+
+    # Rendu de tous les documents
+    t0 = time.perf_counter()
+    ids, documents, metadatas = _render_rows(rows)
+    render_time = time.perf_counter() - t0
+
+    timings = _populate_collection(collection, ids, documents, metadatas, batch_size, verbose)
+
+    # La clé n'est écrite qu'une fois l'index complet : une construction
+    # interrompue sera refaite au prochain démarrage
+    collection.modify(metadata=_collection_metadata(kb_key))
+    _persist(collection)
+    lexical_time = _refresh_lexical_index(collection)
+    _bump_kb_version()
+
+    last_build_report.clear()
+    last_build_report.update({
+        "documents": len(documents),
+        "reused": False,
+        "kb_key": kb_key,
+        "batch_size": batch_size,
+        "render_seconds": round(render_time, 3),
+        "encode_seconds": round(timings["encode_seconds"], 3),
+        "insert_seconds": round(timings["insert_seconds"], 3),
+        "lexical_seconds": round(lexical_time, 3),
+        "total_seconds": round(time.perf_counter() - started, 3)
+    })
+
+    if verbose:
+        print(
+            f"Base vectorielle construite: {len(documents)} documents "
+            f"(rendu {render_time:.2f}s, encodage {timings['encode_seconds']:.2f}s, "
+            f"insertion {timings['insert_seconds']:.2f}s)"
         )
 
     return collection
+
+def sync_vector_db(collection, source, delete_missing: bool = True, batch_size: int = None,
+                   verbose: bool = True) -> dict:
+    """
+    Met à jour la base vectorielle de façon incrémentale
+
+    source : chemin d'un CSV ou liste de lignes (dictionnaires avec une clé "id")
+    Les lignes sont comparées aux identifiants et hash de contenu stockés :
+    seules les lignes nouvelles ou modifiées sont encodées puis insérées (upsert),
+    et, si delete_missing est vrai, les lignes absentes de la source sont supprimées
+    """
+    batch_size = batch_size or DEFAULT_BATCH_SIZE
+    started = time.perf_counter()
+
+    rows = load_threat_rows(source) if isinstance(source, str) else list(source)
+    for i, row in enumerate(rows):
+        # 0 est un identifiant valide : seuls l'absence et la chaîne vide sont refusées
+        if row.get("id") is None or str(row["id"]).strip() == "":
+            raise ValueError(f"Ligne {i} sans identifiant")
+
+    t0 = time.perf_counter()
+    ids, documents, metadatas = _render_rows(rows)
+    render_time = time.perf_counter() - t0
+
+    # État actuel de l'index : identifiant -> hash du contenu
+    stored = collection.get(include=["metadatas"])
+    stored_hashes = {
+        doc_id: (metadata or {}).get("content_hash")
+        for doc_id, metadata in zip(stored["ids"], stored["metadatas"])
+    }
+
+    added = []
+    updated = []
+    changed_positions = []
+    for position, (doc_id, metadata) in enumerate(zip(ids, metadatas)):
+        if doc_id not in stored_hashes:
+            added.append(doc_id)
+        elif stored_hashes[doc_id] != metadata["content_hash"]:
+            updated.append(doc_id)
+        else:
+            continue
+        changed_positions.append(position)
+
+    timings = {"encode_seconds": 0.0, "insert_seconds": 0.0}
+    if changed_positions:
+        timings = _populate_collection(
+            collection,
+            [ids[p] for p in changed_positions],
+            [documents[p] for p in changed_positions],
+            [metadatas[p] for p in changed_positions],
+            batch_size,
+            verbose
+        )
+
+    deleted = []
+    if delete_missing:
+        incoming = set(ids)
+        deleted = [doc_id for doc_id in stored_hashes if doc_id not in incoming]
+        for start in range(0, len(deleted), batch_size):
+            collection.delete(ids=deleted[start:start + batch_size])
+
+    # Une synchronisation depuis le CSV rend l'index conforme à ce fichier ;
+    # toute autre modification le marque comme divergent
+    discarded_edits = False
+    if isinstance(source, str) and delete_missing:
+        discarded_edits = bool((collection.metadata or {}).get("edited")) and bool(added or updated or deleted)
+        collection.modify(metadata=_collection_metadata(compute_kb_key(source)))
+    elif added or updated or deleted:
+        _mark_edited(collection, {
+            "upserted": {ids[p]: metadatas[p]["content_hash"] for p in changed_positions},
+            "deleted": deleted
+        })
+    _persist(collection)
+
+    lexical_time = 0.0
+    if added or updated or deleted or get_lexical_index(collection) is None:
+        lexical_time = _refresh_lexical_index(collection)
+    if added or updated or deleted:
+        _bump_kb_version()
+
+    report = {
+        "documents": collection.count(),
+        "added": len(added),
+        "updated": len(updated),
+        "deleted": len(deleted),
+        "unchanged": len(ids) - len(changed_positions),
+        "discarded_admin_edits": discarded_edits,
+        "render_seconds": round(render_time, 3),
+        "encode_seconds": round(timings["encode_seconds"], 3),
+        "insert_seconds": round(timings["insert_seconds"], 3),
+        "lexical_seconds": round(lexical_time, 3),
+        "total_seconds": round(time.perf_counter() - started, 3)
+    }
+
+    if discarded_edits:
+        print("⚠ Synchronisation depuis le CSV : les modifications admin absentes du CSV ont été écartées")
+    if verbose:
+        print(
+            f"Base vectorielle synchronisée: {report['added']} ajoutés, {report['updated']} modifiés, "
+            f"{report['deleted']} supprimés, {report['unchanged']} inchangés"
+        )
+
+    return report
+
+def delete_threat_rows(collection, ids: list) -> dict:
+    """
+    Supprime des lignes de la base vectorielle par identifiant
+    """
+    ids = [str(doc_id) for doc_id in ids]
+    existing = collection.get(ids=ids, include=[])["ids"] if ids else []
+    if existing:
+        collection.delete(ids=existing)
+        _mark_edited(collection, {"deleted": existing})
+        _persist(collection)
+        _refresh_lexical_index(collection)
+        _bump_kb_version()
+    return {"deleted": len(existing), "documents": collection.count()}
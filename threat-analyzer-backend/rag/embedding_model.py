@@ -0,0 +1,111 @@
+"""
+Registre unique du modèle d'embedding
+Le modèle est chargé paresseusement au premier usage et partagé
+entre la construction (build_kb) et la recherche (query_kb)
+"""
+import os
+import time
+import threading
+from typing import Dict, List
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Configuration du modèle (via .env)
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE", "")  # vide = choix automatique (cuda si disponible)
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))  # 0 = valeur par défaut de torch
+
+_model = None
+_load_seconds = None
+_lock = threading.Lock()
+
+def get_embedding_model():
+    """
+    Retourne l'instance partagée du modèle, chargée au premier appel
+    """
+    global _model, _load_seconds
+
+    if _model is None:
+        with _lock:
+            if _model is None:
+                # Import différé : sentence_transformers/torch coûtent cher à importer
+                from sentence_transformers import SentenceTransformer
+
+                if EMBEDDING_THREADS > 0:
+                    import torch
+                    torch.set_num_threads(EMBEDDING_THREADS)
+
+                t0 = time.perf_counter()
+                _model = SentenceTransformer(EMBEDDING_MODEL_NAME, device=EMBEDDING_DEVICE or None)
+                _load_seconds = time.perf_counter() - t0
+                print(f"Modèle d'embedding {EMBEDDING_MODEL_NAME} chargé en {_load_seconds:.2f}s")
+
+    return _model
+
+def is_loaded() -> bool:
+    return _model is not None
+
+def encode(texts: List[str], batch_size: int = 32):
+    """
+    Encode une liste de textes avec le modèle partagé (un seul appel au modèle)
+    Retourne un tableau numpy (un vecteur par texte)
+    """
+    return get_embedding_model().encode(
+        texts,
+        batch_size=batch_size,
+        show_progress_bar=False
+    )
+
+def warm_up() -> Dict:
+    """
+    Charge le modèle et exécute un encodage à vide pour que la première
+    requête utilisateur ne paie pas le coût d'initialisation
+    """
+    t0 = time.perf_counter()
+    encode(["warm-up"])
+    report = get_memory_report()
+    report["warm_up_seconds"] = round(time.perf_counter() - t0, 3)
+    return report
+
+def _process_rss_mb() -> float:
+    """
+    Mémoire résidente du processus en Mo (Linux : /proc, sinon pic via resource)
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import resource
+        import sys
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss est en octets sur macOS, en Ko ailleurs
+        return round(max_rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    except Exception:
+        return None
+
+def get_memory_report() -> Dict:
+    """
+    Rapport mémoire : état du modèle, taille des paramètres, RSS du processus
+    """
+    report = {
+        "model": EMBEDDING_MODEL_NAME,
+        "loaded": is_loaded(),
+        "process_rss_mb": _process_rss_mb()
+    }
+
+    if _model is not None:
+        import torch
+        parameter_bytes = sum(p.numel() * p.element_size() for p in _model.parameters())
+        report.update({
+            "device": str(_model.device),
+            "threads": torch.get_num_threads(),
+            "load_seconds": round(_load_seconds, 3),
+            "parameters_mb": round(parameter_bytes / (1024 * 1024), 1)
+        })
+
+    return report
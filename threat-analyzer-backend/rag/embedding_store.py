@@ -0,0 +1,136 @@
+"""
+Stockage quantifié des embeddings de la base de menaces
+- float32 : vecteurs normalisés tels quels
+- float16 : moitié de la taille, précision suffisante pour la similarité cosinus
+- int8    : un quart de la taille, un facteur d'échelle float32 par vecteur
+
+Les fichiers .npy sont ouverts en mémoire mappée : tous les workers d'une même
+machine partagent les mêmes pages du cache disque, et la recherche est faite
+directement sur le tableau mappé, par blocs pour borner la mémoire temporaire.
+
+Chaque écriture crée un nouveau sous-dossier versionné (codes + échelles) ; le
+manifeste de la collection, remplacé en dernier, désigne la version courante.
+Un lecteur voit donc toujours un ensemble cohérent, et un worker qui a mappé une
+ancienne version la garde lisible jusqu'à ce qu'il recharge le manifeste.
+"""
+import os
+import shutil
+import time
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+SUPPORTED_DTYPES = ("float32", "float16", "int8")
+
+# Nombre de lignes décodées à la fois pendant la recherche
+SCORE_CHUNK_ROWS = 4096
+
+CODES_FILE = "embeddings.npy"
+SCALES_FILE = "scales.npy"
+STORE_PREFIX = "store-"
+
+# Dossiers temporaires d'écritures interrompues supprimés après ce délai (secondes)
+STALE_TMP_SECONDS = 3600
+
+def quantize(matrix: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Quantifie une matrice float32 ; retourne (codes, échelles ou None)
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if dtype == "float32":
+        return matrix, None
+    if dtype == "float16":
+        return matrix.astype(np.float16), None
+    if dtype == "int8":
+        if matrix.size == 0:
+            return matrix.astype(np.int8), np.zeros(len(matrix), dtype=np.float32)
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    raise ValueError(f"Type de stockage non supporté: {dtype}")
+
+def dequantize(codes: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    matrix = np.asarray(codes, dtype=np.float32)
+    if scales is not None:
+        matrix = matrix * np.asarray(scales, dtype=np.float32)[:, None]
+    return matrix
+
+def save_store(directory: str, matrix: np.ndarray, dtype: str) -> str:
+    """
+    Écrit la matrice quantifiée dans un nouveau sous-dossier versionné de directory
+    Retourne le nom de la version, à référencer dans le manifeste (écrit ensuite)
+    """
+    codes, scales = quantize(matrix, dtype)
+    # Nom unique entre processus : pas de collision entre workers qui écrivent en même temps
+    version = f"{STORE_PREFIX}{time.time_ns()}-{os.getpid()}"
+    tmp_dir = os.path.join(directory, version + ".tmp")
+    os.makedirs(tmp_dir)
+
+    files = [(CODES_FILE, codes)]
+    if scales is not None:
+        files.append((SCALES_FILE, scales))
+    for filename, array in files:
+        with open(os.path.join(tmp_dir, filename), "wb") as f:
+            np.save(f, array)
+            f.flush()
+            os.fsync(f.fileno())
+    os.rename(tmp_dir, os.path.join(directory, version))
+    return version
+
+def load_store(directory: str, version: str = "") -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Ouvre les codes (et échelles) d'une version en mémoire mappée, en lecture seule
+    version vide : ancien format, fichiers directement dans directory
+    """
+    store_dir = os.path.join(directory, version)
+    codes = np.load(os.path.join(store_dir, CODES_FILE), mmap_mode="r")
+    scales = None
+    if codes.dtype == np.int8:
+        scales = np.load(os.path.join(store_dir, SCALES_FILE), mmap_mode="r")
+        if len(scales) != len(codes):
+            raise ValueError(f"Stockage incohérent dans {store_dir}: {len(codes)} codes, {len(scales)} échelles")
+    return codes, scales
+
+def prune_store(directory: str, keep: Iterable[str]):
+    """
+    Supprime les versions qui ne sont plus référencées (et l'ancien format)
+    Les pages déjà mappées par un autre worker restent lisibles jusqu'à son rechargement
+    """
+    keep = set(keep)
+    now = time.time()
+    for entry in os.listdir(directory):
+        path = os.path.join(directory, entry)
+        try:
+            if entry.startswith(STORE_PREFIX) and entry.endswith(".tmp"):
+                # Écriture en cours dans un autre processus, ou interrompue depuis longtemps
+                if now - os.path.getmtime(path) > STALE_TMP_SECONDS:
+                    shutil.rmtree(path)
+            elif entry.startswith(STORE_PREFIX) and entry not in keep:
+                shutil.rmtree(path)
+            elif entry in (CODES_FILE, SCALES_FILE) and "" not in keep:
+                os.remove(path)
+        except OSError as e:
+            print(f"Impossible de supprimer l'ancienne version {path}: {e}")
+
+def score(queries: np.ndarray, codes: np.ndarray, scales: Optional[np.ndarray] = None,
+          rows: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Similarité (produit scalaire) entre les requêtes float32 normalisées et les
+    vecteurs stockés, calculée par blocs sans décoder toute la matrice
+    rows : positions à évaluer (None = toutes)
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    n_rows = len(rows) if rows is not None else len(codes)
+    scores = np.empty((len(queries), n_rows), dtype=np.float32)
+
+    for start in range(0, n_rows, SCORE_CHUNK_ROWS):
+        stop = min(start + SCORE_CHUNK_ROWS, n_rows)
+        positions = rows[start:stop] if rows is not None else slice(start, stop)
+        block = np.asarray(codes[positions], dtype=np.float32)
+        block_scores = queries @ block.T
+        if scales is not None:
+            block_scores *= np.asarray(scales[positions], dtype=np.float32)
+        scores[:, start:stop] = block_scores
+
+    return scores
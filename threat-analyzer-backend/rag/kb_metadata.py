@@ -0,0 +1,131 @@
+"""
+Métadonnées structurées des documents de la base de menaces
+- dérivées à l'indexation (plateformes, gravité, CWE, OWASP, MITRE)
+- filtres de recherche au format "where" de Chroma
+- évaluation de ces filtres pour les backends sans moteur de requête (numpy)
+"""
+import re
+from typing import Dict, Optional
+
+# Mots-clés servant à étiqueter les documents et à classer le type d'application
+PLATFORM_KEYWORDS = {
+    "mobile": ["mobile", "ios", "android"],
+    "web": ["web", "site", "navigateur", "browser"],
+    "api": ["api", "rest", "graphql", "backend"],
+}
+
+# Pour les documents, mots entiers uniquement ("api" ne doit pas correspondre à "rapide"),
+# au singulier ou au pluriel ("APIs", "backends") ; "API-first" est un mot entier
+_PLATFORM_PATTERNS = {
+    platform: re.compile(r"\b(" + "|".join(keywords) + r")s?\b")
+    for platform, keywords in PLATFORM_KEYWORDS.items()
+}
+
+def _has_keyword(text: str, platform: str) -> bool:
+    return bool(_PLATFORM_PATTERNS[platform].search(text))
+
+def derive_metadata(row: Dict) -> Dict:
+    """
+    Construit les métadonnées filtrables d'une ligne du CSV
+    Les valeurs sont scalaires (contrainte Chroma) : chaînes vides plutôt que None
+    """
+    architecture = str(row.get("architecture_description", "")).lower()
+    threat_text = f"{row.get('threat_type', '')} {row.get('threat_description', '')}".lower()
+    text = f"{architecture} {threat_text}"
+
+    is_mobile = _has_keyword(text, "mobile")
+    is_web = _has_keyword(text, "web")
+    is_api = _has_keyword(text, "api")
+
+    metadata = {
+        "severity": str(row.get("severity", "")).upper(),
+        "cwe_id": str(row.get("cwe_id", "")),
+        "owasp_category": str(row.get("owasp_category", "")),
+        "mitre_attack_id": str(row.get("mitre_attack_id", "")),
+        "threat_type": str(row.get("threat_type", "")),
+        "platform_mobile": is_mobile,
+        "platform_web": is_web,
+        "platform_api": is_api,
+        "platform_generic": not (is_mobile or is_web or is_api)
+    }
+
+    try:
+        metadata["cvss_score"] = float(row.get("cvss_score", ""))
+    except (TypeError, ValueError):
+        pass
+
+    return metadata
+
+def detect_app_platform(app_type: str) -> str:
+    """
+    Classe le type d'application saisi : "mobile", "web", "api" ou "other"
+    """
+    app_type_lower = app_type.lower()
+    if "mobile" in app_type_lower or "ios" in app_type_lower or "android" in app_type_lower:
+        return "mobile"
+    if "web" in app_type_lower or "site" in app_type_lower:
+        return "web"
+    if "api" in app_type_lower or "rest" in app_type_lower or "graphql" in app_type_lower:
+        return "api"
+    return "other"
+
+def build_platform_filter(app_type: str) -> Optional[Dict]:
+    """
+    Filtre "where" excluant les menaces propres à une autre plateforme
+    - mobile : exclut les menaces web qui ne concernent pas le mobile
+    - web : exclut les menaces mobiles qui ne concernent pas le web
+    - api : exclut les menaces d'interface (web/mobile) qui ne concernent pas l'API
+    """
+    platform = detect_app_platform(app_type)
+
+    if platform == "mobile":
+        return {"$or": [{"platform_mobile": True}, {"platform_web": False}]}
+    if platform == "web":
+        return {"$or": [{"platform_web": True}, {"platform_mobile": False}]}
+    if platform == "api":
+        return {"$or": [
+            {"platform_api": True},
+            {"$and": [{"platform_web": False}, {"platform_mobile": False}]}
+        ]}
+    return None
+
+_OPERATORS = {
+    "$eq": lambda value, expected: value == expected,
+    "$ne": lambda value, expected: value != expected,
+    "$gt": lambda value, expected: value is not None and value > expected,
+    "$gte": lambda value, expected: value is not None and value >= expected,
+    "$lt": lambda value, expected: value is not None and value < expected,
+    "$lte": lambda value, expected: value is not None and value <= expected,
+    "$in": lambda value, expected: value in expected,
+    "$nin": lambda value, expected: value not in expected,
+}
+
+def matches_where(metadata: Optional[Dict], where: Optional[Dict]) -> bool:
+    """
+    Évalue un filtre "where" (syntaxe Chroma) sur les métadonnées d'un document
+    """
+    if not where:
+        return True
+    metadata = metadata or {}
+
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for operator, expected in condition.items():
+                if operator not in _OPERATORS:
+                    raise ValueError(f"Opérateur de filtre non supporté: {operator}")
+                try:
+                    if not _OPERATORS[operator](value, expected):
+                        return False
+                except TypeError:
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+
+    return True
@@ -0,0 +1,122 @@
+"""
+Index lexical BM25 de la base de menaces
+Complète la recherche vectorielle pour les identifiants exacts
+(Redis, Kafka, CWE-89, T1190, Firebase...) mal servis par les embeddings
+"""
+import math
+import os
+import pickle
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from rag.kb_metadata import matches_where
+
+# Mots composés conservés entiers (cwe-89, a03:2021, oauth2.0) en plus de leurs parties
+_TOKEN_PATTERN = re.compile(r"\w+(?:[-:.]\w+)*")
+_PART_PATTERN = re.compile(r"[-:.]")
+
+# Mots vides français/anglais fréquents dans les documents du catalogue
+STOPWORDS = {
+    "de", "des", "du", "la", "le", "les", "et", "en", "un", "une", "à", "a", "au", "aux",
+    "pour", "par", "sur", "avec", "dans", "ou", "d", "l", "the", "of", "and", "to", "in",
+    "for", "with", "on", "or", "nan"
+}
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if _PART_PATTERN.search(token):
+            tokens.extend(part for part in _PART_PATTERN.split(token) if part and part not in STOPWORDS)
+    return tokens
+
+class BM25Index:
+    """
+    Index inversé BM25 : terme -> [(position du document, fréquence)]
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.key = None
+        self.ids = []
+        self.metadatas = []
+        self.doc_lengths = []
+        self.avg_length = 0.0
+        self.postings = {}
+        self.idf = {}
+
+    def build(self, ids: List[str], documents: List[str], metadatas: Optional[List[Dict]] = None,
+              key: Optional[str] = None) -> "BM25Index":
+        self.key = key
+        self.ids = list(ids)
+        self.metadatas = list(metadatas) if metadatas else [None] * len(ids)
+        self.doc_lengths = []
+
+        postings = defaultdict(list)
+        for position, document in enumerate(documents):
+            counts = Counter(tokenize(document or ""))
+            self.doc_lengths.append(sum(counts.values()))
+            for term, frequency in counts.items():
+                postings[term].append((position, frequency))
+
+        self.postings = dict(postings)
+        n_docs = len(self.ids)
+        self.avg_length = (sum(self.doc_lengths) / n_docs) if n_docs else 0.0
+        self.idf = {
+            term: math.log(1 + (n_docs - len(entries) + 0.5) / (len(entries) + 0.5))
+            for term, entries in self.postings.items()
+        }
+        return self
+
+    def search(self, query: str, k: int = 10, where: Optional[Dict] = None) -> List[Tuple[str, float]]:
+        """
+        Retourne les k meilleurs (id, score) ; seuls les documents contenant
+        au moins un terme de la requête sont évalués
+        """
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            entries = self.postings.get(term)
+            if not entries:
+                continue
+            idf = self.idf[term]
+            for position, frequency in entries:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[position] / (self.avg_length or 1))
+                scores[position] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        results = []
+        for position, score in ranked:
+            if where and not matches_where(self.metadatas[position], where):
+                continue
+            results.append((self.ids[position], score))
+            if len(results) >= k:
+                break
+        return results
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump((self.FORMAT_VERSION, self.__dict__), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["BM25Index"]:
+        """
+        Charge un index sauvegardé (None si absent ou d'un format antérieur)
+        """
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            version, state = pickle.load(f)
+        if version != cls.FORMAT_VERSION:
+            return None
+        index = cls()
+        index.__dict__.update(state)
+        return index
@@ -0,0 +1,162 @@
+"""
+Recherche multi-requêtes pour les longues descriptions d'architecture
+MiniLM tronque les entrées longues : la description est découpée en
+morceaux (sections de composants, relations, paragraphes), chaque morceau
+est recherché (en un seul lot), puis les classements sont fusionnés par
+RRF et diversifiés par MMR dans un budget fixe de résultats.
+"""
+import os
+import re
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from rag.query_kb import reciprocal_rank_fusion, search_threats, search_threats_batch
+
+# Taille maximale d'un morceau (en caractères, ~ la fenêtre utile de MiniLM)
+MULTI_QUERY_CHUNK_CHARS = int(os.getenv("MULTI_QUERY_CHUNK_CHARS", "600"))
+# Nombre maximal de sous-requêtes par analyse
+MULTI_QUERY_MAX_CHUNKS = int(os.getenv("MULTI_QUERY_MAX_CHUNKS", "64"))
+# Compromis pertinence / diversité de MMR (1.0 = pertinence seule)
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# Nombre de candidats fusionnés soumis à MMR, par résultat demandé
+MMR_CANDIDATES_FACTOR = 3
+
+_SENTENCE_END = re.compile(r"(?<=[.!?;])\s+")
+
+def _split_long_block(block: str, max_chars: int) -> List[str]:
+    """
+    Découpe un bloc trop long par phrases, puis par mots en dernier recours
+    """
+    pieces = []
+    current = ""
+    for sentence in _SENTENCE_END.split(block):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            pieces.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if current and len(current) + len(sentence) + 1 > max_chars:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}".strip()
+    if current:
+        pieces.append(current)
+    return pieces
+
+def split_architecture_text(text: str, max_chars: int = MULTI_QUERY_CHUNK_CHARS) -> List[str]:
+    """
+    Découpe une description d'architecture en morceaux d'au plus max_chars
+    - les paragraphes (lignes vides) sont des frontières
+    - les listes ("Composants identifiés:", "Relations entre composants:"...) sont
+      regroupées par éléments entiers, chaque morceau répétant le titre de sa section
+    - les paragraphes trop longs sont découpés par phrases
+    """
+    chunks = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        lines = [line.strip() for line in paragraph.splitlines() if line.strip()]
+        if not lines:
+            continue
+
+        items = [line for line in lines if line.startswith(("-", "*", "•"))]
+        if len(items) >= 2:
+            # Section de liste : titre éventuel + éléments regroupés
+            title = lines[0] if not lines[0].startswith(("-", "*", "•")) else ""
+            current = []
+            current_len = len(title)
+            for line in lines:
+                if line == title:
+                    continue
+                if current and current_len + len(line) + 1 > max_chars:
+                    chunks.append("\n".join(([title] if title else []) + current))
+                    current = []
+                    current_len = len(title)
+                current.append(line)
+                current_len += len(line) + 1
+            if current:
+                chunks.append("\n".join(([title] if title else []) + current))
+        else:
+            block = " ".join(lines)
+            if len(block) <= max_chars:
+                chunks.append(block)
+            else:
+                chunks.extend(_split_long_block(block, max_chars))
+
+    return chunks
+
+def _select_chunks(chunks: List[str], max_chunks: int) -> List[str]:
+    # Au-delà du budget, on garde des morceaux répartis sur toute la description
+    if len(chunks) <= max_chunks:
+        return chunks
+    positions = np.linspace(0, len(chunks) - 1, max_chunks).round().astype(int)
+    return [chunks[p] for p in sorted(set(positions.tolist()))]
+
+def mmr_select(candidate_ids: List[str], relevance: Dict[str, float], embeddings: np.ndarray,
+               k: int, mmr_lambda: float = MMR_LAMBDA) -> List[str]:
+    """
+    Maximal Marginal Relevance : choisit k documents pertinents et peu redondants
+    relevance : score de pertinence par identifiant (normalisé dans [0, 1])
+    embeddings : vecteurs des candidats, dans l'ordre de candidate_ids
+    """
+    if not candidate_ids:
+        return []
+
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors = vectors / norms
+    similarity = vectors @ vectors.T
+
+    relevance_scores = np.array([relevance[doc_id] for doc_id in candidate_ids], dtype=np.float32)
+    selected = []
+    max_similarity = np.zeros(len(candidate_ids), dtype=np.float32)
+    available = np.ones(len(candidate_ids), dtype=bool)
+
+    for _ in range(min(k, len(candidate_ids))):
+        scores = mmr_lambda * relevance_scores - (1 - mmr_lambda) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, similarity[best])
+
+    return [candidate_ids[i] for i in selected]
+
+def retrieve_multi_query(collection, text: str, k: int = 10, where: Optional[dict] = None,
+                         context: str = "", max_chars: int = MULTI_QUERY_CHUNK_CHARS,
+                         max_chunks: int = MULTI_QUERY_MAX_CHUNKS,
+                         mmr_lambda: float = MMR_LAMBDA) -> List[str]:
+    """
+    Recherche les menaces d'une longue description d'architecture
+    context : texte ajouté à chaque sous-requête (type d'application, menaces ciblées)
+    Retourne au plus k documents, comme search_threats
+    """
+    chunks = _select_chunks(split_architecture_text(text, max_chars), max_chunks)
+    if len(chunks) <= 1:
+        return search_threats(collection, f"{context}\n{text}".strip(), k=k, where=where)
+
+    queries = [f"{context}\n{chunk}".strip() for chunk in chunks]
+    batch = search_threats_batch(collection, queries, k=k, where=where)
+
+    fused = reciprocal_rank_fusion(batch["per_query"])
+    if not fused:
+        return []
+    documents_by_id = {entry["id"]: entry["document"] for entry in batch["results"]}
+
+    candidate_ids = [doc_id for doc_id, _ in fused[:k * MMR_CANDIDATES_FACTOR] if doc_id in documents_by_id]
+    top_score = fused[0][1]
+    relevance = {doc_id: score / top_score for doc_id, score in fused}
+
+    candidates = collection.get(ids=candidate_ids, include=["embeddings"])
+    embeddings_by_id = dict(zip(candidates["ids"], candidates["embeddings"]))
+    candidate_ids = [doc_id for doc_id in candidate_ids if doc_id in embeddings_by_id]
+
+    selected = mmr_select(
+        candidate_ids,
+        relevance,
+        np.array([embeddings_by_id[doc_id] for doc_id in candidate_ids]),
+        k,
+        mmr_lambda
+    )
+    return [documents_by_id[doc_id] for doc_id in selected]
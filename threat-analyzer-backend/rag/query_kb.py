@@ -1,13 +1,217 @@
-from sentence_transformers import SentenceTransformer
+import os
+import re
+import json
+import time
+from typing import Dict, List, Tuple
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
+from rag.build_kb import get_kb_version, get_lexical_index
+from rag.embedding_model import encode
+from services.cache_service import LRUCache
+from services.metrics_service import LatencyStats
 
-def search_threats(collection, query: str, k=10):
-    query_embedding = model.encode(query).tolist()
+# Mode de recherche : "vector" (embeddings seuls) ou "hybrid" (embeddings + BM25 fusionnés)
+RAG_SEARCH_MODE = os.getenv("RAG_SEARCH_MODE", "hybrid")
+# Constante de la fusion par rang réciproque (RRF)
+RRF_K = int(os.getenv("RRF_K", "60"))
+# En mode hybride, chaque branche propose k * HYBRID_CANDIDATES_FACTOR candidats
+HYBRID_CANDIDATES_FACTOR = 3
+
+# Caches des requêtes RAG (taille et TTL configurables via .env, TTL 0 = sans expiration)
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "0"))
+
+# Embeddings des requêtes : ne dépendent que du texte (et du modèle)
+_embedding_cache = LRUCache(max_entries=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+# Résultats top-k : dépendent aussi de k et de la version de la base
+_results_cache = LRUCache(max_entries=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+_results_kb_version = None
+
+# Latences par branche de la recherche
+_retrieval_latency = {
+    "vector": LatencyStats(),
+    "lexical": LatencyStats(),
+    "fusion": LatencyStats()
+}
+
+def normalize_query(query: str) -> str:
+    """
+    Normalise le texte d'une requête (espaces) pour servir de clé de cache
+    """
+    return re.sub(r"\s+", " ", query).strip()
+
+def get_query_embeddings(queries: List[str]) -> List[list]:
+    """
+    Retourne les embeddings de plusieurs requêtes : celles absentes du cache
+    sont encodées ensemble, en un seul appel au modèle
+    """
+    keys = [normalize_query(query) for query in queries]
+    embeddings = [_embedding_cache.get(key) for key in keys]
+
+    missing = list(dict.fromkeys(key for key, embedding in zip(keys, embeddings) if embedding is None))
+    if missing:
+        encoded = dict(zip(missing, encode(missing).tolist()))
+        for key, embedding in encoded.items():
+            _embedding_cache.set(key, embedding)
+        embeddings = [embedding if embedding is not None else encoded[key]
+                      for key, embedding in zip(keys, embeddings)]
+
+    return embeddings
+
+def get_query_embedding(query: str) -> list:
+    """
+    Retourne l'embedding d'une requête, depuis le cache si possible
+    """
+    return get_query_embeddings([query])[0]
+
+def _check_kb_version():
+    # La base a changé depuis le dernier appel : les résultats en cache sont périmés
+    global _results_kb_version
+    kb_version = get_kb_version()
+    if kb_version != _results_kb_version:
+        _results_cache.clear()
+        _results_kb_version = kb_version
+    return kb_version
+
+def reciprocal_rank_fusion(rankings: List[List[str]], rrf_k: int = RRF_K) -> List[Tuple[str, float]]:
+    """
+    Fusionne plusieurs classements d'identifiants : score = somme de 1 / (rrf_k + rang)
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+def _vector_search(collection, queries: List[str], k: int, where: dict) -> Dict:
+    """
+    Recherche vectorielle de plusieurs requêtes en un seul appel à l'index
+    """
+    t0 = time.perf_counter()
+    query_embeddings = get_query_embeddings(queries)
 
     results = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=k
+        query_embeddings=query_embeddings,
+        n_results=k,
+        where=where
     )
+    _retrieval_latency["vector"].record((time.perf_counter() - t0) * 1000)
+
+    return results
+
+def _rank_queries(collection, queries: List[str], k: int, where: dict, mode: str) -> Tuple[List[List[str]], Dict]:
+    """
+    Classe les documents pour chaque requête
+    Retourne (identifiants classés par requête, documents connus par identifiant)
+    """
+    lexical_index = get_lexical_index(collection) if mode == "hybrid" else None
+
+    if lexical_index is None:
+        results = _vector_search(collection, queries, k, where)
+        documents_by_id = {}
+        for ids, documents in zip(results["ids"], results["documents"]):
+            documents_by_id.update(zip(ids, documents))
+        return results["ids"], documents_by_id
+
+    n_candidates = k * HYBRID_CANDIDATES_FACTOR
+    results = _vector_search(collection, queries, n_candidates, where)
+    documents_by_id = {}
+    for ids, documents in zip(results["ids"], results["documents"]):
+        documents_by_id.update(zip(ids, documents))
+
+    t0 = time.perf_counter()
+    lexical_rankings = [
+        [doc_id for doc_id, _ in lexical_index.search(query, k=n_candidates, where=where)]
+        for query in queries
+    ]
+    _retrieval_latency["lexical"].record((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    rankings = [
+        [doc_id for doc_id, _ in reciprocal_rank_fusion([vector_ids, lexical_ids])[:k]]
+        for vector_ids, lexical_ids in zip(results["ids"], lexical_rankings)
+    ]
+
+    # Documents trouvés uniquement par BM25 : récupérés en un seul appel
+    missing = list(dict.fromkeys(
+        doc_id for ranking in rankings for doc_id in ranking if doc_id not in documents_by_id
+    ))
+    if missing:
+        fetched = collection.get(ids=missing, include=["documents"])
+        documents_by_id.update(zip(fetched["ids"], fetched["documents"]))
+    _retrieval_latency["fusion"].record((time.perf_counter() - t0) * 1000)
+
+    return rankings, documents_by_id
+
+def _resolve_mode(collection, mode: str) -> str:
+    mode = mode or RAG_SEARCH_MODE
+    if mode == "hybrid" and get_lexical_index(collection) is None:
+        return "vector"
+    return mode
+
+def search_threats(collection, query: str, k=10, where: dict = None, mode: str = None):
+    """
+    Recherche les k menaces les plus proches de la requête
+    where : filtre sur les métadonnées (syntaxe Chroma), appliqué dans l'index
+    mode : "vector" ou "hybrid" (par défaut RAG_SEARCH_MODE) ; le mode hybride
+    fusionne par RRF le classement vectoriel et le classement BM25
+    """
+    mode = _resolve_mode(collection, mode)
+
+    kb_version = _check_kb_version()
+    cache_key = (normalize_query(query), k, json.dumps(where, sort_keys=True), mode, kb_version)
+
+    documents = _results_cache.get(cache_key)
+    if documents is None:
+        rankings, documents_by_id = _rank_queries(collection, [query], k, where, mode)
+        documents = [documents_by_id[doc_id] for doc_id in rankings[0] if doc_id in documents_by_id]
+        _results_cache.set(cache_key, documents)
+
+    return list(documents)
+
+def search_threats_batch(collection, queries: List[str], k=10, where: dict = None, mode: str = None) -> Dict:
+    """
+    Recherche plusieurs requêtes (composants, flux, frontières de confiance...) :
+    un seul appel d'encodage pour les requêtes hors cache et un seul appel à l'index
+
+    Retourne :
+    - "per_query" : pour chaque requête, les identifiants classés
+    - "results" : les documents dédupliqués, chacun avec les requêtes qui l'ont
+      retourné ("queries") et son meilleur rang ("best_rank"), triés par meilleur
+      rang puis par nombre de requêtes
+    """
+    if not queries:
+        return {"per_query": [], "results": []}
+
+    mode = _resolve_mode(collection, mode)
+    rankings, documents_by_id = _rank_queries(collection, list(queries), k, where, mode)
+
+    merged = {}
+    for query_index, ranking in enumerate(rankings):
+        for rank, doc_id in enumerate(ranking, start=1):
+            if doc_id not in documents_by_id:
+                continue
+            entry = merged.setdefault(doc_id, {
+                "id": doc_id,
+                "document": documents_by_id[doc_id],
+                "queries": [],
+                "best_rank": rank
+            })
+            entry["queries"].append(query_index)
+            entry["best_rank"] = min(entry["best_rank"], rank)
+
+    results = sorted(merged.values(), key=lambda entry: (entry["best_rank"], -len(entry["queries"])))
+    return {"per_query": rankings, "results": results}
+
+def clear_query_cache():
+    _embedding_cache.clear()
+    _results_cache.clear()
+
+def get_query_cache_stats() -> dict:
+    return {
+        "kb_version": get_kb_version(),
+        "embeddings": _embedding_cache.stats(),
+        "results": _results_cache.stats()
+    }
 
-    return results["documents"][0]
+def get_retrieval_stats() -> Dict:
+    return {leg: stats.stats() for leg, stats in _retrieval_latency.items()}
@@ -0,0 +1,433 @@
+"""
+Backends de stockage et de recherche vectorielle pour la base de menaces
+
+Chaque backend expose le sous-ensemble de l'API client Chroma utilisé par
+build_kb (get_collection / create_collection / delete_collection), et ses
+collections le sous-ensemble de l'API Collection utilisé par build_kb et
+query_kb (add / upsert / get / delete / query / count / modify / metadata).
+
+- "chroma" : client Chroma (persistant ou en mémoire)
+- "numpy"  : recherche exacte par produit matrice-vecteur sur une matrice
+             normalisée, stockée en float32, float16 ou int8 (KB_VECTOR_DTYPE)
+             et chargée en mémoire mappée depuis un .npy (voir embedding_store)
+"""
+import os
+import json
+import shutil
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from rag import embedding_store
+from rag.kb_metadata import matches_where
+
+load_dotenv()
+
+# Backend utilisé par build_kb (configurable via .env)
+KB_BACKEND = os.getenv("KB_BACKEND", "chroma")
+
+# Type de stockage des embeddings du backend numpy : float32, float16 ou int8
+KB_VECTOR_DTYPE = os.getenv("KB_VECTOR_DTYPE", "float32")
+
+def get_backend(persist_dir: str = "", backend_name: str = None, vector_dtype: str = None):
+    """
+    Retourne un client de stockage vectoriel
+    persist_dir vide = stockage en mémoire uniquement
+    vector_dtype : type de stockage des embeddings (backend numpy, KB_VECTOR_DTYPE par défaut)
+    """
+    backend_name = (backend_name or KB_BACKEND).lower()
+
+    if backend_name == "chroma":
+        import chromadb
+        if persist_dir:
+            return chromadb.PersistentClient(path=persist_dir)
+        return chromadb.Client()
+
+    if backend_name == "numpy":
+        return NumpyBackend(os.path.join(persist_dir, "numpy") if persist_dir else "", vector_dtype=vector_dtype)
+
+    raise ValueError(f"Backend vectoriel inconnu: {backend_name}")
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+class NumpyBackend:
+    """
+    Client minimal gérant des NumpyCollection, éventuellement sur disque
+    """
+
+    def __init__(self, persist_dir: str = "", vector_dtype: str = None):
+        self.persist_dir = persist_dir
+        self.vector_dtype = vector_dtype
+        self._collections = {}
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.persist_dir, name) if self.persist_dir else ""
+
+    def get_collection(self, name: str):
+        if name in self._collections:
+            return self._collections[name]
+
+        path = self._path(name)
+        if path and os.path.exists(os.path.join(path, NumpyCollection.MANIFEST)):
+            collection = NumpyCollection.load(name, path, vector_dtype=self.vector_dtype)
+            self._collections[name] = collection
+            return collection
+
+        raise ValueError(f"Collection {name} inexistante")
+
+    def create_collection(self, name: str, metadata: Optional[Dict] = None):
+        if name in self._collections:
+            raise ValueError(f"Collection {name} existe déjà")
+        collection = NumpyCollection(name, metadata=metadata, path=self._path(name), vector_dtype=self.vector_dtype)
+        self._collections[name] = collection
+        return collection
+
+    def get_or_create_collection(self, name: str, metadata: Optional[Dict] = None):
+        try:
+            return self.get_collection(name)
+        except ValueError:
+            return self.create_collection(name, metadata=metadata)
+
+    def delete_collection(self, name: str):
+        self._collections.pop(name, None)
+        path = self._path(name)
+        if path and os.path.exists(path):
+            shutil.rmtree(path)
+
+class NumpyCollection:
+    """
+    Collection de vecteurs normalisés (une ligne par document)
+    La recherche est exacte : un produit matrice-vecteur puis argpartition
+
+    Les vecteurs sont soit en mémoire (_matrix, float32, modifiable), soit
+    sur disque en mémoire mappée (_codes/_scales, éventuellement quantifiés)
+
+    Les modifications (endpoints admin, threadpool) et les recherches
+    (asyncio.to_thread) sont concurrentes : tout accès à l'état passe par _lock ;
+    une recherche prend un instantané sous le verrou puis calcule les scores
+    hors verrou (la matrice partagée avec une recherche est copiée avant écriture)
+    """
+
+    MANIFEST = "collection.json"
+
+    def __init__(self, name: str, metadata: Optional[Dict] = None, path: str = "",
+                 vector_dtype: str = None):
+        self.name = name
+        self.metadata = dict(metadata) if metadata else None
+        self.path = path
+        self.vector_dtype = vector_dtype or KB_VECTOR_DTYPE
+        if self.vector_dtype not in embedding_store.SUPPORTED_DTYPES:
+            raise ValueError(f"KB_VECTOR_DTYPE invalide: {self.vector_dtype}")
+        self._ids = []
+        self._documents = []
+        self._metadatas = []
+        self._positions = {}
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._codes = None
+        self._scales = None
+        self._pending = []
+        self._dirty = False
+        self._where_masks = {}
+        self._matrix_shared = False
+        self._store_version = ""
+        self._manifest_signature = None
+        self._lock = threading.RLock()
+
+    # -------------------------------
+    # Persistance
+    # -------------------------------
+    @classmethod
+    def load(cls, name: str, path: str, vector_dtype: str = None) -> "NumpyCollection":
+        collection = cls(name, path=path, vector_dtype=vector_dtype)
+        collection._load_manifest()
+
+        # Type de stockage modifié dans la configuration : conversion immédiate
+        if str(collection._codes.dtype) != collection.vector_dtype:
+            collection._consolidated()
+            collection._dirty = True
+            collection.persist()
+        return collection
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.path, self.MANIFEST)
+
+    def _load_manifest(self):
+        """
+        Recharge la collection depuis le manifeste courant et mappe la version
+        de stockage qu'il désigne (partagée entre workers via le cache disque)
+        """
+        for attempt in range(2):
+            with open(self._manifest_path(), encoding="utf-8") as f:
+                manifest = json.load(f)
+                stat = os.fstat(f.fileno())
+            try:
+                codes, scales = embedding_store.load_store(self.path, manifest.get("store_version", ""))
+                break
+            except FileNotFoundError:
+                # Version remplacée par un autre worker entre les deux lectures
+                if attempt:
+                    raise
+        if len(codes) != len(manifest["ids"]):
+            raise ValueError(f"Stockage incohérent dans {self.path}: {len(codes)} vecteurs, {len(manifest['ids'])} documents")
+
+        self.metadata = manifest.get("metadata")
+        self._ids = manifest["ids"]
+        self._documents = manifest["documents"]
+        self._metadatas = manifest["metadatas"]
+        self._positions = {doc_id: i for i, doc_id in enumerate(self._ids)}
+        self._codes, self._scales = codes, scales
+        self._matrix = None
+        self._pending = []
+        self._where_masks = {}
+        self._store_version = manifest.get("store_version", "")
+        self._manifest_signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _refresh_from_disk(self):
+        """
+        Recharge la collection si un autre worker a publié une nouvelle version
+        (un os.stat du manifeste par lecture)
+        """
+        if not self.path or self._dirty or self._manifest_signature is None:
+            return
+        try:
+            stat = os.stat(self._manifest_path())
+        except FileNotFoundError:
+            return
+        if (stat.st_ino, stat.st_mtime_ns, stat.st_size) != self._manifest_signature:
+            self._load_manifest()
+
+    def persist(self):
+        """
+        Écrit la collection sur disque (no-op en mémoire ou si rien n'a changé)
+        """
+        with self._lock:
+            self._persist()
+
+    def _persist(self):
+        if not self.path or not self._dirty:
+            return
+
+        # Nouvelle version des vecteurs, puis manifeste remplacé en dernier :
+        # un lecteur voit l'ancien ensemble complet ou le nouveau, jamais un mélange
+        version = embedding_store.save_store(self.path, self._consolidated(), self.vector_dtype)
+        tmp_manifest = f"{self._manifest_path()}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_manifest, "w", encoding="utf-8") as f:
+            json.dump({
+                "metadata": self.metadata,
+                "vector_dtype": self.vector_dtype,
+                "store_version": version,
+                "ids": self._ids,
+                "documents": self._documents,
+                "metadatas": self._metadatas
+            }, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_manifest, self._manifest_path())
+
+        # La version précédente reste disponible pour les workers qui viennent de lire l'ancien manifeste
+        embedding_store.prune_store(self.path, keep={version, self._store_version})
+
+        # La copie en mémoire est remplacée par le fichier mappé, partagé entre workers
+        self._dirty = False
+        self._load_manifest()
+
+    # -------------------------------
+    # Gestion de la matrice
+    # -------------------------------
+    def _consolidated(self) -> np.ndarray:
+        # Le stockage mappé est décodé en float32 avant toute modification
+        if self._matrix is None:
+            self._matrix = embedding_store.dequantize(self._codes, self._scales)
+            self._codes = None
+            self._scales = None
+        # Les lots ajoutés sont concaténés une seule fois, au besoin
+        if self._pending:
+            blocks = [self._matrix] if self._matrix.size else []
+            self._matrix = np.vstack(blocks + self._pending)
+            self._pending = []
+        return self._matrix
+
+    def _candidates(self, where: Optional[Dict]) -> Optional[np.ndarray]:
+        """
+        Positions des documents satisfaisant le filtre (None = tous)
+        Les résultats sont mémorisés par filtre jusqu'à la prochaine modification
+        """
+        if not where:
+            return None
+        key = json.dumps(where, sort_keys=True)
+        positions = self._where_masks.get(key)
+        if positions is None:
+            positions = np.array(
+                [i for i, metadata in enumerate(self._metadatas) if matches_where(metadata, where)],
+                dtype=np.int64
+            )
+            self._where_masks[key] = positions
+        return positions
+
+    def _writable(self) -> np.ndarray:
+        matrix = self._consolidated()
+        if not matrix.flags.writeable or self._matrix_shared:
+            self._matrix = np.array(matrix)
+            self._matrix_shared = False
+        return self._matrix
+
+    def _vectors(self):
+        """
+        Retourne (codes, échelles) à utiliser pour la recherche : le stockage
+        mappé s'il est à jour, sinon la matrice float32 en mémoire
+        """
+        if self._matrix is None and not self._pending:
+            return self._codes, self._scales
+        # Matrice lue hors verrou par l'appelant : copie avant la prochaine écriture
+        self._matrix_shared = True
+        return self._consolidated(), None
+
+    # -------------------------------
+    # API de type Collection Chroma
+    # -------------------------------
+    def count(self) -> int:
+        with self._lock:
+            self._refresh_from_disk()
+            return len(self._ids)
+
+    def modify(self, metadata: Optional[Dict] = None, name: Optional[str] = None):
+        with self._lock:
+            self._refresh_from_disk()
+            if metadata is not None:
+                self.metadata = dict(metadata)
+            if name:
+                self.name = name
+            self._dirty = True
+            self._persist()
+
+    def add(self, ids: List[str], embeddings, documents: List[str] = None, metadatas: List[Dict] = None):
+        with self._lock:
+            duplicates = [doc_id for doc_id in ids if doc_id in self._positions]
+            if duplicates:
+                raise ValueError(f"Identifiants déjà présents: {duplicates[:5]}")
+            self.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def upsert(self, ids: List[str], embeddings, documents: List[str] = None, metadatas: List[Dict] = None):
+        vectors = _normalize_rows(embeddings)
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [None] * len(ids)
+
+        with self._lock:
+            # Modification appliquée à la dernière version publiée
+            self._refresh_from_disk()
+            new_rows = []
+            for doc_id, vector, document, metadata in zip(ids, vectors, documents, metadatas):
+                position = self._positions.get(doc_id)
+                if position is None:
+                    self._positions[doc_id] = len(self._ids)
+                    self._ids.append(doc_id)
+                    self._documents.append(document)
+                    self._metadatas.append(metadata)
+                    new_rows.append(vector)
+                else:
+                    if new_rows:
+                        # Une ligne ajoutée plus haut dans le même lot peut être mise à jour
+                        self._pending.append(np.vstack(new_rows))
+                        new_rows = []
+                    self._writable()[position] = vector
+                    self._documents[position] = document
+                    self._metadatas[position] = metadata
+
+            if new_rows:
+                self._pending.append(np.vstack(new_rows))
+            self._where_masks = {}
+            self._dirty = True
+
+    def delete(self, ids: List[str] = None):
+        with self._lock:
+            self._refresh_from_disk()
+            to_delete = {doc_id for doc_id in (ids or []) if doc_id in self._positions}
+            if not to_delete:
+                return
+
+            keep = [i for i, doc_id in enumerate(self._ids) if doc_id not in to_delete]
+            self._matrix = np.array(self._consolidated()[keep])
+            self._ids = [self._ids[i] for i in keep]
+            self._documents = [self._documents[i] for i in keep]
+            self._metadatas = [self._metadatas[i] for i in keep]
+            self._positions = {doc_id: i for i, doc_id in enumerate(self._ids)}
+            self._where_masks = {}
+            self._dirty = True
+
+    def get(self, ids: List[str] = None, where: Optional[Dict] = None, include: List[str] = None) -> Dict:
+        include = include if include is not None else ["documents", "metadatas"]
+        with self._lock:
+            self._refresh_from_disk()
+            if ids is None:
+                positions = list(range(len(self._ids)))
+            else:
+                positions = [self._positions[doc_id] for doc_id in ids if doc_id in self._positions]
+            if where:
+                allowed = set(self._candidates(where).tolist())
+                positions = [p for p in positions if p in allowed]
+
+            result = {"ids": [self._ids[p] for p in positions]}
+            if "documents" in include:
+                result["documents"] = [self._documents[p] for p in positions]
+            if "metadatas" in include:
+                result["metadatas"] = [self._metadatas[p] for p in positions]
+            if "embeddings" in include:
+                codes, scales = self._vectors()
+                result["embeddings"] = embedding_store.dequantize(
+                    codes[positions],
+                    scales[positions] if scales is not None else None
+                )
+            return result
+
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[Dict] = None,
+              include: List[str] = None) -> Dict:
+        include = include if include is not None else ["documents", "metadatas", "distances"]
+        queries = _normalize_rows(query_embeddings)
+        with self._lock:
+            self._refresh_from_disk()
+            # Instantané cohérent : vecteurs, filtre et lignes de la même version
+            codes, scales = self._vectors()
+            # Seuls les documents satisfaisant le filtre sont évalués
+            candidates = self._candidates(where)
+            ids, documents, metadatas = list(self._ids), list(self._documents), list(self._metadatas)
+        n_rows = len(candidates) if candidates is not None else len(ids)
+
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        k = min(n_results, n_rows)
+        if k == 0:
+            for _ in range(len(queries)):
+                for key in result:
+                    result[key].append([])
+            return result
+
+        # Similarité cosinus de toutes les requêtes en un seul produit matriciel (par blocs)
+        scores = embedding_store.score(queries, codes, scales, rows=candidates)
+
+        for row in scores:
+            if k < len(row):
+                top = np.argpartition(-row, k - 1)[:k]
+            else:
+                top = np.arange(len(row))
+            top = top[np.argsort(-row[top])]
+            top_scores = row[top]
+            # Retour aux positions de la collection complète
+            positions = candidates[top] if candidates is not None else top
+
+            result["ids"].append([ids[p] for p in positions])
+            result["documents"].append([documents[p] for p in positions])
+            result["metadatas"].append([metadatas[p] for p in positions])
+            # Même échelle que la distance L2 au carré de Chroma (vecteurs normalisés)
+            result["distances"].append([float(2.0 - 2.0 * score) for score in top_scores])
+
+        for key in ("documents", "metadatas", "distances"):
+            if key not in include:
+                result[key] = None
+        return result
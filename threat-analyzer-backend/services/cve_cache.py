@@ -0,0 +1,226 @@
+"""
+Cache des recherches CVE (NVD)
+Les mêmes mots-clés ("SQL Injection", "CWE-89"...) reviennent à chaque analyse :
+- deux niveaux : LRU en mémoire, puis SQLite sur disque (persistant entre redémarrages)
+- durée de vie par entrée : résultat, résultat vide (négatif) et erreur ont chacun leur TTL
+- stale-while-revalidate : une entrée expirée reste servie pendant CVE_CACHE_STALE_TTL
+  et elle est rafraîchie en arrière-plan ; si le rafraîchissement échoue, l'ancienne
+  valeur est conservée et le prochain essai attend CVE_CACHE_ERROR_TTL
+"""
+import copy
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from services.cache_service import LRUCache, SQLiteCache
+
+load_dotenv()
+
+# Niveaux du cache : tiered (mémoire + disque), memory ou none (désactivé)
+CVE_CACHE_BACKEND = os.getenv("CVE_CACHE_BACKEND", "tiered").lower()
+CVE_CACHE_PATH = os.getenv("CVE_CACHE_PATH", "cve_cache.sqlite3")
+CVE_CACHE_SIZE = int(os.getenv("CVE_CACHE_SIZE", "1024"))
+CVE_CACHE_DISK_SIZE = int(os.getenv("CVE_CACHE_DISK_SIZE", "20000"))
+# Durées de vie (secondes) : résultats, résultats vides, erreurs, fenêtre stale-while-revalidate
+CVE_CACHE_TTL = float(os.getenv("CVE_CACHE_TTL", "86400"))
+CVE_CACHE_NEGATIVE_TTL = float(os.getenv("CVE_CACHE_NEGATIVE_TTL", "3600"))
+CVE_CACHE_ERROR_TTL = float(os.getenv("CVE_CACHE_ERROR_TTL", "60"))
+CVE_CACHE_STALE_TTL = float(os.getenv("CVE_CACHE_STALE_TTL", "86400"))
+
+class CVELookupCache:
+    """
+    Entrées : {"value", "status" (ok / negative / error), "fresh_until", "stale_until"}
+    (horodatages time.time() : valables aussi pour le niveau disque partagé)
+    """
+
+    def __init__(self, memory: LRUCache, disk: Optional[SQLiteCache] = None,
+                 ttl: float = CVE_CACHE_TTL, negative_ttl: float = CVE_CACHE_NEGATIVE_TTL,
+                 error_ttl: float = CVE_CACHE_ERROR_TTL, stale_ttl: float = CVE_CACHE_STALE_TTL):
+        self.memory = memory
+        self.disk = disk
+        self.ttls = {"ok": ttl, "negative": negative_ttl, "error": error_ttl}
+        self.stale_ttl = stale_ttl
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self.counters = {
+            "fresh_hits": 0,
+            "stale_hits": 0,
+            "negative_hits": 0,
+            "error_hits": 0,
+            "misses": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "refreshes": 0,
+            "refresh_failures": 0
+        }
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _read(self, key: str) -> Optional[Dict]:
+        entry = self.memory.get(key)
+        if entry is not None:
+            self._count("memory_hits")
+            return entry
+        if self.disk is not None:
+            entry = self.disk.get(key)
+            if entry is not None:
+                self._count("disk_hits")
+                # Promotion en mémoire pour le reste de sa durée de vie
+                self.memory.set(key, entry, ttl=max(1.0, entry["stale_until"] - time.time()))
+                return entry
+        return None
+
+    def _write(self, key: str, entry: Dict):
+        ttl = max(1.0, entry["stale_until"] - time.time())
+        self.memory.set(key, entry, ttl=ttl)
+        if self.disk is not None:
+            self.disk.set(key, entry, ttl=ttl)
+
+    def get(self, key: str) -> Tuple[Any, Optional[str]]:
+        """
+        Retourne (valeur, état) ; état : "fresh", "stale" (à rafraîchir) ou None (absent)
+        """
+        entry = self._read(key)
+        if entry is None:
+            self._count("misses")
+            return None, None
+        if entry["status"] == "negative":
+            self._count("negative_hits")
+        elif entry["status"] == "error":
+            self._count("error_hits")
+        if entry["fresh_until"] > time.time():
+            self._count("fresh_hits")
+            return copy.deepcopy(entry["value"]), "fresh"
+        self._count("stale_hits")
+        return copy.deepcopy(entry["value"]), "stale"
+
+    def set(self, key: str, value: Any, status: str = "ok"):
+        now = time.time()
+        fresh_until = now + self.ttls[status]
+        self._write(key, {
+            "value": copy.deepcopy(value),
+            "status": status,
+            "fresh_until": fresh_until,
+            "stale_until": fresh_until + self.stale_ttl
+        })
+
+    def set_error(self, key: str, empty: Any):
+        """
+        Échec de la recherche : une valeur encore utilisable est conservée
+        (nouvel essai après le TTL d'erreur), sinon l'erreur est mise en cache
+        """
+        entry = self._read(key)
+        if entry is not None and entry["status"] != "error" and entry["stale_until"] > time.time():
+            entry = dict(entry, fresh_until=time.time() + self.ttls["error"])
+            self._write(key, entry)
+        else:
+            self.set(key, empty, "error")
+
+    def begin_refresh(self, key: str) -> bool:
+        """
+        Réserve le rafraîchissement d'une clé (un seul à la fois par clé)
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            self.counters["refreshes"] += 1
+            return True
+
+    def end_refresh(self, key: str, failed: bool = False):
+        with self._lock:
+            self._refreshing.discard(key)
+            if failed:
+                self.counters["refresh_failures"] += 1
+
+    def _fetch_and_store(self, key: str, fetch: Callable[[], Any], empty: Any) -> Tuple[Any, bool]:
+        try:
+            value = fetch()
+        except Exception as e:
+            print(f"Erreur lors de la recherche CVE ({key}): {e}")
+            self.set_error(key, empty)
+            return copy.deepcopy(empty), False
+        self.set(key, value, "ok" if value else "negative")
+        return value, True
+
+    def get_or_fetch(self, key: str, fetch: Callable[[], Any], empty: Any = None) -> Any:
+        """
+        Valeur en cache, sinon fetch() (qui lève une exception en cas d'erreur)
+        Une valeur expirée est retournée immédiatement et rafraîchie dans un thread
+        """
+        value, state = self.get(key)
+        if state == "fresh":
+            return value
+        if state == "stale":
+            if self.begin_refresh(key):
+                threading.Thread(target=self._refresh, args=(key, fetch, empty), daemon=True).start()
+            return value
+        value, _ = self._fetch_and_store(key, fetch, empty)
+        return value
+
+    def _refresh(self, key: str, fetch: Callable[[], Any], empty: Any):
+        _, succeeded = self._fetch_and_store(key, fetch, empty)
+        self.end_refresh(key, failed=not succeeded)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.counters)
+            stats["refreshing"] = len(self._refreshing)
+        served = stats["fresh_hits"] + stats["stale_hits"]
+        total = served + stats["misses"]
+        stats["hit_rate"] = round(served / total, 3) if total else 0.0
+        stats["ttl_seconds"] = dict(self.ttls, stale=self.stale_ttl)
+        stats["memory"] = self.memory.stats()
+        if self.disk is not None:
+            stats["disk"] = self.disk.stats()
+        return stats
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cve_cache() -> Optional[CVELookupCache]:
+    """
+    Retourne le cache partagé (créé au premier appel), None si désactivé
+    """
+    global _cache
+    if CVE_CACHE_BACKEND == "none":
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                disk = None
+                if CVE_CACHE_BACKEND == "tiered":
+                    disk = SQLiteCache(CVE_CACHE_PATH, max_entries=CVE_CACHE_DISK_SIZE)
+                _cache = CVELookupCache(LRUCache(max_entries=CVE_CACHE_SIZE), disk)
+    return _cache
+
+def cached_cve_lookup(key: str, fetch: Callable[[], Any], empty: Any = None) -> Any:
+    cache = get_cve_cache()
+    if cache is None:
+        try:
+            return fetch()
+        except Exception as e:
+            print(f"Erreur lors de la recherche CVE ({key}): {e}")
+            return empty
+    return cache.get_or_fetch(key, fetch, empty)
+
+def clear_cve_cache():
+    cache = get_cve_cache()
+    if cache is not None:
+        cache.clear()
+
+def get_cve_cache_stats() -> Dict:
+    cache = get_cve_cache()
+    if cache is None:
+        return {"backend": "none"}
+    return {"backend": CVE_CACHE_BACKEND, **cache.stats()}
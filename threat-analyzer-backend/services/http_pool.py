@@ -0,0 +1,148 @@
+"""
+Pool de connexions HTTP partagé par les clients LLM
+Le client Anthropic (llm_service) et la chaîne LangChain utilisent le même
+pool keep-alive : une analyse réutilise la connexion TLS de la précédente
+au lieu de refaire une poignée de main.
+Un pool asynchrone jumeau sert les versions async (appelées depuis l'event loop).
+"""
+import os
+import threading
+from typing import Dict
+
+import anthropic
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "20"))
+LLM_HTTP_MAX_KEEPALIVE = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "10"))
+# Durée (secondes) pendant laquelle une connexion inactive reste ouverte
+LLM_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "60"))
+LLM_HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", "120"))
+# URL de l'API (ex. mock_anthropic_server.py pour les tests de charge hors ligne)
+ANTHROPIC_BASE_URL = os.getenv("ANTHROPIC_BASE_URL") or None
+
+_lock = threading.Lock()
+_http_client = None
+_anthropic_client = None
+_async_http_client = None
+_async_anthropic_client = None
+_counters = {"requests": 0, "responses": 0, "new_connections": 0}
+
+def _trace(event_name: str, info: dict):
+    # Événements httpcore : une connexion TCP ouverte = une connexion non réutilisée
+    if event_name == "connection.connect_tcp.complete":
+        _counters["new_connections"] += 1
+
+def _on_request(request):
+    _counters["requests"] += 1
+    request.extensions["trace"] = _trace
+
+def _on_response(response):
+    _counters["responses"] += 1
+
+async def _atrace(event_name: str, info: dict):
+    _trace(event_name, info)
+
+async def _on_async_request(request):
+    _counters["requests"] += 1
+    request.extensions["trace"] = _atrace
+
+async def _on_async_response(response):
+    _counters["responses"] += 1
+
+def _connection_limits():
+    # Limits de la version de httpx utilisée par le SDK Anthropic
+    limits_class = type(anthropic.DEFAULT_CONNECTION_LIMITS)
+    return limits_class(
+        max_connections=LLM_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=LLM_HTTP_KEEPALIVE_EXPIRY
+    )
+
+def get_http_client():
+    """
+    Client HTTP partagé (créé au premier appel)
+    """
+    global _http_client
+    if _http_client is None:
+        with _lock:
+            if _http_client is None:
+                _http_client = anthropic.DefaultHttpxClient(
+                    limits=_connection_limits(),
+                    timeout=LLM_HTTP_TIMEOUT,
+                    event_hooks={"request": [_on_request], "response": [_on_response]}
+                )
+    return _http_client
+
+def get_anthropic_client() -> anthropic.Anthropic:
+    """
+    Client Anthropic partagé, adossé au pool HTTP commun
+    """
+    global _anthropic_client
+    if _anthropic_client is None:
+        http_client = get_http_client()
+        with _lock:
+            if _anthropic_client is None:
+                _anthropic_client = anthropic.Anthropic(
+                    api_key=os.getenv("ANTHROPIC_API_KEY"),
+                    base_url=ANTHROPIC_BASE_URL,
+                    http_client=http_client
+                )
+    return _anthropic_client
+
+def get_async_http_client():
+    """
+    Client HTTP asynchrone partagé (même réglages que le pool synchrone)
+    """
+    global _async_http_client
+    if _async_http_client is None:
+        with _lock:
+            if _async_http_client is None:
+                _async_http_client = anthropic.DefaultAsyncHttpxClient(
+                    limits=_connection_limits(),
+                    timeout=LLM_HTTP_TIMEOUT,
+                    event_hooks={"request": [_on_async_request], "response": [_on_async_response]}
+                )
+    return _async_http_client
+
+def get_async_anthropic_client() -> anthropic.AsyncAnthropic:
+    """
+    Client Anthropic asynchrone partagé, adossé au pool HTTP asynchrone
+    """
+    global _async_anthropic_client
+    if _async_anthropic_client is None:
+        http_client = get_async_http_client()
+        with _lock:
+            if _async_anthropic_client is None:
+                _async_anthropic_client = anthropic.AsyncAnthropic(
+                    api_key=os.getenv("ANTHROPIC_API_KEY"),
+                    base_url=ANTHROPIC_BASE_URL,
+                    http_client=http_client
+                )
+    return _async_anthropic_client
+
+def _pool_connections(client) -> list:
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    return list(getattr(pool, "connections", [])) if pool is not None else []
+
+def get_pool_stats() -> Dict:
+    """
+    Connexions ouvertes / inactives du pool et taux de réutilisation
+    """
+    stats = {
+        "max_connections": LLM_HTTP_MAX_CONNECTIONS,
+        "max_keepalive_connections": LLM_HTTP_MAX_KEEPALIVE,
+        "keepalive_expiry_s": LLM_HTTP_KEEPALIVE_EXPIRY,
+        **_counters,
+        "reused_connections": max(0, _counters["requests"] - _counters["new_connections"]),
+        "open_connections": 0,
+        "idle_connections": 0
+    }
+    for client in (_http_client, _async_http_client):
+        if client is None:
+            continue
+        connections = _pool_connections(client)
+        stats["open_connections"] += len(connections)
+        stats["idle_connections"] += sum(1 for connection in connections if connection.is_idle())
+    return stats
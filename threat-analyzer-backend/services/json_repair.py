@@ -0,0 +1,104 @@
+"""
+Extraction tolérante du JSON des réponses LLM
+Évite un second appel au modèle quand la réponse est presque valide :
+- texte ou bloc ```json autour de l'objet : on isole l'objet racine
+- virgules finales (, avant } ou ]) : supprimées
+- réponse tronquée (max_tokens atteint) : on conserve toutes les menaces
+  complètes et on referme le tableau et l'objet racine ; le résultat est marqué
+  "truncated": True (analyse partielle, jamais mise en cache)
+"""
+import json
+import threading
+from typing import Dict, Optional
+
+from services.json_stream import StreamingArrayParser, strip_trailing_commas
+
+_lock = threading.Lock()
+_counters = {
+    "calls": 0,
+    "valid": 0,
+    "extracted": 0,
+    "trailing_commas": 0,
+    "truncated_recovered": 0,
+    "failed": 0
+}
+
+def _count(name: str):
+    with _lock:
+        _counters[name] += 1
+
+def _loads_object(text: str) -> Optional[dict]:
+    try:
+        value = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    return value if isinstance(value, dict) else None
+
+def extract_json_object(raw_text: str, array_key: str = "menaces") -> Optional[dict]:
+    """
+    Retourne l'objet JSON de la réponse, réparé si besoin ; None si irrécupérable
+    Un objet reconstruit depuis une réponse tronquée contient "truncated": True
+    """
+    _count("calls")
+    text = raw_text.strip()
+
+    # Cas nominal : JSON valide tel quel
+    result = _loads_object(text)
+    if result is not None:
+        _count("valid")
+        return result
+
+    parser = StreamingArrayParser(array_key)
+    parser.feed(text)
+    if parser.root_start is None:
+        _count("failed")
+        return None
+
+    if parser.finished:
+        # Objet racine complet, entouré de texte ou avec des virgules finales
+        candidate = text[parser.root_start:parser.root_end + 1]
+        result = _loads_object(candidate)
+        if result is not None:
+            _count("extracted")
+            return result
+        result = _loads_object(strip_trailing_commas(candidate))
+        if result is not None:
+            _count("trailing_commas")
+            return result
+
+    if parser.root_end is None and parser.last_item_end is not None:
+        # Réponse tronquée (objet racine jamais refermé) : on coupe après la
+        # dernière menace complète et on referme ; les clés suivantes sont perdues
+        candidate = text[parser.root_start:parser.last_item_end + 1] + "]}"
+        result = _loads_object(strip_trailing_commas(candidate))
+        if result is not None:
+            _count("truncated_recovered")
+            result["truncated"] = True
+            return result
+
+    _count("failed")
+    return None
+
+def parse_llm_json(raw_text: str, error_message: str = "JSON invalide retourné par le modèle") -> dict:
+    """
+    Convertit la réponse texte du modèle en dictionnaire, avec réparation si besoin
+    Retourne {"error": ..., "raw_response": ...} si la réponse est irrécupérable
+    """
+    if not raw_text.strip():
+        return {"error": "Réponse vide du modèle"}
+
+    result = extract_json_object(raw_text)
+    if result is None:
+        return {
+            "error": error_message,
+            "raw_response": raw_text
+        }
+    return result
+
+def get_repair_stats() -> Dict:
+    with _lock:
+        stats = dict(_counters)
+    repaired = stats["extracted"] + stats["trailing_commas"] + stats["truncated_recovered"]
+    stats["repaired"] = repaired
+    stats["repair_rate"] = round(repaired / stats["calls"], 3) if stats["calls"] else 0.0
+    return stats
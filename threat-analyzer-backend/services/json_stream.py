@@ -0,0 +1,140 @@
+"""
+Parseur JSON incrémental pour les réponses LLM en streaming
+Le texte arrive par fragments ; chaque élément du tableau ciblé ("menaces")
+est retourné dès que son objet est fermé, sans attendre la fin de la réponse.
+"""
+import json
+import re
+from typing import Dict, List
+
+_KEY_BEFORE_ARRAY = re.compile(r'"((?:[^"\\]|\\.)*)"\s*:\s*$')
+
+def strip_trailing_commas(text: str) -> str:
+    """
+    Supprime les virgules placées juste avant } ou ] (hors chaînes)
+    """
+    result = []
+    in_string = False
+    escaped = False
+    pending_comma = None
+    for char in text:
+        if in_string:
+            result.append(char)
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if pending_comma is not None:
+            if char.isspace():
+                pending_comma.append(char)
+                continue
+            if char not in "}]":
+                result.append(",")
+            result.extend(pending_comma)
+            pending_comma = None
+        if char == ",":
+            pending_comma = []
+            continue
+        if char == '"':
+            in_string = True
+        result.append(char)
+    if pending_comma is not None:
+        result.append(",")
+        result.extend(pending_comma)
+    return "".join(result)
+
+class StreamingArrayParser:
+    """
+    Suit l'imbrication des {} / [] (hors chaînes) du premier objet JSON du texte
+    et extrait les objets complets du tableau `array_key` de l'objet racine
+    """
+
+    def __init__(self, array_key: str = "menaces"):
+        self.array_key = array_key
+        self.text = ""
+        self._position = 0
+        self._stack = []
+        self._in_string = False
+        self._escaped = False
+        self._in_array = False
+        self._item_start = None
+        self.finished = False
+        self.items_emitted = 0
+        # Positions dans self.text : début / fin de l'objet racine, fin du dernier élément complet
+        self.root_start = None
+        self.root_end = None
+        self.last_item_end = None
+
+    def feed(self, chunk: str) -> List[Dict]:
+        """
+        Ajoute un fragment ; retourne les éléments du tableau complétés par ce fragment
+        """
+        self.text += chunk
+        items = []
+        text = self.text
+
+        while self._position < len(text) and not self.finished:
+            i = self._position
+            char = text[i]
+            self._position += 1
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if not self._stack:
+                # Avant l'objet racine (texte libre, bloc ```json) : on attend la première accolade
+                if char == "{":
+                    self._stack.append("{")
+                    self.root_start = i
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if char == "[" and self._stack == ["{"] and self._is_target_key(i):
+                    self._in_array = True
+                elif char == "{" and self._in_array and len(self._stack) == 2:
+                    self._item_start = i
+                self._stack.append(char)
+            elif char in "}]":
+                self._stack.pop()
+                if self._in_array and char == "}" and len(self._stack) == 2 and self._item_start is not None:
+                    item = self._decode(text[self._item_start:i + 1])
+                    if item is not None:
+                        items.append(item)
+                        self.items_emitted += 1
+                        self.last_item_end = i
+                    self._item_start = None
+                elif self._in_array and char == "]" and len(self._stack) == 1:
+                    self._in_array = False
+                elif not self._stack:
+                    self.finished = True
+                    self.root_end = i
+
+        return items
+
+    def _is_target_key(self, index: int) -> bool:
+        # Clé qui précède le "[" : on ne relit qu'une courte fenêtre du texte
+        window = self.text[max(0, index - len(self.array_key) - 64):index]
+        match = _KEY_BEFORE_ARRAY.search(window)
+        return bool(match) and match.group(1) == self.array_key
+
+    @staticmethod
+    def _decode(fragment: str):
+        try:
+            item = json.loads(fragment)
+        except json.JSONDecodeError:
+            try:
+                item = json.loads(strip_trailing_commas(fragment))
+            except json.JSONDecodeError:
+                return None
+        return item if isinstance(item, dict) else None
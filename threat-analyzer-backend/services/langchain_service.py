@@ -6,29 +6,50 @@ from langchain_anthropic import ChatAnthropic
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnablePassthrough
-import json
 import os
+import threading
 from dotenv import load_dotenv
 
+from services.http_pool import get_anthropic_client, get_async_anthropic_client
+from services.json_repair import parse_llm_json
+from services.llm_cache import cached_analysis
+
 load_dotenv()
 
+LANGCHAIN_MODEL = "claude-3-haiku-20240307"
+# À incrémenter à chaque modification du prompt : invalide les réponses en cache
+PROMPT_VERSION = "langchain-2"
+
 def create_threat_analysis_chain():
     """
     Crée une chaîne LangChain pour l'analyse de menaces
     """
     llm = ChatAnthropic(
-        model="claude-3-haiku-20240307",
+        model=LANGCHAIN_MODEL,
         temperature=0.1,
         max_tokens=4000,
         api_key=os.getenv("ANTHROPIC_API_KEY")
     )
+    # ChatAnthropic n'accepte pas de client en paramètre : on remplace ses clients
+    # (propriétés mises en cache) par les clients partagés, adossés aux pools HTTP communs
+    shared_client = get_anthropic_client()
+    shared_async_client = get_async_anthropic_client()
+    llm.__dict__["_client"] = shared_client
+    llm.__dict__["_async_client"] = shared_async_client
+    # Dépend du fonctionnement interne de langchain-anthropic (version épinglée dans
+    # requirements.txt) : une version qui ignorerait ces clients est détectée ici
+    if llm._client is not shared_client or llm._async_client is not shared_async_client:
+        raise RuntimeError(
+            "ChatAnthropic n'utilise pas les clients HTTP partagés : "
+            "version de langchain-anthropic incompatible avec services/langchain_service.py"
+        )
     
     prompt_template = ChatPromptTemplate.from_messages([
         ("system", """Tu es un expert senior en cybersécurité spécialisé en modélisation des menaces applicatives.
         
 RÈGLES CRITIQUES DE FILTRAGE :
 1. **FILTRAGE PAR TYPE D'APPLICATION** : Tu DOIS ignorer complètement les menaces qui ne sont PAS pertinentes pour le type d'application spécifié.
-2. **EXTRACTION DES RECOMMANDATIONS** : Extrais les recommandations directement des champs "Recommandation de mitigation" du contexte RAG.
+2. **EXTRACTION DES RECOMMANDATIONS** : Extrais les recommandations directement des champs "Mitigation" du contexte RAG.
 3. **QUALITÉ** : Chaque recommandation doit être claire, actionnable et spécifique.
 4. **FORMAT** : Réponds uniquement avec un JSON valide, aucune phrase hors JSON."""),
         ("human", """MENACES POTENTIELLES (extraits du CSV) :
@@ -67,36 +88,60 @@ FORMAT STRICT JSON (OBLIGATOIRE) :
     
     return chain
 
+_chain = None
+_chain_lock = threading.Lock()
+
+def get_threat_analysis_chain():
+    """
+    Retourne la chaîne d'analyse, construite une seule fois (client et prompt réutilisés)
+    """
+    global _chain
+    if _chain is None:
+        with _chain_lock:
+            if _chain is None:
+                _chain = create_threat_analysis_chain()
+    return _chain
+
+def parse_chain_output(result: str) -> dict:
+    """
+    Convertit la sortie texte de la chaîne en dictionnaire
+    (blocs markdown, texte autour du JSON, virgules finales et réponse tronquée réparés)
+    """
+    return parse_llm_json(result)
+
+@cached_analysis(LANGCHAIN_MODEL, PROMPT_VERSION)
 def analyze_with_langchain(rag_context: str, user_input: str) -> dict:
     """
     Analyse de menaces utilisant LangChain pour l'orchestration
     """
     try:
-        chain = create_threat_analysis_chain()
+        chain = get_threat_analysis_chain()
         
         result = chain.invoke({
             "rag_context": rag_context,
             "user_input": user_input
         })
         
-        # Parser le JSON
-        result = result.strip()
-        
-        # Nettoyer le résultat (enlever markdown si présent)
-        if result.startswith("```json"):
-            result = result[7:]
-        if result.startswith("```"):
-            result = result[3:]
-        if result.endswith("```"):
-            result = result[:-3]
-        result = result.strip()
-        
-        return json.loads(result)
-    except json.JSONDecodeError as e:
+        return parse_chain_output(result)
+    except Exception as e:
         return {
-            "error": "JSON invalide retourné par le modèle",
-            "raw_response": result if 'result' in locals() else ""
+            "error": f"Erreur lors de l'analyse: {str(e)}"
         }
+
+@cached_analysis(LANGCHAIN_MODEL, PROMPT_VERSION)
+async def analyze_with_langchain_async(rag_context: str, user_input: str) -> dict:
+    """
+    Version asynchrone de analyze_with_langchain (chain.ainvoke)
+    """
+    try:
+        chain = get_threat_analysis_chain()
+        
+        result = await chain.ainvoke({
+            "rag_context": rag_context,
+            "user_input": user_input
+        })
+        
+        return parse_chain_output(result)
     except Exception as e:
         return {
             "error": f"Erreur lors de l'analyse: {str(e)}"
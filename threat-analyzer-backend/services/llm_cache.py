@@ -0,0 +1,136 @@
+"""
+Cache des réponses LLM (analyse de menaces)
+La clé est un hash du modèle, de la version du gabarit de prompt, du contexte RAG
+et de l'entrée utilisateur : une analyse relancée à l'identique (réouverture
+d'un résultat, nouvelle tentative après une erreur PDF) ne refait pas d'appel à Claude.
+Les réponses en erreur et les analyses partielles (réponse tronquée, réparée)
+ne sont jamais mises en cache.
+"""
+import contextvars
+import copy
+import functools
+import hashlib
+import inspect
+import os
+import threading
+from typing import Callable, Dict, Optional
+
+from dotenv import load_dotenv
+
+from services.cache_service import LRUCache, SQLiteCache
+
+load_dotenv()
+
+# Backend du cache : memory, sqlite ou none (désactivé)
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "memory").lower()
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "256"))
+# Durée de vie des réponses en secondes (0 = sans expiration)
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+
+_cache = None
+_cache_lock = threading.Lock()
+_counters = {"stored": 0, "skipped_errors": 0, "skipped_truncated": 0}
+# Réponses servies par le cache dans le contexte courant (tâche asyncio) :
+# permet à l'appelant de distinguer un appel au modèle d'une réponse en cache
+_context_hits = contextvars.ContextVar("llm_cache_context_hits", default=0)
+
+def context_cache_hits() -> int:
+    """
+    Nombre de réponses trouvées par lookup_analysis (décorateur, streaming)
+    dans le contexte courant (à comparer avant / après un appel)
+    """
+    return _context_hits.get()
+
+def get_llm_cache():
+    """
+    Retourne le cache partagé (créé au premier appel), None si désactivé
+    """
+    global _cache
+    if LLM_CACHE_BACKEND == "none":
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                if LLM_CACHE_BACKEND == "sqlite":
+                    _cache = SQLiteCache(LLM_CACHE_PATH, max_entries=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL)
+                else:
+                    _cache = LRUCache(max_entries=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL)
+    return _cache
+
+def make_llm_cache_key(model: str, prompt_version: str, rag_context: str, user_input: str) -> str:
+    digest = hashlib.sha256()
+    for part in (model, prompt_version, rag_context, user_input):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+def lookup_analysis(model: str, prompt_version: str, rag_context: str, user_input: str):
+    """
+    Retourne (clé, analyse en cache ou None) ; clé None si le cache est désactivé
+    """
+    cache = get_llm_cache()
+    if cache is None:
+        return None, None
+    key = make_llm_cache_key(model, prompt_version, rag_context, user_input)
+    cached = cache.get(key)
+    if cached is not None:
+        _context_hits.set(_context_hits.get() + 1)
+    return key, copy.deepcopy(cached) if cached is not None else None
+
+def store_analysis(key: Optional[str], result):
+    """
+    Met en cache une analyse réussie (les réponses en erreur ou tronquées sont ignorées)
+    """
+    if key is None:
+        return
+    if isinstance(result, dict) and result.get("truncated"):
+        # Une nouvelle tentative peut obtenir l'analyse complète
+        _counters["skipped_truncated"] += 1
+    elif isinstance(result, dict) and "error" not in result:
+        get_llm_cache().set(key, copy.deepcopy(result))
+        _counters["stored"] += 1
+    else:
+        _counters["skipped_errors"] += 1
+
+def cached_analysis(model: str, prompt_version: str) -> Callable:
+    """
+    Décorateur pour les fonctions analyze_*(rag_context, user_input) -> dict
+    (synchrones ou async ; les deux variantes d'un service partagent les entrées)
+    Le résultat est copié à l'entrée et à la sortie du cache : l'appelant peut
+    enrichir les menaces retournées sans modifier l'entrée mise en cache
+    """
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(rag_context: str, user_input: str) -> dict:
+                key, cached = lookup_analysis(model, prompt_version, rag_context, user_input)
+                if cached is not None:
+                    return cached
+                result = await func(rag_context, user_input)
+                store_analysis(key, result)
+                return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(rag_context: str, user_input: str) -> dict:
+            key, cached = lookup_analysis(model, prompt_version, rag_context, user_input)
+            if cached is not None:
+                return cached
+            result = func(rag_context, user_input)
+            store_analysis(key, result)
+            return result
+
+        return wrapper
+    return decorator
+
+def clear_llm_cache():
+    cache = get_llm_cache()
+    if cache is not None:
+        cache.clear()
+
+def get_llm_cache_stats() -> Dict:
+    cache = get_llm_cache()
+    if cache is None:
+        return {"backend": "none"}
+    return {**cache.stats(), **_counters}
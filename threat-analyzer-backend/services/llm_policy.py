@@ -0,0 +1,300 @@
+"""
+Politique d'exécution des appels LLM
+- hedging : si le chemin principal (LangChain) n'a pas répondu après un délai
+  calé sur son p95, le chemin de secours (Claude direct) est lancé en parallèle ;
+  la première réponse valide l'emporte, l'autre appel est annulé
+- circuit breaker : un chemin qui échoue de façon répétée est ignoré pendant
+  un temps, puis réessayé avec un seul appel de test
+- statistiques de latence et d'erreurs par chemin
+- streaming : le premier fragment passe par le circuit breaker du chemin, avec
+  repli sur l'exécution complète (hedging) si le flux ne peut pas démarrer
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from services.llm_cache import context_cache_hits
+from services.metrics_service import LatencyStats
+
+load_dotenv()
+
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true"
+# Percentile de latence du chemin principal au-delà duquel le secours est lancé
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+# Bornes du délai de hedging (secondes) et délai utilisé tant que les mesures sont trop peu nombreuses
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "2"))
+LLM_HEDGE_MAX_DELAY = float(os.getenv("LLM_HEDGE_MAX_DELAY", "60"))
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "20"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Circuit breaker : échecs consécutifs avant ouverture, durée d'ouverture (secondes)
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+
+AnalyzeFunc = Callable[[str, str], Awaitable[dict]]
+StreamFunc = Callable[[str, str], AsyncIterator[str]]
+
+class CircuitBreaker:
+    """
+    closed : appels autorisés ; open : appels refusés jusqu'à reset_timeout ;
+    half_open : un seul appel de test, qui referme ou rouvre le circuit
+    """
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURES, reset_timeout: float = LLM_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probe_running = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probe_running:
+                self._probe_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self._probe_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probe_running = False
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.times_opened += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        # Appel annulé (perdant d'un hedge) : ni succès ni échec
+        with self._lock:
+            self._probe_running = False
+
+    def stats(self) -> Dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened
+        }
+
+class LLMPath:
+    """
+    Un chemin d'analyse (fonction async) avec ses statistiques et son circuit breaker
+    """
+
+    def __init__(self, name: str, func: AnalyzeFunc):
+        self.name = name
+        self.func = func
+        self.latency = LatencyStats()
+        self.breaker = CircuitBreaker()
+        self.skipped = 0
+        self.cancelled = 0
+        self.cache_hits = 0
+        self.wins = 0
+
+    def hedge_delay(self) -> float:
+        if self.latency.count < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_DEFAULT_DELAY
+        delay = self.latency.percentile(LLM_HEDGE_PERCENTILE) / 1000
+        return min(LLM_HEDGE_MAX_DELAY, max(LLM_HEDGE_MIN_DELAY, delay))
+
+    async def call(self, rag_context: str, user_input: str) -> dict:
+        start = time.perf_counter()
+        hits = context_cache_hits()
+        try:
+            result = await self.func(rag_context, user_input)
+        except asyncio.CancelledError:
+            # Durée tronquée par l'annulation : pas de mesure (elle abaisserait le p95)
+            self.cancelled += 1
+            self.breaker.release()
+            raise
+        except Exception as e:
+            result = {"error": f"Erreur {self.name}: {str(e)}"}
+
+        if context_cache_hits() > hits:
+            # Réponse en cache : ni mesure de latence du modèle, ni indication sur sa santé
+            self.cache_hits += 1
+            self.breaker.release()
+            return result
+
+        failed = not isinstance(result, dict) or "error" in result
+        self.latency.record((time.perf_counter() - start) * 1000, error=failed)
+        if failed:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return result
+
+    def stats(self) -> Dict:
+        return {
+            **self.latency.stats(),
+            "hedge_delay_s": round(self.hedge_delay(), 3),
+            "breaker": self.breaker.stats(),
+            "skipped_by_breaker": self.skipped,
+            "cancelled": self.cancelled,
+            "cache_hits": self.cache_hits,
+            "wins": self.wins
+        }
+
+class LLMExecutionPolicy:
+    """
+    Exécute une analyse sur une liste ordonnée de chemins (principal, secours...)
+    """
+
+    def __init__(self, paths: List[Tuple[str, AnalyzeFunc]], hedging: bool = LLM_HEDGE_ENABLED):
+        self.paths = [LLMPath(name, func) for name, func in paths]
+        self.hedging = hedging
+        self.hedges_started = 0
+        self.calls = 0
+        self.streams = 0
+        self.stream_fallbacks = 0
+
+    def _path(self, name: str) -> LLMPath:
+        for path in self.paths:
+            if path.name == name:
+                return path
+        raise ValueError(f"Chemin LLM inconnu: {name}")
+
+    def _available_paths(self) -> List[LLMPath]:
+        available = []
+        for path in self.paths:
+            if path.breaker.allow():
+                available.append(path)
+            else:
+                path.skipped += 1
+        # Tous les circuits ouverts : on tente quand même, dans l'ordre
+        return available or list(self.paths)
+
+    async def run(self, rag_context: str, user_input: str) -> dict:
+        """
+        Retourne la première réponse valide ; sinon la dernière erreur obtenue
+        """
+        self.calls += 1
+        pending_paths = self._available_paths()
+        running: Dict[asyncio.Task, LLMPath] = {}
+        last_error: Optional[dict] = None
+
+        def start_next() -> bool:
+            if not pending_paths:
+                return False
+            path = pending_paths.pop(0)
+            running[asyncio.create_task(path.call(rag_context, user_input))] = path
+            return True
+
+        start_next()
+        try:
+            while running:
+                # Délai de hedging du chemin le plus récemment lancé
+                timeout = None
+                if self.hedging and pending_paths:
+                    timeout = list(running.values())[-1].hedge_delay()
+
+                done, _ = await asyncio.wait(running.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    # Pas de réponse dans le délai : on lance le chemin suivant en parallèle
+                    self.hedges_started += 1
+                    start_next()
+                    continue
+
+                for task in done:
+                    path = running.pop(task)
+                    result = task.result()
+                    if "error" not in result:
+                        path.wins += 1
+                        return result
+                    last_error = result
+
+                # Échec : chemin suivant immédiatement (s'il n'est pas déjà lancé)
+                if not running:
+                    start_next()
+        finally:
+            for task in running:
+                task.cancel()
+            for path in pending_paths:
+                path.breaker.release()
+
+        return last_error or {"error": "Aucun chemin LLM disponible"}
+
+    async def stream(self, path_name: str, stream_func: StreamFunc,
+                     rag_context: str, user_input: str) -> AsyncIterator[str]:
+        """
+        Analyse en streaming sur le chemin path_name, sous son circuit breaker
+        - circuit ouvert ou échec avant le premier fragment : repli sur run()
+          (tous les chemins, hedging), la réponse est produite en un seul fragment
+        - échec après le premier fragment : échec du chemin, l'erreur est propagée
+        """
+        path = self._path(path_name)
+        self.streams += 1
+
+        if path.breaker.allow():
+            start = time.perf_counter()
+            hits = context_cache_hits()
+            fragments = stream_func(rag_context, user_input)
+            try:
+                first = await fragments.__anext__()
+            except asyncio.CancelledError:
+                path.breaker.release()
+                await fragments.aclose()
+                raise
+            except Exception as e:
+                print(f"Erreur {path.name} (streaming) avant le premier fragment: {str(e)}")
+                path.latency.record((time.perf_counter() - start) * 1000, error=True)
+                path.breaker.record_failure()
+            else:
+                try:
+                    yield first
+                    async for text in fragments:
+                        yield text
+                except (GeneratorExit, asyncio.CancelledError):
+                    # Flux abandonné par le client : ni succès ni échec
+                    path.cancelled += 1
+                    path.breaker.release()
+                    raise
+                except Exception:
+                    path.latency.record((time.perf_counter() - start) * 1000, error=True)
+                    path.breaker.record_failure()
+                    raise
+                finally:
+                    await fragments.aclose()
+                if context_cache_hits() > hits:
+                    # Réponse en cache produite en un fragment : pas de mesure
+                    path.cache_hits += 1
+                    path.breaker.release()
+                    return
+                path.latency.record((time.perf_counter() - start) * 1000)
+                path.breaker.record_success()
+                path.wins += 1
+                return
+        else:
+            path.skipped += 1
+
+        self.stream_fallbacks += 1
+        result = await self.run(rag_context, user_input)
+        yield json.dumps(result, ensure_ascii=False)
+
+    def stats(self) -> Dict:
+        return {
+            "hedging": self.hedging,
+            "calls": self.calls,
+            "hedges_started": self.hedges_started,
+            "streams": self.streams,
+            "stream_fallbacks": self.stream_fallbacks,
+            "paths": {path.name: path.stats() for path in self.paths}
+        }
@@ -1,22 +1,27 @@
-import os
 import json
-from anthropic import Anthropic
+from typing import AsyncIterator
 from dotenv import load_dotenv
 
+from services.http_pool import get_anthropic_client, get_async_anthropic_client
+from services.json_repair import parse_llm_json
+from services.llm_cache import cached_analysis, lookup_analysis, store_analysis
+
 # Charger les variables d'environnement
 load_dotenv()
 
-client = Anthropic(
-    api_key=os.getenv("ANTHROPIC_API_KEY")
-)
+# Client partagé : connexions keep-alive réutilisées d'une analyse à l'autre
+client = get_anthropic_client()
+async_client = get_async_anthropic_client()
 
-def analyze_with_claude(rag_context: str, user_input: str) -> dict:
+CLAUDE_MODEL = "claude-3-haiku-20240307"
+# À incrémenter à chaque modification du prompt : invalide les réponses en cache
+PROMPT_VERSION = "claude-2"
+
+def build_prompt(rag_context: str, user_input: str) -> str:
     """
-    Analyse de menaces basée sur un RAG
-    Retourne TOUJOURS un dictionnaire Python
+    Prompt d'analyse (partagé par les versions synchrone et asynchrone)
     """
-
-    prompt = f"""
+    return f"""
 Tu es un expert senior en cybersécurité spécialisé en modélisation des menaces applicatives.
 
 MENACES POTENTIELLES (extraits du CSV - certaines peuvent ne pas être pertinentes) :
@@ -59,7 +64,7 @@ RÈGLES CRITIQUES DE FILTRAGE :
    - Si c'est une API : IGNORE les menaces spécifiques aux interfaces utilisateur web ou mobiles
    - Ne garde QUE les menaces dont l'architecture_description correspond au type d'application
 
-2. **EXTRACTION DES RECOMMANDATIONS** : Extrais les recommandations directement des champs "Recommandation de mitigation" du contexte RAG
+2. **EXTRACTION DES RECOMMANDATIONS** : Extrais les recommandations directement des champs "Mitigation" du contexte RAG
 3. **SÉPARATION DES RECOMMANDATIONS** : Si plusieurs recommandations sont présentes, sépare-les en éléments distincts du tableau
 4. **QUALITÉ DES RECOMMANDATIONS** : Chaque recommandation doit être claire, actionnable et spécifique
 5. **GRAVITÉ** : Utilise la gravité exacte du CSV (Critique, HAUTE, MOYENNE, Faible) - normalise HAUTE en "Élevée"
@@ -68,21 +73,57 @@ RÈGLES CRITIQUES DE FILTRAGE :
 EXEMPLE : Si le type d'application est "mobile" et qu'une menace parle de "Application web avec authentification utilisateur et base de données MySQL", IGNORE cette menace car elle n'est pas pertinente pour une application mobile.
 """
 
+def parse_response(raw_text: str) -> dict:
+    """
+    Convertit la réponse texte du modèle en dictionnaire
+    (texte autour du JSON, virgules finales et réponse tronquée réparés)
+    """
+    return parse_llm_json(raw_text, "JSON invalide retourné par Claude")
+
+@cached_analysis(CLAUDE_MODEL, PROMPT_VERSION)
+def analyze_with_claude(rag_context: str, user_input: str) -> dict:
+    """
+    Analyse de menaces basée sur un RAG
+    Retourne TOUJOURS un dictionnaire Python
+    """
     response = client.messages.create(
-        model="claude-3-haiku-20240307",
+        model=CLAUDE_MODEL,
         max_tokens=4000,
-        messages=[{"role": "user", "content": prompt}]
+        messages=[{"role": "user", "content": build_prompt(rag_context, user_input)}]
     )
+    return parse_response(response.content[0].text)
 
-    raw_text = response.content[0].text.strip()
+@cached_analysis(CLAUDE_MODEL, PROMPT_VERSION)
+async def analyze_with_claude_async(rag_context: str, user_input: str) -> dict:
+    """
+    Version asynchrone de analyze_with_claude (ne bloque pas l'event loop)
+    """
+    response = await async_client.messages.create(
+        model=CLAUDE_MODEL,
+        max_tokens=4000,
+        messages=[{"role": "user", "content": build_prompt(rag_context, user_input)}]
+    )
+    return parse_response(response.content[0].text)
 
-    if not raw_text:
-        return {"error": "Réponse vide du modèle"}
+async def stream_claude_async(rag_context: str, user_input: str) -> AsyncIterator[str]:
+    """
+    Analyse en streaming : produit le texte du modèle au fil de la génération
+    Une réponse déjà en cache est produite en un seul fragment ; une réponse
+    complète et valide est mise en cache à la fin du flux
+    """
+    key, cached = lookup_analysis(CLAUDE_MODEL, PROMPT_VERSION, rag_context, user_input)
+    if cached is not None:
+        yield json.dumps(cached, ensure_ascii=False)
+        return
+
+    fragments = []
+    async with async_client.messages.stream(
+        model=CLAUDE_MODEL,
+        max_tokens=4000,
+        messages=[{"role": "user", "content": build_prompt(rag_context, user_input)}]
+    ) as stream:
+        async for text in stream.text_stream:
+            fragments.append(text)
+            yield text
 
-    try:
-        return json.loads(raw_text)
-    except json.JSONDecodeError:
-        return {
-            "error": "JSON invalide retourné par Claude",
-            "raw_response": raw_text
-        }
+    store_analysis(key, parse_response("".join(fragments)))
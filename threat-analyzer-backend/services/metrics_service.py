@@ -0,0 +1,47 @@
+"""
+Service de métriques en mémoire (latences et compteurs)
+Les statistiques portent sur une fenêtre glissante des derniers appels
+"""
+import threading
+from collections import deque
+from typing import Dict
+
+class LatencyStats:
+    """
+    Latences (en ms) et erreurs d'une étape, sur une fenêtre glissante
+    """
+
+    def __init__(self, window: int = 500):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+
+    def record(self, duration_ms: float, error: bool = False):
+        with self._lock:
+            self._samples.append(duration_ms)
+            self.count += 1
+            self.total_ms += duration_ms
+            if error:
+                self.errors += 1
+
+    def percentile(self, pct: float) -> float:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return 0.0
+        index = min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            samples = list(self._samples)
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50), 3),
+            "p95_ms": round(self.percentile(95), 3),
+            "max_ms": round(max(samples), 3) if samples else 0.0
+        }
@@ -0,0 +1,217 @@
+"""
+Catalogue MITRE ATT&CK construit depuis le bundle STIX Enterprise local
+(https://github.com/mitre-attack/attack-stix-data : enterprise-attack.json)
+- lu une seule fois, réduit à un index technique / sous-technique -> nom,
+  tactiques, plateformes, description courte, mitigations
+- sérialisé dans un fichier cache (pickle) rechargé en quelques millisecondes ;
+  reconstruit automatiquement quand le bundle change
+- aucun appel réseau : le bundle est téléchargé hors ligne et référencé par MITRE_ATTACK_BUNDLE
+"""
+import json
+import os
+import pickle
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MITRE_ATTACK_BUNDLE = os.getenv("MITRE_ATTACK_BUNDLE", "enterprise-attack.json")
+MITRE_CATALOG_CACHE = os.getenv("MITRE_CATALOG_CACHE", "mitre_catalog.pickle")
+
+_CITATION = re.compile(r"\s*\(Citation:[^)]*\)")
+_MARKDOWN_LINK = re.compile(r"\[([^\]]+)\]\([^)]+\)")
+
+def normalize_technique_id(technique_id: str) -> str:
+    return technique_id.strip().upper()
+
+def _external_id(stix_object: Dict):
+    for reference in stix_object.get("external_references", []):
+        if reference.get("source_name") == "mitre-attack" and reference.get("external_id"):
+            return reference["external_id"], reference.get("url", "")
+    return None, ""
+
+def _short_description(text: str) -> str:
+    # Premier paragraphe, sans les références bibliographiques ni la syntaxe des liens
+    paragraph = (text or "").strip().split("\n\n")[0]
+    paragraph = _MARKDOWN_LINK.sub(r"\1", _CITATION.sub("", paragraph))
+    return " ".join(paragraph.split())
+
+def _is_active(stix_object: Dict) -> bool:
+    return not stix_object.get("revoked") and not stix_object.get("x_mitre_deprecated")
+
+def build_catalog(bundle: Dict) -> Dict:
+    """
+    Index compact du bundle STIX : techniques (actives), alias des techniques
+    révoquées vers leur remplaçante, version ATT&CK
+    """
+    objects = bundle.get("objects", [])
+    by_ref = {stix_object.get("id"): stix_object for stix_object in objects}
+
+    tactics = {
+        stix_object.get("x_mitre_shortname"): stix_object.get("name", "")
+        for stix_object in objects
+        if stix_object.get("type") == "x-mitre-tactic" and _is_active(stix_object)
+    }
+
+    techniques = {}
+    for stix_object in objects:
+        if stix_object.get("type") != "attack-pattern" or not _is_active(stix_object):
+            continue
+        technique_id, url = _external_id(stix_object)
+        if not technique_id:
+            continue
+        phases = [
+            phase.get("phase_name") for phase in stix_object.get("kill_chain_phases", [])
+            if phase.get("kill_chain_name") == "mitre-attack"
+        ]
+        techniques[technique_id] = {
+            "id": technique_id,
+            "name": stix_object.get("name", ""),
+            "description": _short_description(stix_object.get("description", "")),
+            "tactics": [tactics.get(phase, phase) for phase in phases],
+            "platforms": stix_object.get("x_mitre_platforms", []),
+            "is_subtechnique": bool(stix_object.get("x_mitre_is_subtechnique")),
+            "mitigations": [],
+            "url": url
+        }
+
+    aliases = {}
+    for relation in objects:
+        if relation.get("type") != "relationship" or not _is_active(relation):
+            continue
+        source = by_ref.get(relation.get("source_ref"), {})
+        target = by_ref.get(relation.get("target_ref"), {})
+        source_id, _ = _external_id(source)
+        target_id, _ = _external_id(target)
+        if not source_id or not target_id:
+            continue
+        if relation.get("relationship_type") == "mitigates" and source.get("type") == "course-of-action":
+            if target_id in techniques and _is_active(source):
+                techniques[target_id]["mitigations"].append({"id": source_id, "name": source.get("name", "")})
+        elif relation.get("relationship_type") == "revoked-by" and source.get("type") == "attack-pattern":
+            # Ancien identifiant encore cité par le référentiel ou le LLM
+            aliases[source_id] = target_id
+
+    for technique in techniques.values():
+        technique["mitigations"].sort(key=lambda mitigation: mitigation["id"])
+
+    version = next(
+        (stix_object.get("x_mitre_version") for stix_object in objects
+         if stix_object.get("type") == "x-mitre-collection"),
+        None
+    )
+    return {
+        "techniques": techniques,
+        "aliases": {old: new for old, new in aliases.items() if old not in techniques},
+        "attack_version": version
+    }
+
+class MitreCatalog:
+    """
+    Recherche O(1) d'une technique (identifiant normalisé, alias des techniques révoquées)
+    """
+    # À incrémenter quand le format du catalogue change (invalide les caches existants)
+    FORMAT_VERSION = 1
+
+    def __init__(self, catalog: Dict, source: Dict, load_seconds: float = 0.0, from_cache: bool = False):
+        self.techniques = catalog["techniques"]
+        self.aliases = catalog["aliases"]
+        self.attack_version = catalog["attack_version"]
+        self.source = source
+        self.load_seconds = load_seconds
+        self.from_cache = from_cache
+
+    def get(self, technique_id: str) -> Optional[Dict]:
+        technique_id = normalize_technique_id(technique_id)
+        technique = self.techniques.get(technique_id)
+        if technique is None and technique_id in self.aliases:
+            technique = self.techniques.get(self.aliases[technique_id])
+        return technique
+
+    def __len__(self) -> int:
+        return len(self.techniques)
+
+    def stats(self) -> Dict:
+        return {
+            "attack_version": self.attack_version,
+            "techniques": sum(1 for technique in self.techniques.values() if not technique["is_subtechnique"]),
+            "subtechniques": sum(1 for technique in self.techniques.values() if technique["is_subtechnique"]),
+            "aliases": len(self.aliases),
+            "source": self.source,
+            "from_cache": self.from_cache,
+            "load_ms": round(self.load_seconds * 1000, 2)
+        }
+
+def _bundle_signature(path: str) -> Optional[Dict]:
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime}
+
+def _load_cache(path: str):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            version, source, catalog = pickle.load(f)
+    except Exception as e:
+        print(f"Cache du catalogue MITRE illisible ({path}): {e}")
+        return None
+    if version != MitreCatalog.FORMAT_VERSION:
+        return None
+    return source, catalog
+
+def _save_cache(path: str, source: Dict, catalog: Dict):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump((MitreCatalog.FORMAT_VERSION, source, catalog), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+def load_mitre_catalog(bundle_path: str = MITRE_ATTACK_BUNDLE,
+                       cache_path: str = MITRE_CATALOG_CACHE) -> Optional[MitreCatalog]:
+    """
+    Charge le catalogue depuis le cache s'il correspond au bundle (ou si le bundle
+    est absent), sinon le reconstruit depuis le bundle ; None si ni l'un ni l'autre
+    """
+    start = time.perf_counter()
+    signature = _bundle_signature(bundle_path)
+    cached = _load_cache(cache_path)
+    if cached is not None and (signature is None or cached[0] == signature):
+        source, catalog = cached
+        return MitreCatalog(catalog, source, time.perf_counter() - start, from_cache=True)
+    if signature is None:
+        return None
+
+    with open(bundle_path, "r", encoding="utf-8") as f:
+        catalog = build_catalog(json.load(f))
+    try:
+        _save_cache(cache_path, signature, catalog)
+    except OSError as e:
+        print(f"Impossible d'écrire le cache du catalogue MITRE ({cache_path}): {e}")
+    print(f"✓ Catalogue MITRE ATT&CK construit : {len(catalog['techniques'])} techniques")
+    return MitreCatalog(catalog, signature, time.perf_counter() - start)
+
+_catalog = None
+_catalog_loaded = False
+_catalog_lock = threading.Lock()
+
+def get_mitre_catalog() -> Optional[MitreCatalog]:
+    """
+    Catalogue partagé (chargé au premier appel) ; None si aucun bundle ni cache
+    """
+    global _catalog, _catalog_loaded
+    if not _catalog_loaded:
+        with _catalog_lock:
+            if not _catalog_loaded:
+                try:
+                    _catalog = load_mitre_catalog()
+                except Exception as e:
+                    print(f"Erreur lors du chargement du catalogue MITRE: {e}")
+                    _catalog = None
+                _catalog_loaded = True
+    return _catalog
@@ -1,27 +1,48 @@
 """
 Service pour enrichir les données avec des informations MITRE ATT&CK
+Source : catalogue construit depuis le bundle STIX local (services/mitre_catalog.py),
+sinon table réduite des techniques les plus courantes
 """
-import requests
 from typing import Optional, Dict
 
+from services.mitre_catalog import get_mitre_catalog
+
+def technique_url(technique_id: str) -> str:
+    # T1059.001 -> https://attack.mitre.org/techniques/T1059/001/
+    return f"https://attack.mitre.org/techniques/{technique_id.replace('.', '/')}/"
+
 def get_mitre_technique_info(technique_id: str) -> Optional[Dict]:
     """
     Récupère des informations sur une technique MITRE ATT&CK
-    Note: Utilise l'API publique MITRE ATT&CK si disponible
-    Sinon retourne des informations basiques basées sur l'ID
+    Catalogue local (bundle STIX) si disponible, sinon informations basiques basées sur l'ID
     """
     if not technique_id or technique_id == "N/A":
         return None
     
     # Nettoyer l'ID (enlever les espaces, etc.)
     technique_id = technique_id.strip().upper()
+
+    catalog = get_mitre_catalog()
+    technique = catalog.get(technique_id) if catalog is not None else None
+    if technique is not None:
+        return {
+            "id": technique["id"],
+            "name": technique["name"],
+            "description": technique["description"],
+            "url": technique["url"] or technique_url(technique["id"]),
+            "tactic": ", ".join(technique["tactics"]) or "Unknown",
+            "tactics": list(technique["tactics"]),
+            "platforms": list(technique["platforms"]),
+            "mitigations": [dict(mitigation) for mitigation in technique["mitigations"]],
+            "is_subtechnique": technique["is_subtechnique"]
+        }
     
     # Informations basiques basées sur les IDs communs
     mitre_info = {
         "id": technique_id,
         "name": "",
         "description": "",
-        "url": f"https://attack.mitre.org/techniques/{technique_id.replace('T', '')}"
+        "url": technique_url(technique_id)
     }
     
     # Mapping étendu de techniques MITRE ATT&CK communes
@@ -68,14 +89,6 @@ def get_mitre_technique_info(technique_id: str) -> Optional[Dict]:
         mitre_info["description"] = technique_descriptions.get(technique_id, f"Technique MITRE ATT&CK {technique_id}")
         mitre_info["tactic"] = get_tactic_for_technique(technique_id)
     
-    # Essayer de récupérer depuis l'API MITRE (si disponible)
-    try:
-        # L'API MITRE ATT&CK Enterprise nécessite souvent une clé API
-        # Pour l'instant, on retourne les infos basiques
-        pass
-    except Exception as e:
-        print(f"Erreur lors de la récupération MITRE: {e}")
-    
     return mitre_info
 
 def get_tactic_for_technique(technique_id: str) -> str:
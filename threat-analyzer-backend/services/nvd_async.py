@@ -0,0 +1,273 @@
+"""
+Enrichissement CVE asynchrone et concurrent de toutes les menaces d'une analyse
+- recherches dédupliquées sur l'ensemble des menaces (même nom, même CWE : une requête)
+- cache des recherches (services/cve_cache.py) consulté avant tout appel
+- un limiteur unique (token bucket) dimensionné sur le quota publié par la NVD :
+  5 requêtes / 30 s, 50 / 30 s avec une clé d'API (NVD_API_KEY)
+- client httpx.AsyncClient partagé (keep-alive), nouvel essai avec backoff
+  exponentiel sur 403 / 429 / 503 (quota dépassé, service surchargé)
+La durée d'enrichissement tend vers (requêtes uniques hors cache / débit autorisé)
+au lieu de la somme des latences de chaque menace.
+"""
+import asyncio
+import os
+import random
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+
+from services.cve_cache import get_cve_cache
+from services.nvd_mirror import parse_cve_record
+from services.nvd_service import (
+    NVD_API_BASE, NVD_SOURCE, NVDAPIError, cwe_cache_key, keyword_cache_key, merge_threat_cves,
+    public_cve_fields, run_cve_query, threat_cve_queries, use_mirror
+)
+
+load_dotenv()
+
+NVD_API_KEY = os.getenv("NVD_API_KEY") or None
+# Quota NVD : NVD_RATE_LIMIT requêtes par fenêtre glissante de NVD_RATE_WINDOW secondes
+NVD_RATE_LIMIT = int(os.getenv("NVD_RATE_LIMIT", "50" if NVD_API_KEY else "5"))
+NVD_RATE_WINDOW = float(os.getenv("NVD_RATE_WINDOW", "30"))
+# Rafale autorisée ; le débit de remplissage est réduit d'autant (rafale + débit x fenêtre <= quota)
+NVD_RATE_BURST = int(os.getenv("NVD_RATE_BURST", str(max(1, NVD_RATE_LIMIT // 5))))
+NVD_MAX_RETRIES = int(os.getenv("NVD_MAX_RETRIES", "3"))
+NVD_RETRY_BACKOFF = float(os.getenv("NVD_RETRY_BACKOFF", "2"))
+NVD_HTTP_TIMEOUT = float(os.getenv("NVD_HTTP_TIMEOUT", "10"))
+NVD_HTTP_MAX_CONNECTIONS = int(os.getenv("NVD_HTTP_MAX_CONNECTIONS", "10"))
+# Attente maximale de l'enrichissement (secondes) ; les recherches restantes
+# se terminent en arrière-plan et alimentent le cache pour les analyses suivantes
+NVD_ENRICH_TIMEOUT = float(os.getenv("NVD_ENRICH_TIMEOUT", "20"))
+
+# Statuts NVD à retenter : 403 (quota dépassé), 429, 503 (surcharge)
+RETRY_STATUSES = {403, 429, 503}
+
+class AsyncTokenBucket:
+    """
+    Token bucket asynchrone : `capacity` jetons au plus, `rate` jetons par seconde
+    Les appelants sont servis dans l'ordre d'arrivée
+    Le quota est partagé par tout le processus ; le verrou asyncio, lié à un
+    event loop, est recréé si l'event loop change (comme le client HTTP)
+    """
+
+    def __init__(self, capacity: int, rate: float):
+        self.capacity = max(1, capacity)
+        self.rate = rate
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = None
+        self._lock_loop = None
+        self.acquired = 0
+        self.waited_seconds = 0.0
+
+    def _loop_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+        return self._lock
+
+    async def acquire(self):
+        async with self._loop_lock():
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.acquired += 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+                self.waited_seconds += wait
+                await asyncio.sleep(wait)
+
+    def stats(self) -> Dict:
+        return {
+            "capacity": self.capacity,
+            "rate_per_second": round(self.rate, 4),
+            "tokens": round(min(self.capacity, self.tokens + (time.monotonic() - self.updated) * self.rate), 2),
+            "acquired": self.acquired,
+            "waited_seconds": round(self.waited_seconds, 2)
+        }
+
+_bucket = AsyncTokenBucket(
+    NVD_RATE_BURST,
+    max(1, NVD_RATE_LIMIT - NVD_RATE_BURST) / NVD_RATE_WINDOW
+)
+_client = None
+_client_loop = None
+_background_tasks = set()
+_counters = {
+    "enrichments": 0,
+    "queries": 0,
+    "unique_queries": 0,
+    "api_requests": 0,
+    "retries": 0,
+    "failures": 0,
+    "deferred": 0
+}
+
+def get_nvd_async_client() -> httpx.AsyncClient:
+    """
+    Client HTTP asynchrone partagé vers la NVD (recréé si l'event loop change)
+    """
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=NVD_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=NVD_HTTP_MAX_CONNECTIONS
+            ),
+            timeout=NVD_HTTP_TIMEOUT,
+            headers={"apiKey": NVD_API_KEY} if NVD_API_KEY else None
+        )
+        _client_loop = loop
+    return _client
+
+def _retry_delay(attempt: int, retry_after: Optional[str]) -> float:
+    delay = NVD_RETRY_BACKOFF * (2 ** attempt) + random.uniform(0, NVD_RETRY_BACKOFF)
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, float(retry_after))
+    return delay
+
+async def _fetch_nvd_async(params: Dict) -> Dict:
+    client = get_nvd_async_client()
+    for attempt in range(NVD_MAX_RETRIES + 1):
+        await _bucket.acquire()
+        _counters["api_requests"] += 1
+        retry_after = None
+        try:
+            response = await client.get(NVD_API_BASE, params=params)
+        except httpx.HTTPError as e:
+            error = NVDAPIError(f"Erreur réseau NVD: {e}")
+        else:
+            if response.status_code == 200:
+                return response.json()
+            error = NVDAPIError(f"Erreur API NVD: {response.status_code}")
+            if response.status_code not in RETRY_STATUSES:
+                raise error
+            retry_after = response.headers.get("Retry-After")
+
+        if attempt == NVD_MAX_RETRIES:
+            raise error
+        _counters["retries"] += 1
+        await asyncio.sleep(_retry_delay(attempt, retry_after))
+
+async def search_cve_by_keyword_async(keyword: str, limit: int = 5) -> List[Dict]:
+    """
+    Recherche NVD par mot-clé (lève NVDAPIError en cas d'échec)
+    """
+    return _cves_from_response(await _fetch_nvd_async({"keywordSearch": keyword, "resultsPerPage": limit}))
+
+async def search_cves_by_cwe_async(cwe_id: str, limit: int = 5) -> List[Dict]:
+    """
+    CVE dont la faiblesse déclarée est cwe_id (lève NVDAPIError en cas d'échec)
+    """
+    return _cves_from_response(await _fetch_nvd_async({"cweId": cwe_id, "resultsPerPage": limit}))
+
+def _cves_from_response(data: Dict) -> List[Dict]:
+    return [
+        public_cve_fields(parse_cve_record(vuln.get('cve', {})))
+        for vuln in data.get('vulnerabilities', [])
+    ]
+
+def _query_api(query: Tuple[str, str, int]) -> Tuple[str, Callable[[], Awaitable[List[Dict]]]]:
+    kind, value, limit = query
+    if kind == "cwe":
+        return cwe_cache_key(value, limit), lambda: search_cves_by_cwe_async(value, limit)
+    return keyword_cache_key(value, limit), lambda: search_cve_by_keyword_async(value, limit)
+
+async def _fetch_into_cache(cache, key: str, fetch) -> Tuple[List[Dict], bool]:
+    try:
+        value = await fetch()
+    except Exception as e:
+        _counters["failures"] += 1
+        print(f"Erreur lors de la recherche CVE ({key}): {e}")
+        if cache is not None:
+            cache.set_error(key, [])
+        return [], False
+    if cache is not None:
+        cache.set(key, value, "ok" if value else "negative")
+    return value, True
+
+async def _refresh(cache, key: str, fetch):
+    _, succeeded = await _fetch_into_cache(cache, key, fetch)
+    cache.end_refresh(key, failed=not succeeded)
+
+def _run_in_background(coroutine) -> asyncio.Task:
+    task = asyncio.create_task(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+async def cached_query_async(query: Tuple[str, str, int]) -> List[Dict]:
+    """
+    Recherche ("keyword" / "cwe", valeur, limite) via le cache : entrée fraîche,
+    entrée expirée (rafraîchie en arrière-plan) ou appel à l'API
+    """
+    cache = get_cve_cache()
+    key, fetch = _query_api(query)
+    if cache is not None:
+        value, state = cache.get(key)
+        if state == "fresh":
+            return value
+        if state == "stale":
+            if cache.begin_refresh(key):
+                _run_in_background(_refresh(cache, key, fetch))
+            return value
+    value, _ = await _fetch_into_cache(cache, key, fetch)
+    return value
+
+async def search_queries_async(queries: List[Tuple[str, str, int]]) -> Dict[Tuple[str, str, int], List[Dict]]:
+    """
+    Exécute des recherches distinctes (voir threat_cve_queries) en parallèle
+    Les recherches non terminées après NVD_ENRICH_TIMEOUT retournent [] pour cette analyse
+    """
+    if not queries:
+        return {}
+    if NVD_SOURCE == "local" or use_mirror():
+        # Miroir local : quelques millisecondes par recherche, sans limite de débit
+        return await asyncio.to_thread(
+            lambda: {query: run_cve_query(query) for query in queries}
+        )
+
+    tasks = {query: _run_in_background(cached_query_async(query)) for query in queries}
+    done, pending = await asyncio.wait(tasks.values(), timeout=NVD_ENRICH_TIMEOUT)
+    _counters["deferred"] += len(pending)
+    return {
+        query: task.result() if task in done else []
+        for query, task in tasks.items()
+    }
+
+async def enrich_menaces_with_cves(menaces: List[Dict]) -> List[Dict]:
+    """
+    Ajoute les CVE liées (champ "cves") à toutes les menaces d'une analyse
+    """
+    per_menace = [
+        threat_cve_queries(menace.get("nom", ""), menace.get("cwe_id", ""))
+        for menace in menaces
+    ]
+    unique_queries = list(dict.fromkeys(query for queries in per_menace for query in queries))
+    _counters["enrichments"] += 1
+    _counters["queries"] += sum(len(queries) for queries in per_menace)
+    _counters["unique_queries"] += len(unique_queries)
+
+    results = await search_queries_async(unique_queries)
+    for menace, queries in zip(menaces, per_menace):
+        cves = merge_threat_cves([results[query] for query in queries])
+        if cves:
+            menace["cves"] = cves
+    return menaces
+
+def get_enrichment_stats() -> Dict:
+    return {
+        "source": NVD_SOURCE,
+        "api_key": bool(NVD_API_KEY),
+        "rate_limit": f"{NVD_RATE_LIMIT}/{NVD_RATE_WINDOW:g}s",
+        **_counters,
+        "background_tasks": len(_background_tasks),
+        "bucket": _bucket.stats()
+    }
@@ -0,0 +1,321 @@
+"""
+Miroir local de la NVD (SQLite + index plein texte FTS5)
+Les fichiers de flux NVD JSON 2.0 (nvdcve-2.0-*.json[.gz]) sont chargés par
+ingest_nvd.py ; l'enrichissement CVE interroge ensuite ce miroir sans appel
+réseau (quelques millisecondes, fonctionne hors ligne).
+Un index inversé CWE -> CVE (les N meilleures CVE de chaque CWE, par score CVSS
+puis date de publication) est précalculé à l'ingestion et chargé en mémoire.
+"""
+import gzip
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+NVD_MIRROR_PATH = os.getenv("NVD_MIRROR_PATH", "nvd_mirror.sqlite3")
+# Nombre de CVE conservées par CWE dans l'index précalculé
+NVD_CWE_INDEX_TOP_N = int(os.getenv("NVD_CWE_INDEX_TOP_N", "20"))
+
+_CWE_PATTERN = re.compile(r"^CWE-(\d+)$", re.IGNORECASE)
+_CWE_NUMBER = re.compile(r"(\d+)")
+_CVE_COLUMNS = "c.id, c.description, c.cvss_score, c.severity, c.published"
+# Classement des CVE d'une CWE : score CVSS puis publication, décroissants (sans score en dernier)
+_CWE_RANKING = "c.cvss_score IS NULL, c.cvss_score DESC, c.published DESC"
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS cves ("
+    "id TEXT PRIMARY KEY, description TEXT NOT NULL, cvss_score REAL, "
+    "severity TEXT, published TEXT, last_modified TEXT)",
+    "CREATE TABLE IF NOT EXISTS cve_cwes ("
+    "cve_id TEXT NOT NULL, cwe_id TEXT NOT NULL, PRIMARY KEY (cve_id, cwe_id))",
+    "CREATE INDEX IF NOT EXISTS cve_cwes_cwe ON cve_cwes(cwe_id)",
+    # Index plein texte des descriptions : rowid = rowid de la CVE dans cves
+    "CREATE VIRTUAL TABLE IF NOT EXISTS cves_fts USING fts5(description)",
+    "CREATE TABLE IF NOT EXISTS cwe_top_cves ("
+    "cwe_id TEXT NOT NULL, rank INTEGER NOT NULL, cve_id TEXT NOT NULL, PRIMARY KEY (cwe_id, rank))",
+    "CREATE TABLE IF NOT EXISTS ingest_log ("
+    "source TEXT PRIMARY KEY, records INTEGER NOT NULL, ingested_at REAL NOT NULL)",
+]
+
+def parse_cve_record(cve_data: Dict) -> Dict:
+    """
+    Extrait d'un objet "cve" NVD 2.0 (API ou flux) : description anglaise,
+    score et sévérité CVSS (v3.1, sinon v3.0, sinon v2), CWE et dates
+    """
+    cve_id = cve_data.get('id', '')
+
+    description = ''
+    for desc in cve_data.get('descriptions', []):
+        if desc.get('lang') == 'en':
+            description = desc.get('value', '')
+            break
+
+    metrics = cve_data.get('metrics', {})
+    cvss_score = None
+    severity = None
+    for version in ('cvssMetricV31', 'cvssMetricV30', 'cvssMetricV2'):
+        if metrics.get(version):
+            metric = metrics[version][0]
+            cvss_score = metric.get('cvssData', {}).get('baseScore')
+            # En v2 la sévérité est portée par la métrique, pas par cvssData
+            severity = metric.get('cvssData', {}).get('baseSeverity') or metric.get('baseSeverity')
+            break
+
+    cwes = []
+    for weakness in cve_data.get('weaknesses', []):
+        for desc in weakness.get('description', []):
+            value = desc.get('value', '').upper()
+            # "NVD-CWE-Other" / "NVD-CWE-noinfo" ignorés
+            if _CWE_PATTERN.match(value) and value not in cwes:
+                cwes.append(value)
+
+    return {
+        'id': cve_id,
+        'description': description,
+        'cvss_score': cvss_score,
+        'severity': severity,
+        'published': cve_data.get('published'),
+        'last_modified': cve_data.get('lastModified'),
+        'cwes': cwes,
+        'url': f"https://nvd.nist.gov/vuln/detail/{cve_id}"
+    }
+
+def iter_feed_records(path: str) -> Iterator[Dict]:
+    """
+    Parcourt un fichier de flux NVD JSON 2.0 (éventuellement compressé en .gz)
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as feed:
+        data = json.load(feed)
+    for vuln in data.get('vulnerabilities', []):
+        cve_data = vuln.get('cve')
+        if cve_data and cve_data.get('id'):
+            yield parse_cve_record(cve_data)
+
+def normalize_cwe_id(cwe_id: str) -> Optional[str]:
+    """
+    "CWE-89", "cwe-89" ou "89" -> "CWE-89" ; None si aucun numéro
+    """
+    match = _CWE_NUMBER.search(cwe_id or "")
+    return f"CWE-{int(match.group(1))}" if match else None
+
+def _row_to_cve(row) -> Dict:
+    cve_id, description, cvss_score, severity, published = row
+    return {
+        'id': cve_id,
+        'description': description,
+        'cvss_score': cvss_score,
+        'severity': severity,
+        'published': published,
+        'url': f"https://nvd.nist.gov/vuln/detail/{cve_id}"
+    }
+
+def _fts_query(keyword: str) -> str:
+    # Chaque mot entre guillemets : pas d'opérateur FTS5 involontaire (AND, NEAR, "-"...)
+    return " ".join(f'"{token}"' for token in _TOKEN_PATTERN.findall(keyword))
+
+class NVDMirror:
+    """
+    Accès au miroir SQLite ; une connexion partagée protégée par un verrou
+    """
+
+    def __init__(self, path: str = NVD_MIRROR_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # Index CWE -> CVE en mémoire, rechargé quand un autre processus modifie la base
+        self._cwe_index = None
+        self._cwe_index_version = None
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            for statement in _SCHEMA:
+                self._conn.execute(statement)
+
+    def ingest(self, records: Iterable[Dict], source: str = "", batch_size: int = 2000) -> int:
+        """
+        Insère ou met à jour des CVE (format parse_cve_record) ; retourne le nombre traité
+        """
+        count = 0
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                count += self._ingest_batch(batch)
+                batch = []
+        if batch:
+            count += self._ingest_batch(batch)
+        if source:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO ingest_log (source, records, ingested_at) VALUES (?, ?, ?)",
+                    (source, count, time.time())
+                )
+        return count
+
+    def _ingest_batch(self, records: List[Dict]) -> int:
+        ids = [(record['id'],) for record in records]
+        with self._lock, self._conn:
+            # Une CVE peut figurer dans plusieurs flux (année + "modified") : la dernière lue l'emporte
+            self._conn.executemany(
+                "DELETE FROM cves_fts WHERE rowid = (SELECT rowid FROM cves WHERE id = ?)", ids
+            )
+            self._conn.executemany("DELETE FROM cve_cwes WHERE cve_id = ?", ids)
+            # Mise à jour en place : le rowid de la CVE (clé de l'index plein texte) est conservé
+            self._conn.executemany(
+                "INSERT INTO cves (id, description, cvss_score, severity, published, last_modified) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET "
+                "description = excluded.description, cvss_score = excluded.cvss_score, "
+                "severity = excluded.severity, published = excluded.published, "
+                "last_modified = excluded.last_modified",
+                [(r['id'], r['description'], r['cvss_score'], r['severity'], r['published'], r['last_modified'])
+                 for r in records]
+            )
+            self._conn.executemany(
+                "INSERT INTO cves_fts (rowid, description) SELECT rowid, description FROM cves WHERE id = ?",
+                ids
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO cve_cwes (cve_id, cwe_id) VALUES (?, ?)",
+                [(r['id'], cwe) for r in records for cwe in r['cwes']]
+            )
+        return len(records)
+
+    def build_cwe_index(self, top_n: int = NVD_CWE_INDEX_TOP_N) -> int:
+        """
+        Précalcule les top_n CVE de chaque CWE (à relancer après chaque ingestion) ;
+        retourne le nombre de CWE indexées
+        """
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cwe_top_cves")
+            self._conn.execute(
+                "INSERT INTO cwe_top_cves (cwe_id, rank, cve_id) "
+                "SELECT cwe_id, rank, cve_id FROM ("
+                "SELECT w.cwe_id, w.cve_id, "
+                f"ROW_NUMBER() OVER (PARTITION BY w.cwe_id ORDER BY {_CWE_RANKING}) AS rank "
+                "FROM cve_cwes w JOIN cves c ON c.id = w.cve_id) WHERE rank <= ?",
+                (top_n,)
+            )
+            self._cwe_index = None
+            return self._conn.execute("SELECT COUNT(DISTINCT cwe_id) FROM cwe_top_cves").fetchone()[0]
+
+    def _current_cwe_index(self) -> Dict[str, List[Dict]]:
+        # À appeler sous self._lock ; data_version change quand une autre connexion écrit
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if self._cwe_index is None or version != self._cwe_index_version:
+            index = {}
+            rows = self._conn.execute(
+                f"SELECT t.cwe_id, {_CVE_COLUMNS} FROM cwe_top_cves t "
+                "JOIN cves c ON c.id = t.cve_id ORDER BY t.cwe_id, t.rank"
+            ).fetchall()
+            for row in rows:
+                index.setdefault(row[0], []).append(_row_to_cve(row[1:]))
+            self._cwe_index = index
+            self._cwe_index_version = version
+        return self._cwe_index
+
+    def cwe_cves(self, cwe_id: str, limit: int = 5) -> List[Dict]:
+        """
+        Meilleures CVE déclarées pour une CWE : lecture de l'index en mémoire
+        (requête sur cve_cwes si l'index n'a pas encore été construit)
+        """
+        cwe_id = normalize_cwe_id(cwe_id)
+        if cwe_id is None:
+            return []
+        with self._lock:
+            index = self._current_cwe_index()
+            if index:
+                return [dict(cve) for cve in index.get(cwe_id, [])[:limit]]
+            rows = self._conn.execute(
+                f"SELECT {_CVE_COLUMNS} FROM cve_cwes w JOIN cves c ON c.id = w.cve_id "
+                f"WHERE w.cwe_id = ? ORDER BY {_CWE_RANKING} LIMIT ?",
+                (cwe_id, limit)
+            ).fetchall()
+        return [_row_to_cve(row) for row in rows]
+
+    def search(self, keyword: str, limit: int = 5) -> List[Dict]:
+        """
+        Équivalent local de keywordSearch : "CWE-NNN" lit l'index CWE -> CVE,
+        sinon recherche plein texte (BM25)
+        """
+        keyword = keyword.strip()
+        if _CWE_PATTERN.match(keyword):
+            return self.cwe_cves(keyword, limit)
+
+        query = _fts_query(keyword)
+        if not query:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {_CVE_COLUMNS} "
+                "FROM cves_fts JOIN cves c ON c.rowid = cves_fts.rowid WHERE cves_fts MATCH ? "
+                "ORDER BY bm25(cves_fts) LIMIT ?",
+                (query, limit)
+            ).fetchall()
+        return [_row_to_cve(row) for row in rows]
+
+    def get(self, cve_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, description, cvss_score, severity, published FROM cves WHERE id = ?",
+                (cve_id.strip().upper(),)
+            ).fetchone()
+        return _row_to_cve(row) if row else None
+
+    def has_data(self) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM cves LIMIT 1").fetchone() is not None
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cves").fetchone()[0]
+
+    def optimize(self):
+        # Fusion des segments FTS5 après une ingestion volumineuse
+        with self._lock, self._conn:
+            self._conn.execute("INSERT INTO cves_fts (cves_fts) VALUES ('optimize')")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            cves = self._conn.execute("SELECT COUNT(*) FROM cves").fetchone()[0]
+            cwes = self._conn.execute("SELECT COUNT(DISTINCT cwe_id) FROM cve_cwes").fetchone()[0]
+            indexed_cwes, top_n = self._conn.execute(
+                "SELECT COUNT(DISTINCT cwe_id), MAX(rank) FROM cwe_top_cves"
+            ).fetchone()
+            latest = self._conn.execute("SELECT MAX(last_modified) FROM cves").fetchone()[0]
+            sources = self._conn.execute(
+                "SELECT source, records, ingested_at FROM ingest_log ORDER BY ingested_at"
+            ).fetchall()
+        return {
+            "path": self.path,
+            "cves": cves,
+            "cwes": cwes,
+            "cwe_index": {"cwes": indexed_cwes, "top_n": top_n},
+            "latest_modification": latest,
+            "sources": [
+                {"source": source, "records": records, "ingested_at": ingested_at}
+                for source, records, ingested_at in sources
+            ]
+        }
+
+_mirror = None
+_mirror_lock = threading.Lock()
+
+def get_nvd_mirror() -> Optional[NVDMirror]:
+    """
+    Miroir partagé (ouvert au premier appel) ; None si le fichier n'existe pas encore
+    """
+    global _mirror
+    if _mirror is None:
+        with _mirror_lock:
+            if _mirror is None and os.path.exists(NVD_MIRROR_PATH):
+                _mirror = NVDMirror(NVD_MIRROR_PATH)
+    return _mirror
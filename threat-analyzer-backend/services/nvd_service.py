@@ -2,141 +2,180 @@
 Service pour intégrer l'API NVD (National Vulnerability Database)
 Récupère des informations sur les vulnérabilités CVE
 """
+import os
 import requests
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Tuple
 import time
 
+from dotenv import load_dotenv
+
+from services.nvd_mirror import get_nvd_mirror, normalize_cwe_id, parse_cve_record
+from services.cve_cache import cached_cve_lookup
+
+load_dotenv()
+
 NVD_API_BASE = "https://services.nvd.nist.gov/rest/json/cves/2.0"
+# Source des CVE : local (miroir seul, hors ligne), api (NVD en ligne)
+# ou auto (miroir s'il a été alimenté par ingest_nvd.py, sinon API)
+NVD_SOURCE = os.getenv("NVD_SOURCE", "auto").lower()
+
+_missing_mirror_reported = False
+
+def use_mirror() -> bool:
+    global _missing_mirror_reported
+    if NVD_SOURCE == "api":
+        return False
+    mirror = get_nvd_mirror()
+    if NVD_SOURCE == "local":
+        if mirror is None and not _missing_mirror_reported:
+            print("Miroir NVD absent : lancer ingest_nvd.py (NVD_SOURCE=local)")
+            _missing_mirror_reported = True
+        return mirror is not None
+    return mirror is not None and mirror.has_data()
+
+def public_cve_fields(record: Dict) -> Dict:
+    return {
+        'id': record['id'],
+        'description': record['description'],
+        'cvss_score': record['cvss_score'],
+        'severity': record['severity'],
+        'url': record['url']
+    }
+
+def normalize_keyword(keyword: str) -> str:
+    return " ".join(keyword.lower().split())
+
+def keyword_cache_key(keyword: str, limit: int) -> str:
+    return f"search:{normalize_keyword(keyword)}:{limit}"
+
+def cwe_cache_key(cwe_id: str, limit: int) -> str:
+    return f"cwe:{cwe_id}:{limit}"
+
+class NVDAPIError(Exception):
+    """
+    Échec d'un appel à l'API NVD (réseau, statut HTTP inattendu)
+    """
+
+def _fetch_nvd(params: Dict) -> Dict:
+    # L'API NVD nécessite un rate limiting
+    time.sleep(0.6)  # Respecter le rate limit (50 requêtes par 30 secondes)
+
+    # Paramètres encodés par requests (mots-clés avec espaces, "&", "#"...)
+    response = requests.get(NVD_API_BASE, params=params, timeout=10)
+    if response.status_code != 200:
+        raise NVDAPIError(f"Erreur API NVD: {response.status_code}")
+    return response.json()
+
+def _search_api(keyword: str, limit: int) -> List[Dict]:
+    return _cves_from_response(_fetch_nvd({"keywordSearch": keyword, "resultsPerPage": limit}))
+
+def _search_cwe_api(cwe_id: str, limit: int) -> List[Dict]:
+    # Filtre cweId : CVE dont la faiblesse déclarée est cette CWE (et non la mention "CWE-NNN" dans le texte)
+    return _cves_from_response(_fetch_nvd({"cweId": cwe_id, "resultsPerPage": limit}))
+
+def _cves_from_response(data: Dict) -> List[Dict]:
+    return [
+        public_cve_fields(parse_cve_record(vuln.get('cve', {})))
+        for vuln in data.get('vulnerabilities', [])
+    ]
+
+def _get_api(cve_id: str) -> Optional[Dict]:
+    data = _fetch_nvd({"cveId": cve_id})
+    if data.get('vulnerabilities'):
+        return public_cve_fields(parse_cve_record(data['vulnerabilities'][0].get('cve', {})))
+    return None
 
 def search_cve_by_keyword(keyword: str, limit: int = 5) -> List[Dict]:
     """
-    Recherche des CVE par mot-clé
+    Recherche des CVE par mot-clé (miroir local en priorité, voir NVD_SOURCE)
+    Les réponses de l'API sont mises en cache (voir services/cve_cache.py)
     """
     try:
-        # L'API NVD nécessite un rate limiting
-        time.sleep(0.6)  # Respecter le rate limit (50 requêtes par 30 secondes)
-        
-        url = f"{NVD_API_BASE}?keywordSearch={keyword}&resultsPerPage={limit}"
-        response = requests.get(url, timeout=10)
-        
-        if response.status_code == 200:
-            data = response.json()
-            cves = []
-            
-            if 'vulnerabilities' in data:
-                for vuln in data['vulnerabilities']:
-                    cve_data = vuln.get('cve', {})
-                    cve_id = cve_data.get('id', '')
-                    
-                    # Extraire la description
-                    descriptions = cve_data.get('descriptions', [])
-                    description = ''
-                    for desc in descriptions:
-                        if desc.get('lang') == 'en':
-                            description = desc.get('value', '')
-                            break
-                    
-                    # Extraire le score CVSS
-                    metrics = cve_data.get('metrics', {})
-                    cvss_score = None
-                    severity = None
-                    
-                    if 'cvssMetricV31' in metrics:
-                        cvss_data = metrics['cvssMetricV31'][0]
-                        cvss_score = cvss_data.get('cvssData', {}).get('baseScore')
-                        severity = cvss_data.get('cvssData', {}).get('baseSeverity')
-                    elif 'cvssMetricV30' in metrics:
-                        cvss_data = metrics['cvssMetricV30'][0]
-                        cvss_score = cvss_data.get('cvssData', {}).get('baseScore')
-                        severity = cvss_data.get('cvssData', {}).get('baseSeverity')
-                    elif 'cvssMetricV2' in metrics:
-                        cvss_data = metrics['cvssMetricV2'][0]
-                        cvss_score = cvss_data.get('cvssData', {}).get('baseScore')
-                        severity = cvss_data.get('baseSeverity', '')
-                    
-                    cves.append({
-                        'id': cve_id,
-                        'description': description,
-                        'cvss_score': cvss_score,
-                        'severity': severity,
-                        'url': f"https://nvd.nist.gov/vuln/detail/{cve_id}"
-                    })
-            
-            return cves
-        else:
-            print(f"Erreur API NVD: {response.status_code}")
+        if use_mirror():
+            return [public_cve_fields(cve) for cve in get_nvd_mirror().search(keyword, limit)]
+        if NVD_SOURCE == "local":
             return []
+
+        key = keyword_cache_key(keyword, limit)
+        return cached_cve_lookup(key, lambda: _search_api(keyword, limit), empty=[])
     except Exception as e:
         print(f"Erreur lors de la recherche CVE: {e}")
         return []
 
+def search_cves_by_cwe(cwe_id: str, limit: int = 5) -> List[Dict]:
+    """
+    CVE associées à une CWE : index CWE -> CVE précalculé du miroir (CVSS puis date
+    décroissants), sinon filtre cweId de l'API NVD (mis en cache)
+    """
+    try:
+        cwe_id = normalize_cwe_id(cwe_id)
+        if cwe_id is None:
+            return []
+        if use_mirror():
+            return [public_cve_fields(cve) for cve in get_nvd_mirror().cwe_cves(cwe_id, limit)]
+        if NVD_SOURCE == "local":
+            return []
+
+        key = cwe_cache_key(cwe_id, limit)
+        return cached_cve_lookup(key, lambda: _search_cwe_api(cwe_id, limit), empty=[])
+    except Exception as e:
+        print(f"Erreur lors de la recherche CVE par CWE: {e}")
+        return []
+
 def get_cve_by_id(cve_id: str) -> Optional[Dict]:
     """
-    Récupère les détails d'un CVE spécifique
+    Récupère les détails d'un CVE spécifique (miroir local en priorité, voir NVD_SOURCE)
     """
     try:
-        time.sleep(0.6)  # Rate limiting
-        
-        url = f"{NVD_API_BASE}?cveId={cve_id}"
-        response = requests.get(url, timeout=10)
-        
-        if response.status_code == 200:
-            data = response.json()
-            if 'vulnerabilities' in data and len(data['vulnerabilities']) > 0:
-                vuln = data['vulnerabilities'][0]
-                cve_data = vuln.get('cve', {})
-                
-                descriptions = cve_data.get('descriptions', [])
-                description = ''
-                for desc in descriptions:
-                    if desc.get('lang') == 'en':
-                        description = desc.get('value', '')
-                        break
-                
-                metrics = cve_data.get('metrics', {})
-                cvss_score = None
-                severity = None
-                
-                if 'cvssMetricV31' in metrics:
-                    cvss_data = metrics['cvssMetricV31'][0]
-                    cvss_score = cvss_data.get('cvssData', {}).get('baseScore')
-                    severity = cvss_data.get('cvssData', {}).get('baseSeverity')
-                
-                return {
-                    'id': cve_id,
-                    'description': description,
-                    'cvss_score': cvss_score,
-                    'severity': severity,
-                    'url': f"https://nvd.nist.gov/vuln/detail/{cve_id}"
-                }
-        return None
+        if use_mirror():
+            cve = get_nvd_mirror().get(cve_id)
+            return public_cve_fields(cve) if cve else None
+        if NVD_SOURCE == "local":
+            return None
+
+        key = f"cve:{cve_id.strip().upper()}"
+        return cached_cve_lookup(key, lambda: _get_api(cve_id), empty=None)
     except Exception as e:
         print(f"Erreur lors de la récupération CVE: {e}")
         return None
 
-def enrich_threat_with_cve(threat_name: str, cwe_id: str = None) -> List[Dict]:
+def threat_cve_queries(threat_name: str, cwe_id: str = None) -> List[Tuple[str, str, int]]:
     """
-    Enrichit une menace avec des CVE associés
+    Recherches (type "keyword" ou "cwe", valeur, nombre de résultats) associées à une menace
     """
-    cves = []
-    
+    queries = []
     # Rechercher par nom de menace
     if threat_name:
-        threat_cves = search_cve_by_keyword(threat_name, limit=3)
-        cves.extend(threat_cves)
-    
-    # Rechercher par CWE si disponible
+        queries.append(("keyword", normalize_keyword(threat_name), 3))
+    # CVE déclarées pour la CWE si disponible
     if cwe_id and cwe_id != "N/A":
-        cwe_number = cwe_id.replace('CWE-', '')
-        cwe_cves = search_cve_by_keyword(f"CWE-{cwe_number}", limit=2)
-        cves.extend(cwe_cves)
-    
-    # Dédupliquer
+        cwe = normalize_cwe_id(cwe_id)
+        if cwe:
+            queries.append(("cwe", cwe, 2))
+    return queries
+
+def run_cve_query(query: Tuple[str, str, int]) -> List[Dict]:
+    kind, value, limit = query
+    if kind == "cwe":
+        return search_cves_by_cwe(value, limit)
+    return search_cve_by_keyword(value, limit)
+
+def merge_threat_cves(results: List[List[Dict]]) -> List[Dict]:
+    """
+    Fusionne les résultats des recherches d'une menace (dédupliqués, 5 CVE au plus)
+    """
     seen_ids = set()
     unique_cves = []
-    for cve in cves:
-        if cve['id'] not in seen_ids:
-            seen_ids.add(cve['id'])
-            unique_cves.append(cve)
-    
+    for cves in results:
+        for cve in cves:
+            if cve['id'] not in seen_ids:
+                seen_ids.add(cve['id'])
+                unique_cves.append(cve)
     return unique_cves[:5]  # Limiter à 5 CVE
+
+def enrich_threat_with_cve(threat_name: str, cwe_id: str = None) -> List[Dict]:
+    """
+    Enrichit une menace avec des CVE associés
+    (version asynchrone et concurrente pour toute une analyse : services/nvd_async.py)
+    """
+    return merge_threat_cves([run_cve_query(query) for query in threat_cve_queries(threat_name, cwe_id)])
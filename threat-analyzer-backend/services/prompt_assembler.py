@@ -0,0 +1,166 @@
+"""
+Assemblage du prompt d'analyse dans un budget de tokens
+- les menaces du RAG sont sérialisées de façon compacte (libellés courts,
+  champs N/A supprimés, menaces regroupées par architecture)
+- la description d'architecture et le fichier fourni sont tronqués (début + fin)
+  pour tenir dans le budget
+- le nombre de tokens de chaque section est rapporté
+"""
+import math
+import os
+import re
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Budget de tokens d'entrée (gabarit + contexte RAG + entrée utilisateur)
+PROMPT_INPUT_TOKEN_BUDGET = int(os.getenv("PROMPT_INPUT_TOKEN_BUDGET", "12000"))
+# Pas de tokenizer Claude local : estimation par caractères (texte français ~3,5 car./token)
+PROMPT_CHARS_PER_TOKEN = float(os.getenv("PROMPT_CHARS_PER_TOKEN", "3.5"))
+# Part maximale du budget disponible pour la description d'architecture
+ARCHITECTURE_BUDGET_SHARE = float(os.getenv("PROMPT_ARCHITECTURE_BUDGET_SHARE", "0.3"))
+# Part du budget disponible réservée au fichier fourni (s'il est assez long)
+FILE_MIN_BUDGET_SHARE = float(os.getenv("PROMPT_FILE_MIN_BUDGET_SHARE", "0.2"))
+
+# Libellés des documents du catalogue -> libellés compacts
+COMPACT_LABELS = OrderedDict([
+    ("Type de menace", "Menace"),
+    ("Gravité", "Gravité"),
+    ("Description", "Description"),
+    ("Impact", "Impact"),
+    ("Vecteur d'attaque", "Vecteur"),
+    ("Recommandation de mitigation", "Mitigation"),
+    ("CWE ID", "CWE"),
+    ("CVSS Score", "CVSS"),
+    ("MITRE ATT&CK", "MITRE"),
+    ("OWASP Category", "OWASP"),
+])
+
+_EMPTY_VALUES = {"", "n/a", "na", "nan", "none", "cwe-n/a", "-"}
+
+last_prompt_report: Dict = {}
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / PROMPT_CHARS_PER_TOKEN) if text else 0
+
+def _is_empty(value: str) -> bool:
+    return value.strip().lower() in _EMPTY_VALUES
+
+def parse_threat_document(document: str) -> Dict[str, str]:
+    """
+    Relit un document du catalogue ("Libellé: valeur" par ligne)
+    """
+    fields = {}
+    for line in document.splitlines():
+        label, sep, value = line.partition(":")
+        if sep and label.strip() and not _is_empty(value):
+            fields[label.strip()] = value.strip()
+    return fields
+
+def serialize_rag_context(documents: List[str]) -> str:
+    """
+    Sérialisation compacte des menaces : une ligne d'architecture par groupe,
+    une ligne par menace, sans les champs vides ou N/A
+    """
+    groups = OrderedDict()
+    for document in documents:
+        fields = parse_threat_document(document)
+        architecture = fields.get("Architecture", "")
+        parts = [f"{short}: {fields[label]}" for label, short in COMPACT_LABELS.items() if label in fields]
+        if parts:
+            groups.setdefault(architecture, []).append(" | ".join(parts))
+
+    blocks = []
+    for architecture, threats in groups.items():
+        lines = [f"Architecture: {architecture}"] if architecture else []
+        lines.extend(f"- {threat}" for threat in threats)
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
+
+def normalize_whitespace(text: str) -> str:
+    # Texte extrait des PDF : espaces multiples et lignes vides en série
+    text = re.sub(r"[ \t\f\v]+", " ", text)
+    text = re.sub(r" *\n[ \n]*\n", "\n\n", text)
+    return text.strip()
+
+def truncate_to_tokens(text: str, max_tokens: int, head_share: float = 0.7) -> Tuple[str, bool]:
+    """
+    Garde le début et la fin du texte (les conclusions des documents sont souvent à la fin)
+    Retourne (texte, tronqué ?)
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text, False
+    if max_tokens <= 0:
+        return "", bool(text)
+
+    marker = "\n[... {} caractères omis ...]\n"
+    max_chars = max(0, int(max_tokens * PROMPT_CHARS_PER_TOKEN) - len(marker.format(len(text))))
+    head = int(max_chars * head_share)
+    tail = max_chars - head
+    omitted = len(text) - head - tail
+    return text[:head] + marker.format(omitted) + (text[-tail:] if tail else ""), True
+
+def build_user_input(project_name: str, app_type: str, architecture_description: str, file_content: str) -> str:
+    return f"""
+Nom du projet : {project_name}
+Type d'application : {app_type}
+Architecture : {architecture_description}
+
+Fichier fourni :
+{file_content}
+"""
+
+def assemble_prompt(documents: List[str], project_name: str, app_type: str,
+                    architecture_description: str, file_content: str,
+                    template_tokens: int = 0, budget: Optional[int] = None) -> Tuple[str, str, Dict]:
+    """
+    Construit (rag_context, user_input, rapport) dans le budget de tokens
+    Priorités : architecture (plafonnée), puis menaces du RAG par ordre de pertinence,
+    puis fichier fourni (avec une part minimale réservée)
+    """
+    budget = budget or PROMPT_INPUT_TOKEN_BUDGET
+    available = max(0, budget - template_tokens - estimate_tokens(build_user_input(project_name, app_type, "", "")))
+
+    architecture, architecture_truncated = truncate_to_tokens(
+        normalize_whitespace(architecture_description),
+        int(available * ARCHITECTURE_BUDGET_SHARE)
+    )
+    available -= estimate_tokens(architecture)
+
+    file_text = normalize_whitespace(file_content)
+    file_reserved = min(estimate_tokens(file_text), int(available * FILE_MIN_BUDGET_SHARE))
+
+    # Menaces ajoutées par ordre de pertinence tant qu'elles tiennent
+    kept = []
+    for document in documents:
+        candidate = serialize_rag_context(kept + [document])
+        if kept and estimate_tokens(candidate) > available - file_reserved:
+            break
+        kept.append(document)
+    rag_context = serialize_rag_context(kept)
+    available -= estimate_tokens(rag_context)
+
+    file_text, file_truncated = truncate_to_tokens(file_text, available)
+    user_input = build_user_input(project_name, app_type, architecture, file_text)
+
+    report = {
+        "budget": budget,
+        "template": template_tokens,
+        "rag_context": estimate_tokens(rag_context),
+        "architecture": estimate_tokens(architecture),
+        "file": estimate_tokens(file_text),
+        "user_input": estimate_tokens(user_input),
+        "total": template_tokens + estimate_tokens(rag_context) + estimate_tokens(user_input),
+        "threats_kept": len(kept),
+        "threats_dropped": len(documents) - len(kept),
+        "rag_raw": estimate_tokens("\n\n".join(documents)),
+        "file_raw": estimate_tokens(file_content),
+        "architecture_truncated": architecture_truncated,
+        "file_truncated": file_truncated
+    }
+    last_prompt_report.clear()
+    last_prompt_report.update(report)
+    return rag_context, user_input, report
@@ -0,0 +1,70 @@
+"""
+Regroupement (single-flight) des exécutions identiques simultanées
+Quand plusieurs requêtes identiques arrivent pendant qu'une exécution est en
+cours (double soumission, équipe ouvrant le même projet), une seule exécution
+a lieu et toutes les requêtes en partagent le résultat.
+"""
+import asyncio
+import copy
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict
+
+def make_flight_key(*parts: Any) -> str:
+    """
+    Hash stable d'un ensemble de valeurs sérialisables en JSON
+    """
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class SingleFlight:
+    """
+    L'exécution tourne dans une tâche séparée : si la requête qui l'a lancée est
+    annulée (client déconnecté), les requêtes en attente obtiennent quand même le résultat
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.executions = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.max_waiters = 0
+        self._waiters: Dict[str, int] = {}
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Exécute func() une seule fois par clé à un instant donné ; chaque appelant
+        reçoit sa propre copie du résultat
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(func())
+            self._inflight[key] = task
+            self._waiters[key] = 1
+            self.executions += 1
+            task.add_done_callback(lambda done, key=key: self._finish(key, done))
+        else:
+            self.coalesced += 1
+            self._waiters[key] += 1
+            self.max_waiters = max(self.max_waiters, self._waiters[key])
+
+        result = await asyncio.shield(task)
+        return copy.deepcopy(result)
+
+    def _finish(self, key: str, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        self._waiters.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            self.errors += 1
+
+    def stats(self) -> Dict:
+        requests = self.executions + self.coalesced
+        return {
+            "requests": requests,
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "coalesced_rate": round(self.coalesced / requests, 3) if requests else 0.0,
+            "in_flight": len(self._inflight),
+            "max_waiters": self.max_waiters,
+            "errors": self.errors
+        }
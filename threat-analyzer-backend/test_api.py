@@ -5,6 +5,7 @@ Script de test simple pour vérifier que le backend fonctionne
 
 import requests
 import json
+import time
 
 BASE_URL = "http://localhost:8000"
 
@@ -40,8 +41,42 @@ def test_analyze():
     except Exception as e:
         print(f"  ✗ Erreur: {e}")
 
+def test_analyze_stream():
+    """Test de l'endpoint analyze en streaming (SSE)"""
+    print("\n✓ Test Analyze Stream Endpoint...")
+    try:
+        data = {
+            "project_name": "TestAppStream",
+            "app_type": "Web Application",
+            "architecture_description": "Microservices avec API REST"
+        }
+        
+        start = time.perf_counter()
+        first_threat = None
+        event = None
+        with requests.post(f"{BASE_URL}/analyze/stream", data=data, stream=True) as res:
+            print(f"  Status: {res.status_code}")
+            for line in res.iter_lines(decode_unicode=True):
+                if line.startswith("event: "):
+                    event = line[7:]
+                elif line.startswith("data: "):
+                    payload = json.loads(line[6:])
+                    if event == "menace":
+                        if first_threat is None:
+                            first_threat = time.perf_counter() - start
+                        print(f"  Menace: {payload.get('nom')}")
+                    elif event == "summary":
+                        print(f"  Score: {payload.get('score_risque')}")
+                    elif event == "error":
+                        print(f"  Error: {payload.get('error')}")
+        if first_threat is not None:
+            print(f"  Première menace après {first_threat:.2f}s, total {time.perf_counter() - start:.2f}s")
+    except Exception as e:
+        print(f"  ✗ Erreur: {e}")
+
 if __name__ == "__main__":
     print("=== TEST DU BACKEND ===")
     test_health()
     test_analyze()
+    test_analyze_stream()
     print("\n=== FIN DES TESTS ===")
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Test de concurrence de /analyze (backend lancé sur BASE_URL)
+N analyses simultanées doivent se terminer en ~ une latence d'analyse (et non N),
+et /health doit rester réactif pendant ce temps.
+
+Usage : python test_concurrency.py [N]
+"""
+
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BASE_URL = "http://localhost:8000"
+
+def run_analysis(index: int) -> float:
+    # Nom de projet unique : pas de réponse servie par le cache LLM
+    data = {
+        "project_name": f"ConcurrencyTest-{time.time_ns()}-{index}",
+        "app_type": "Web Application",
+        "architecture_description": "Microservices avec API REST et base PostgreSQL"
+    }
+    start = time.perf_counter()
+    res = requests.post(f"{BASE_URL}/analyze", data=data)
+    elapsed = time.perf_counter() - start
+    if "error" in res.json():
+        print(f"  ✗ Analyse {index}: {res.json()['error']}")
+    return elapsed
+
+def watch_health(stop: threading.Event, latencies: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            requests.get(f"{BASE_URL}/health", timeout=30)
+            latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            print(f"  ✗ Health: {e}")
+        time.sleep(0.2)
+
+def test_concurrency(n: int):
+    print(f"\n✓ Test de référence (1 analyse)...")
+    single = run_analysis(0)
+    print(f"  Latence d'une analyse: {single:.2f}s")
+
+    print(f"\n✓ Test {n} analyses simultanées...")
+    stop = threading.Event()
+    health_latencies = []
+    watcher = threading.Thread(target=watch_health, args=(stop, health_latencies))
+    watcher.start()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n) as executor:
+        durations = list(executor.map(run_analysis, range(1, n + 1)))
+    wall = time.perf_counter() - start
+
+    stop.set()
+    watcher.join()
+
+    print(f"  Durée totale: {wall:.2f}s (séquentiel ≈ {single * n:.2f}s)")
+    print(f"  Analyse la plus lente: {max(durations):.2f}s")
+    print(f"  Ratio durée totale / une analyse: {wall / single:.2f} (attendu ≈ 1, pas {n})")
+    if health_latencies:
+        print(f"  /health pendant la charge: max {max(health_latencies) * 1000:.0f} ms sur {len(health_latencies)} appels")
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print("=== TEST DE CONCURRENCE ===")
+    test_concurrency(n)
+    print("\n=== FIN DES TESTS ===")